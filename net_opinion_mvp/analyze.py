@@ -1,20 +1,62 @@
 # analyze.py — GPT APIでセンチメント(-1/0/+1)とトピックを返す実装（語句辞書は使わない）
-import os, json, time, math, re
-from typing import List, Dict
+import os, json, time, re, threading, logging
+from typing import List, Dict, Optional, Callable, Tuple, Iterator
+import numpy as np
 import pandas as pd
-
-try:
-    from openai import OpenAI
-except Exception as e:
-    raise RuntimeError("openai パッケージが見つかりません。`pip install openai` を実行してください。") from e
-
+from cache import ClassificationCache, prompt_version, context_key
+from dispatcher import RateLimiter, dispatch, retry_after_seconds
+from batching import count_tokens, pack_batches
+from dedup import collapse
+from retrieval import BM25Index, split_segments
+import rollup
+import telemetry
+
+# openai は最初の分類呼び出しで import する（キー未設定でも保存済みの結果は表示できるように）
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise ValueError("環境変数 OPENAI_API_KEY が未設定です。PowerShellで `$env:OPENAI_API_KEY = \"...\"` を実行してください。")
+
+# OFFLINE=1 なら API を呼ばず、保存済みの判定結果だけで表示する
+OFFLINE = os.environ.get("OFFLINE", "0") == "1"
 
 # 使用モデル（コスト・速度のバランスで小型を推奨）
 DEFAULT_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
 
+# 並列数・レート上限（RPM/TPM は 0 で無制限）
+OPENAI_CONCURRENCY = int(os.environ.get("OPENAI_CONCURRENCY", "4"))
+OPENAI_RPM = float(os.environ.get("OPENAI_RPM", "500"))
+OPENAI_TPM = float(os.environ.get("OPENAI_TPM", "200000"))
+OPENAI_MAX_RATE_LIMIT_RETRIES = int(os.environ.get("OPENAI_MAX_RATE_LIMIT_RETRIES", "6"))
+
+# 1リクエストあたりのトークン予算（入力は SYSTEM_PROMPT 込み）と、1件あたりの出力見込み
+BATCH_INPUT_TOKENS = int(os.environ.get("BATCH_INPUT_TOKENS", "8000"))
+BATCH_OUTPUT_TOKENS = int(os.environ.get("BATCH_OUTPUT_TOKENS", "2000"))
+BATCH_OUTPUT_PER_ITEM = int(os.environ.get("BATCH_OUTPUT_PER_ITEM", "24"))
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "80"))
+
+# 分類前の重複除去（完全重複は常に。ほぼ重複は MinHash/LSH で任意）
+DEDUP_NEAR = os.environ.get("DEDUP_NEAR", "0") == "1"
+DEDUP_NEAR_THRESHOLD = float(os.environ.get("DEDUP_NEAR_THRESHOLD", "0.8"))
+
+# GPT の前段に置くローカル分類器（distill.py で学習。確信度がしきい値以上のコメントは GPT に投げない）
+DISTILL_MODEL_PATH = os.environ.get(
+    "DISTILL_MODEL_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "distilled.pkl"),
+)
+DISTILL_THRESHOLD = float(os.environ.get("DISTILL_THRESHOLD", "0.9"))
+
+# 文字起こし要約で1リクエストに載せる最大トークン数（超える分はチャンクに分けて並列に要約）
+TRANSCRIPT_CHUNK_TOKENS = int(os.environ.get("TRANSCRIPT_CHUNK_TOKENS", "3000"))
+
+# 文脈再判定でバッチごとに添える文字起こしの区間（件数と1区間の文字数）
+RETRIEVAL_TOP_K = int(os.environ.get("RETRIEVAL_TOP_K", "4"))
+RETRIEVAL_SEGMENT_CHARS = int(os.environ.get("RETRIEVAL_SEGMENT_CHARS", "400"))
+
+# 分類リクエストの形式: json（既定）/ compact（入力は「id<TAB>本文」の行、出力は [id, sentiment, topic番号]）
+WIRE_FORMAT = os.environ.get("WIRE_FORMAT", "json")
+COMPACT_OUTPUT_PER_ITEM = int(os.environ.get("COMPACT_OUTPUT_PER_ITEM", "8"))
+
+# enrich_iter(): 1チャンクあたりの代表テキスト数（重複をまとめた後の件数）
+ENRICH_CHUNK_SIZE = int(os.environ.get("ENRICH_CHUNK_SIZE", "500"))
+
 TOPIC_LABELS = [
     "政策", "人格", "外交", "経済",
     "国会運営", "党派支持", "メディア", "倫理",
@@ -25,7 +67,7 @@ SYSTEM_PROMPT = (
     "You are a precise political stance classifier for Japanese YouTube comments. "
     "Your task is to determine the user's stance toward Prime Minister Sanae Takaichi. "
     "For each input text, return a JSON object with key `results`, containing an array aligned to inputs. "
-    "Each item MUST have: `sentiment` (integer -1/0/1) and `topic` "
+    "Each item MUST have: `id` (copied from the input item), `sentiment` (integer -1/0/1) and `topic` "
     "(one of: 政策, 人格, 外交, 経済, 国会運営, 党派支持, メディア, 倫理, その他). "
     "Output strictly valid JSON only, with no explanations.\n\n"
 
@@ -102,7 +144,7 @@ SYSTEM_PROMPT = (
     "=== OUTPUT FORMAT (strictly) ===\n"
     "Numbers MUST be plain integers -1, 0, or 1 (never use a leading plus sign like +1).\n"
     "Return a fully closed, valid JSON object on a single line. Do not stream or truncate.\n"
-    "{ \"results\": [ {\"sentiment\": -1|0|1, "
+    "{ \"results\": [ {\"id\": <input id>, \"sentiment\": -1|0|1, "
     "\"topic\": \"政策|人格|外交|経済|国会運営|党派支持|メディア|倫理|その他\"}, ... ] }\n\n"
 
     "=== EXAMPLES (in Japanese) ===\n"
@@ -117,8 +159,71 @@ SYSTEM_PROMPT = (
     "例8: 「彼女の態度は無理」(高市を指す文脈) → sentiment=-1, topic=人格\n"
 )
 
+# compact 形式の SYSTEM_PROMPT：判定ルールはそのまま、入出力の説明だけを差し替える
+_COMPACT_HEAD = (
+    "You are a precise political stance classifier for Japanese YouTube comments. "
+    "Your task is to determine the user's stance toward Prime Minister Sanae Takaichi. "
+    "Each input line is `<id>\\t<text>`. For every line return one tuple `[id, sentiment, topic_index]`.\n\n"
+)
+_COMPACT_FORMAT = (
+    "=== OUTPUT FORMAT (compact) ===\n"
+    "topic_index: " + ", ".join(f"{i}={t}" for i, t in enumerate(TOPIC_LABELS)) + "\n"
+    "sentiment is a plain integer -1, 0 or 1 (never +1).\n"
+    "Return one valid JSON object on a single line, with no spaces and no explanations:\n"
+    "{\"r\":[[<id>,<sentiment>,<topic_index>],...]}\n\n"
+)
+COMPACT_SYSTEM_PROMPT = (
+    _COMPACT_HEAD
+    + SYSTEM_PROMPT[SYSTEM_PROMPT.index("=== ENTITY DEFINITION ==="):SYSTEM_PROMPT.index("=== OUTPUT FORMAT")]
+    + _COMPACT_FORMAT
+    + SYSTEM_PROMPT[SYSTEM_PROMPT.index("=== EXAMPLES"):]
+)
+
 import re
 
+# プロンプト版（SYSTEM_PROMPT / TOPIC_LABELS のどちらかが変わるとキャッシュは無効化される）
+PROMPT_VERSION = prompt_version(SYSTEM_PROMPT, TOPIC_LABELS)
+# compact 形式の版（キャッシュの文脈に入れるので、COMPACT_SYSTEM_PROMPT が変わると compact 形式の分だけ無効になる）
+COMPACT_PROMPT_VERSION = prompt_version(COMPACT_SYSTEM_PROMPT, TOPIC_LABELS)
+
+# 分類結果キャッシュ（空文字を指定すると無効）
+CACHE_PATH = os.environ.get(
+    "CLASSIFY_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "classify.sqlite3"),
+)
+CACHE_MAX_ENTRIES = int(os.environ.get("CLASSIFY_CACHE_MAX_ENTRIES", "200000"))
+
+_cache: Optional[ClassificationCache] = None
+
+def get_cache() -> Optional[ClassificationCache]:
+    """
+    プロセス内で共有する分類キャッシュを返す（初回呼び出し時に生成）。
+    CLASSIFY_CACHE_PATH が空なら None（キャッシュ無効）。
+    """
+    global _cache
+    if not CACHE_PATH:
+        return None
+    if _cache is None:
+        _cache = ClassificationCache(CACHE_PATH, PROMPT_VERSION, max_entries=CACHE_MAX_ENTRIES)
+    return _cache
+
+_distilled = None
+_distilled_loaded = False
+
+def get_distilled():
+    """
+    ローカル分類器（distill.DistilledClassifier）を返す（初回呼び出し時に読み込み）。
+    DISTILL_MODEL_PATH が空・モデル未学習・scikit-learn 未導入・プロンプト版が違う場合は None。
+    """
+    global _distilled, _distilled_loaded
+    if not DISTILL_MODEL_PATH:
+        return None
+    if not _distilled_loaded:
+        from distill import load
+        _distilled = load(DISTILL_MODEL_PATH, prompt_version=PROMPT_VERSION)
+        _distilled_loaded = True
+    return _distilled
+
 # ポジ/ネガの手動救済キーワード
 _POS_PATTERNS = [
     r"高市.*(支持|応援|続投|続けて|総理に|なってほしい|推し|しか勝たん)",
@@ -160,6 +265,154 @@ def _heuristic_adjust_sentiment(text: str, s: int) -> int:
 
     return s
 
+def _noncapturing(pat: str) -> str:
+    """パターン内の (...) を (?:...) にする（str.contains がグループの警告を出さないように）"""
+    return re.sub(r"(?<!\\)\((?!\?)", "(?:", pat)
+
+# ルールを一度だけコンパイル（判定順 = _NEG_PATTERNS → _POS_PATTERNS）
+_RULES = [(f"neg{i}", -1, p) for i, p in enumerate(_NEG_PATTERNS)] + \
+         [(f"pos{i}", 1, p) for i, p in enumerate(_POS_PATTERNS)]
+_RULE_PATTERNS = {name: p for name, _, p in _RULES}
+# 「どれか1つでも一致するか」を1回の走査で見るための結合パターン（どのルールかは後で _RULE_RES で引く）
+_NEG_ANY_RE = re.compile("|".join(f"(?:{_noncapturing(p)})" for n, v, p in _RULES if v < 0))
+_POS_ANY_RE = re.compile("|".join(f"(?:{_noncapturing(p)})" for n, v, p in _RULES if v > 0))
+_RULE_RES = [(n, v, re.compile(_noncapturing(p))) for n, v, p in _RULES]
+
+def _heuristic_adjust_sentiment_series(texts: pd.Series, s: pd.Series) -> Tuple[pd.Series, pd.Series]:
+    """
+    _heuristic_adjust_sentiment の列単位版（結果は per-row 版と完全一致）。
+    返却: (補正後 sentiment, 発火したルールのパターン文字列 or None)
+    """
+    is_str = texts.map(lambda x: isinstance(x, str)).astype(bool)
+    t = texts.where(is_str, "").astype(str).str.replace(" ", "", regex=False).str.replace("　", "", regex=False)
+
+    neg = t.str.contains(_NEG_ANY_RE, regex=True).astype(bool) & is_str
+    pos = t.str.contains(_POS_ANY_RE, regex=True).astype(bool) & is_str & ~neg
+
+    adjusted = s.copy()
+    adjusted[neg] = -1
+    adjusted[pos] = 1
+
+    # どのルールが効いたか：発火した行だけに per-row 版と同じ順でルールを当て、最初の一致を取る
+    rule = pd.Series([None] * len(t), index=t.index, dtype=object)
+    for mask, kind in ((neg, -1), (pos, 1)):
+        rest = t[mask]
+        for name, v, rx in _RULE_RES:
+            if v != kind or rest.empty:
+                continue
+            hit = rest.str.contains(rx, regex=True).astype(bool)
+            rule.loc[hit.index[hit.to_numpy()]] = _RULE_PATTERNS[name]
+            rest = rest[~hit]
+    return adjusted, rule
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_client_lock = threading.Lock()
+_limiter = RateLimiter(rpm=OPENAI_RPM, tpm=OPENAI_TPM)
+
+def backend_available() -> bool:
+    """API を呼べる状態か（OFFLINE でなく、キーがあり、openai パッケージが入っている）。openai は import しない。"""
+    import importlib.util
+    return not OFFLINE and bool(OPENAI_API_KEY) and importlib.util.find_spec("openai") is not None
+
+def _get_client() -> "OpenAI":
+    """
+    全スレッドで共有する OpenAI クライアント（HTTP 接続はプールして使い回す）。
+    初回呼び出し時に openai を import して作る。
+    リトライは _chat_completion 側で制御するため SDK 内部のリトライは切る。
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                if OFFLINE:
+                    raise RuntimeError("オフラインモード（OFFLINE=1）では API を呼べません。")
+                if not OPENAI_API_KEY:
+                    raise ValueError("環境変数 OPENAI_API_KEY が未設定です。PowerShellで `$env:OPENAI_API_KEY = \"...\"` を実行してください。")
+                try:
+                    from openai import OpenAI
+                except Exception as e:
+                    raise RuntimeError("openai パッケージが見つかりません。`pip install openai` を実行してください。") from e
+                _client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0, timeout=120.0)
+    return _client
+
+def _estimate_tokens(messages: List[Dict]) -> int:
+    """TPM 制御用のトークン見積り"""
+    return sum(count_tokens(m.get("content") or "") for m in messages) + 1
+
+def _usage_fields(resp) -> Dict[str, int]:
+    usage = getattr(resp, "usage", None)
+    if usage is None:
+        return {}
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": int(getattr(usage, "prompt_tokens", 0) or 0),
+        "completion_tokens": int(getattr(usage, "completion_tokens", 0) or 0),
+        "cached_tokens": int(getattr(details, "cached_tokens", 0) or 0),
+    }
+
+# JSON 応答の呼び出しは、パース結果（parse_path）が分かってから telemetry に記録する
+_pending_call = threading.local()
+
+def _finish_call(**fields) -> None:
+    rec = getattr(_pending_call, "rec", None)
+    if rec is None:
+        return
+    _pending_call.rec = None
+    rec.update(fields)
+    telemetry.record(rec)
+
+def _log_usage(resp, n_items: int) -> None:
+    """分類1件あたりの消費トークンをログに出す"""
+    usage = getattr(resp, "usage", None)
+    if usage is None or not n_items:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", 0) or 0
+    logger.info(
+        "tokens/comment: prompt=%.1f completion=%.1f (batch=%d, cached_prompt=%d)",
+        usage.prompt_tokens / n_items, usage.completion_tokens / n_items, n_items, cached,
+    )
+
+def _chat_completion(messages: List[Dict], model: str = DEFAULT_MODEL, kind: str = "classify",
+                     n_items: int = 1, **kwargs):
+    """
+    共有クライアント + レート制御付きの chat.completions.create。
+    429 はサーバの retry-after 系ヘッダに従って待ってから再送する。
+    呼び出しごとに kind / model / n_items / トークン / 遅延 / 試行回数を telemetry に記録する
+    （response_format 付きの呼び出しは _resolve_batch がパース結果を付けてから記録）。
+    """
+    from openai import RateLimitError
+    client = _get_client()  # 初回の import・クライアント生成は遅延に含めない
+    _finish_call()  # 前の呼び出しのパース結果が付かないまま残っていれば、そのまま記録
+    rec: Dict = {"kind": kind, "model": model, "batch_size": n_items, "attempts": 0}
+    est = _estimate_tokens(messages)
+    t0 = time.perf_counter()
+    try:
+        for attempt in range(OPENAI_MAX_RATE_LIMIT_RETRIES + 1):
+            rec["attempts"] += 1
+            _limiter.acquire(est)
+            try:
+                resp = client.chat.completions.create(model=model, messages=messages, **kwargs)
+                break
+            except RateLimitError as e:
+                if attempt >= OPENAI_MAX_RATE_LIMIT_RETRIES:
+                    raise
+                wait = retry_after_seconds(e, default=2.0 * (attempt + 1))
+                _limiter.penalize(wait)
+                time.sleep(wait)
+    except Exception as e:
+        rec.update(status="error", error=type(e).__name__, latency_ms=(time.perf_counter() - t0) * 1000)
+        telemetry.record(rec)
+        raise
+    rec.update(status="ok", latency_ms=(time.perf_counter() - t0) * 1000, **_usage_fields(resp))
+    if kwargs.get("response_format"):
+        _pending_call.rec = rec
+    else:
+        telemetry.record(rec)
+    return resp
+
 def _build_user_prompt(items: List[str]) -> str:
     """
     バッチ分類のユーザープロンプトを構築。
@@ -173,126 +426,481 @@ def _build_user_prompt(items: List[str]) -> str:
     }
     return json.dumps(payload, ensure_ascii=False)
 
-def _call_gpt_batch(texts: List[str], model: str = DEFAULT_MODEL, max_retries: int = 3) -> List[Dict]:
-    from openai import OpenAI
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    user_prompt = _build_user_prompt(texts)
+def _build_compact_user_prompt(items: List[str]) -> str:
+    """compact 形式のユーザープロンプト（1行1件の「id<TAB>本文」。指示は COMPACT_SYSTEM_PROMPT 側にだけ書く）"""
+    return "\n".join(f"{i}\t{' '.join(t.split())}" for i, t in enumerate(items))
 
-    last_err = None
-    for attempt in range(1, max_retries + 1):
-        try:
-            resp = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": user_prompt},
-                ],
-                response_format={"type": "json_object"},  # ← これを追加
-            )
-
-            # ▼ ここからを置き換える ▼
-            import json, re
-            raw = resp.choices[0].message.content.strip()
-
-            # 先頭+の除去（JSONでは不正）
-            raw = re.sub(r':\s*\+1(\b|[^0-9])', r': 1\1', raw)
-
-            # JSONモードなら基本そのままパースで通る
+def _parse_json_content(raw: str) -> Dict:
+    """
+    モデル出力を JSON として読む（+1 の除去・'{'〜'}' の再抽出つきの“保険付き”パース）。
+    """
+    return _parse_json_content_with_path(raw)[0]
+
+def _parse_json_content_with_path(raw: str) -> Tuple[Dict, str]:
+    """_parse_json_content と同じ。どちらで読めたか（"json" / "regex"）も返す"""
+    raw = (raw or "").strip()
+
+    # 先頭+の除去（JSONでは不正）
+    raw = re.sub(r':\s*\+1(\b|[^0-9])', r': 1\1', raw)
+
+    # JSONモードなら基本そのままパースで通る
+    try:
+        return json.loads(raw), "json"
+    except Exception:
+        # フォールバック：最初の '{' から最後の '}' までを再抽出して再トライ
+        m = re.search(r'\{.*\}', raw, re.DOTALL)
+        if not m:
+            raise ValueError(f"JSON parse error: {raw[:300]}")
+        fixed = m.group(0)
+        fixed = re.sub(r':\s*\+1(\b|[^0-9])', r': 1\1', fixed)
+        return json.loads(fixed), "regex"
+
+def _align_results_by_id(data: Dict, n: int, normalize_topic: Callable[[str], str]) -> Dict[int, Dict]:
+    """
+    results を入力の id に突き合わせ、妥当な項目だけを {id: {"sentiment", "topic"}} で返す。
+    - id が範囲外・重複・sentiment が -1/0/1 でない項目は無効（= 再送対象）
+    - どの項目にも id が無く件数が一致する場合のみ、並び順で対応付ける
+    """
+    results = data.get("results") if isinstance(data, dict) else None
+    if isinstance(results, dict):
+        results = [results]
+    elif not isinstance(results, list):
+        results = [data] if isinstance(data, dict) else []
+    items = [r for r in results if isinstance(r, dict)]
+
+    if items and all("id" not in r for r in items) and len(items) == n:
+        keyed = list(enumerate(items))
+    else:
+        keyed = []
+        for r in items:
             try:
-                data = json.loads(raw)
+                keyed.append((int(r.get("id")), r))
             except Exception:
-                # フォールバック：最初の '{' から最後の '}' までを再抽出して再トライ
-                m = re.search(r'\{.*\}', raw, re.DOTALL)
-                if not m:
-                    raise ValueError(f"JSON parse error: {raw[:300]}")
-                fixed = m.group(0)
-                fixed = re.sub(r':\s*\+1(\b|[^0-9])', r': 1\1', fixed)
-                data = json.loads(fixed)
-            # ▲ ここまでを置き換える ▲
-
-            results = data.get("results")
-            if isinstance(results, dict):
-                results = [results]
-            elif not isinstance(results, list):
-                results = [data]
-
-            if len(results) != len(texts):
-                results = (results * math.ceil(len(texts) / len(results)))[:len(texts)]
-
-            out = []
-            for r in results:
-                s = r.get("sentiment", 0)
-                try:
-                    s = int(s)
-                except Exception:
-                    s = 0
-                if s not in (-1, 0, 1):
-                    s = 0
-                t = r.get("topic", "その他")
-                if t not in TOPIC_LABELS:
-                    t = "その他"
-                out.append({"sentiment": s, "topic": t})
-            return out
-
+                continue
+
+    out: Dict[int, Dict] = {}
+    dup = set()
+    for i, r in keyed:
+        if not 0 <= i < n:
+            continue
+        if i in out:
+            dup.add(i)
+            continue
+        try:
+            s = int(r.get("sentiment"))
+        except Exception:
+            continue
+        if s not in (-1, 0, 1):
+            continue
+        out[i] = {"sentiment": s, "topic": normalize_topic(r.get("topic", "その他"))}
+    for i in dup:
+        out.pop(i, None)
+    return out
+
+def _decode_json(raw: str, n: int, normalize_topic: Callable[[str], str]) -> Tuple[Dict[int, Dict], str]:
+    """json 形式の応答 → ({id: {"sentiment", "topic"}}, "json" / "regex")"""
+    data, path = _parse_json_content_with_path(raw)
+    return _align_results_by_id(data, n, normalize_topic), path
+
+_COMPACT_TUPLE_RE = re.compile(r'\[\s*"?(\d+)"?\s*,\s*"?([-+]?\d+)"?\s*,\s*"?([^\],"]+)"?\s*\]')
+
+def _decode_compact(raw: str, n: int, normalize_topic: Callable[[str], str]) -> Tuple[Dict[int, Dict], str]:
+    """
+    compact 形式の応答 → ({id: {"sentiment", "topic"}}, "json" / "regex")。
+    topic は TOPIC_LABELS の番号（範囲外は無効）。番号の代わりにラベル名が来ても normalize_topic で読む。
+    JSON として読めない（途中で切れた等）ときは、閉じている [id, s, t] だけを拾う。
+    json 形式のオブジェクト（{"results": [{"id", ...}]}）で返ってきた場合もそのまま読む。
+    """
+    try:
+        data, path = _parse_json_content_with_path(raw)
+    except Exception:
+        data, path = None, "regex"
+    if isinstance(data, dict) and isinstance(data.get("results"), list) \
+            and any(isinstance(r, dict) for r in data["results"]):
+        return _align_results_by_id(data, n, normalize_topic), path
+    rows = None
+    if isinstance(data, dict):
+        rows = data.get("r", data.get("results"))
+    elif isinstance(data, list):
+        rows = data
+    if not isinstance(rows, list):
+        rows = [list(m) for m in _COMPACT_TUPLE_RE.findall(raw or "")]
+        path = "regex"
+
+    out: Dict[int, Dict] = {}
+    dup = set()
+    for row in rows:
+        if isinstance(row, str):
+            row = row.split(",")
+        if not isinstance(row, (list, tuple)) or len(row) < 3:
+            continue
+        try:
+            i, sent = int(row[0]), int(str(row[1]).strip())
+        except Exception:
+            continue
+        if not 0 <= i < n or sent not in (-1, 0, 1):
+            continue
+        t = str(row[2]).strip().strip('"')
+        if t.lstrip("-").isdigit():
+            k = int(t)
+            if not 0 <= k < len(TOPIC_LABELS):
+                continue
+            topic = TOPIC_LABELS[k]
+        else:
+            topic = normalize_topic(t)
+        if i in out:
+            dup.add(i)
+            continue
+        out[i] = {"sentiment": sent, "topic": topic}
+    for i in dup:
+        out.pop(i, None)
+    return out, path
+
+def _fallback_label() -> Dict:
+    """判定できなかった行の仮のラベル（キャッシュには書かず、次の実行で判定し直す）"""
+    return {"sentiment": 0, "topic": "その他", "source": "fallback"}
+
+def _is_fallback(r: Dict) -> bool:
+    return r.get("source") == "fallback"
+
+def _resolve_batch(texts: List[str], send: Callable[[List[str]], str],
+                   normalize_topic: Callable[[str], str], max_retries: int = 3,
+                   decode: Callable[[str, int, Callable[[str], str]], Tuple[Dict[int, Dict], str]] = None
+                   ) -> List[Dict]:
+    """
+    send(texts) の応答を id で突き合わせ、欠けた/無効な id だけを再送する。
+    応答が1件も使えない場合は同じバッチを丸ごと再送せず、半分に分割して再帰的に処理する
+    （壊れた入力を1件まで切り分ける）。1件まで絞っても判定できない行は _fallback_label()（0/その他）とする。
+    API 呼び出し自体の失敗は従来どおり待機して再試行し、max_retries 回で例外にする。
+    decode は応答の読み方（既定は json 形式の _decode_json、compact 形式なら _decode_compact）。
+    """
+    decode = decode or _decode_json
+    out: List[Optional[Dict]] = [None] * len(texts)
+    pending = list(range(len(texts)))
+    api_failures = 0
+    while pending:
+        sub = [texts[i] for i in pending]
+        try:
+            raw = send(sub)
         except Exception as e:
-            last_err = e
-            time.sleep(1.5 * attempt)
+            api_failures += 1
+            if api_failures >= max_retries:
+                raise RuntimeError(f"OpenAI呼び出しに失敗しました: {e}") from e
+            time.sleep(1.5 * api_failures)
+            continue
 
-    raise RuntimeError(f"OpenAI呼び出しに失敗しました: {last_err}")
+        path = "failed"
+        try:
+            got, path = decode(raw, len(sub), normalize_topic)
+        except Exception:
+            got = {}
+        _finish_call(parse_path=path, n_parsed=len(got))
+        for j, r in got.items():
+            out[pending[j]] = r
+        if not got:
+            break  # 進捗なし → 分割へ
+        pending = [p for j, p in enumerate(pending) if j not in got]
+
+    if pending:
+        if len(pending) == 1:
+            logger.warning("分類結果を取得できませんでした（0/その他として扱います）: %r", texts[pending[0]][:80])
+            out[pending[0]] = _fallback_label()
+        else:
+            mid = len(pending) // 2
+            for half in (pending[:mid], pending[mid:]):
+                sub_out = _resolve_batch([texts[i] for i in half], send, normalize_topic, max_retries, decode)
+                for i, r in zip(half, sub_out):
+                    out[i] = r
+    return out
+
+def _strict_topic(label: str) -> str:
+    return label if label in TOPIC_LABELS else "その他"
+
+def _wire(wire: Optional[str]) -> Tuple[str, Callable[[List[str]], str], Callable]:
+    """形式名 → (system プロンプト, ユーザープロンプトの組み立て, 応答の読み方)"""
+    if (wire or WIRE_FORMAT) == "compact":
+        return COMPACT_SYSTEM_PROMPT, _build_compact_user_prompt, _decode_compact
+    return SYSTEM_PROMPT, _build_user_prompt, _decode_json
+
+def _classify_request(items: List[str], model: str = DEFAULT_MODEL, wire: Optional[str] = None) -> Dict:
+    """分類1バッチ分の chat.completions の引数（同期呼び出しとバッチ処理のリクエストファイルで共通）"""
+    system, build, _ = _wire(wire)
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": system},
+            {"role": "user", "content": build(items)},
+        ],
+        "response_format": {"type": "json_object"},
+    }
 
-def _classify_with_gpt(texts: List[str], batch_size: int = 10) -> List[Dict]:
+def _classify_budget(wire: Optional[str] = None) -> Tuple[int, str, int]:
+    """形式ごとの (固定部分のトークン数, キャッシュの文脈, 1件あたりの出力トークンの見込み)"""
+    wire = wire or WIRE_FORMAT
+    system, build, _ = _wire(wire)
+    prefix = count_tokens(system) + count_tokens(build([]))
+    if wire == "compact":
+        return prefix, f"wire=compact:{COMPACT_PROMPT_VERSION}", COMPACT_OUTPUT_PER_ITEM
+    return prefix, "", BATCH_OUTPUT_PER_ITEM
+
+def _call_gpt_batch(texts: List[str], model: str = DEFAULT_MODEL, max_retries: int = 3,
+                    wire: Optional[str] = None) -> List[Dict]:
+    """wire は "json" / "compact"（省略時は WIRE_FORMAT）"""
+    _, _, decode = _wire(wire)
+
+    def send(items: List[str]) -> str:
+        resp = _chat_completion(**_classify_request(items, model, wire), kind="classify", n_items=len(items))
+        _log_usage(resp, len(items))
+        return resp.choices[0].message.content
+
+    return _resolve_batch(texts, send, _strict_topic, max_retries, decode)
+
+def _classify_cached(texts: List[str], call_batch: Callable[[List[str]], List[Dict]],
+                     batch_size: Optional[int] = None, prefix_tokens: int = 0,
+                     model: str = DEFAULT_MODEL, context: str = "",
+                     output_per_item: int = BATCH_OUTPUT_PER_ITEM) -> List[Dict]:
     """
-    texts を batch_size ずつ GPT に投げ、結合して返す。
+    キャッシュを引いてから、ミスした texts だけを call_batch に投げる。
+    batch_size を省略するとトークン予算（BATCH_INPUT_TOKENS / BATCH_OUTPUT_TOKENS）で詰める
+    （出力は1件あたり output_per_item トークンで見積もる）。
+    prefix_tokens は毎回同じ固定部分（SYSTEM_PROMPT + 指示部）のトークン数。
+    バッチは OPENAI_CONCURRENCY 並列で送り、取得した結果はキャッシュに書き戻して入力順で返す
+    （_fallback_label() の行は書き戻さない）。
     """
-    results: List[Dict] = []
-    n = len(texts)
-    for i in range(0, n, batch_size):
-        batch = texts[i:i + batch_size]
-        chunk = _call_gpt_batch(batch)
-        results.extend(chunk)
+    cache = get_cache()
+    results: List[Optional[Dict]] = [None] * len(texts)
+    if cache is not None:
+        for i, r in cache.get_many(texts, model, context).items():
+            results[i] = r
+
+    miss_idx = [i for i, r in enumerate(results) if r is None]
+    miss_texts = [texts[i] for i in miss_idx]
+    if batch_size:
+        batches = [miss_texts[i:i + batch_size] for i in range(0, len(miss_texts), batch_size)]
+    else:
+        packed = pack_batches(miss_texts, prefix_tokens, BATCH_INPUT_TOKENS, BATCH_OUTPUT_TOKENS,
+                              output_per_item=output_per_item, max_items=BATCH_MAX_ITEMS)
+        batches = [[miss_texts[i] for i in b] for b in packed]
+    if batches:
+        logger.info("classify: %d件を %dリクエストで送信（平均 %.1f件/リクエスト）",
+                    len(miss_texts), len(batches), len(miss_texts) / len(batches))
+    fetched: List[Dict] = []
+    for chunk in dispatch(call_batch, batches, concurrency=OPENAI_CONCURRENCY):
+        fetched.extend(chunk)
+
+    if cache is not None and miss_texts:
+        # 判定できずに 0/その他 にした分は書かない（一時的な失敗でラベルが固定されないように）
+        ok = [j for j, r in enumerate(fetched) if not _is_fallback(r)]
+        cache.put_many([miss_texts[j] for j in ok], [fetched[j] for j in ok], model, context)
+    for i, r in zip(miss_idx, fetched):
+        results[i] = r
     return results
 
-def enrich(df: pd.DataFrame) -> pd.DataFrame:
+def _classify_with_gpt(texts: List[str], batch_size: Optional[int] = None,
+                       model: str = DEFAULT_MODEL, wire: Optional[str] = None) -> List[Dict]:
+    """
+    texts をトークン予算ごと（batch_size 指定時は件数ごと）に GPT に投げ、結合して返す。
+    キャッシュ済みの分は API を呼ばない（形式ごとに別々にキャッシュする）。
+    """
+    wire = wire or WIRE_FORMAT
+    prefix, context, output_per_item = _classify_budget(wire)
+    return _classify_cached(texts, lambda batch: _call_gpt_batch(batch, model=model, wire=wire),
+                            batch_size, prefix_tokens=prefix, model=model, context=context,
+                            output_per_item=output_per_item)
+
+def _classify_with_cascade(texts: List[str], model: str = DEFAULT_MODEL,
+                           threshold: float = DISTILL_THRESHOLD,
+                           stats: Optional[Dict] = None) -> List[Dict]:
+    """
+    ローカル分類器で確信度が threshold 以上のものはその場で判定し、残りだけ _classify_with_gpt に投げる。
+    ローカル分類器が無ければ全件 GPT。stats を渡すと {"n_local", "n_gpt", "offload_ratio"} を書き込む。
+    """
+    distilled = get_distilled()
+    results: List[Optional[Dict]] = [None] * len(texts)
+    if distilled is not None and texts:
+        labels, conf = distilled.predict(texts)
+        for i, (r, c) in enumerate(zip(labels, conf)):
+            if c >= threshold and r["topic"] in TOPIC_LABELS:
+                results[i] = dict(r, source="local")
+
+    rest = [i for i, r in enumerate(results) if r is None]
+    if rest:
+        for i, r in zip(rest, _classify_with_gpt([texts[i] for i in rest], model=model)):
+            results[i] = r
+    if stats is not None:
+        n_local = len(texts) - len(rest)
+        stats.update(n_local=n_local, n_gpt=len(rest),
+                     offload_ratio=(n_local / len(texts)) if texts else 0.0)
+    return results
+
+def _dedup_stats(n_rows: int, n_unique: int) -> Dict:
+    return {
+        "n_rows": n_rows,
+        "n_unique": n_unique,
+        "dedup_ratio": (1.0 - n_unique / n_rows) if n_rows else 0.0,
+    }
+
+def _classify_deduped(texts: List[str], classify: Callable[[List[str]], List[Dict]],
+                      near: bool = False) -> Tuple[List[Dict], Dict]:
+    """
+    重複（near=True ならほぼ重複も）をまとめ、代表だけを classify に渡して全行にラベルを戻す。
+    返却: (入力順のラベル, {"n_rows", "n_unique", "dedup_ratio"})
+    """
+    reps, mapping = collapse(texts, near=near, threshold=DEDUP_NEAR_THRESHOLD)
+    labels = classify([texts[i] for i in reps]) if reps else []
+    return [dict(labels[m]) for m in mapping], _dedup_stats(len(texts), len(reps))
+
+# ラベルの出どころ（ローカル分類器の学習には "gpt" の行だけを使う）
+#   gpt: GPT の判定（キャッシュから引いたものを含む） / local: ローカル分類器 / heuristic: 救済ロジックで sentiment を変えた
+#   refine: 文脈再判定で上書きした / fallback: 判定できずに 0/その他 にした
+LABEL_SOURCES = ["gpt", "local", "heuristic", "refine", "fallback"]
+
+# 判定済みフレームの列型（enrich() / enrich_iter() の返却、ストア・判定済みCSVの読み込み後もこれに揃える）
+TOPIC_DTYPE = pd.CategoricalDtype(TOPIC_LABELS)
+LABEL_SOURCE_DTYPE = pd.CategoricalDtype(LABEL_SOURCES)
+ENRICHED_DTYPES = {
+    "sentiment": "int8",        # -1 / 0 / 1
+    "topic": TOPIC_DTYPE,       # TOPIC_LABELS のカテゴリ（1行1バイト）
+    "source": "category",
+    "likes": "int32",
+    "date": "datetime64[ns]",   # 投稿日（0時に切り捨て）。日時が読めない行は NaT
+    "label_source": LABEL_SOURCE_DTYPE,  # 記録の無い古い行は NaN
+}
+
+def _topic_codes(labels: List[str]) -> np.ndarray:
+    """トピック名 → TOPIC_DTYPE のコード（TOPIC_LABELS に無いものは「その他」）"""
+    other = TOPIC_LABELS.index("その他")
+    index = {t: i for i, t in enumerate(TOPIC_LABELS)}
+    return np.fromiter((index.get(t, other) for t in labels), dtype=np.int8, count=len(labels))
+
+def _date_column(published_at: pd.Series) -> pd.Series:
+    dt = pd.to_datetime(published_at, errors="coerce", utc=True)
+    return dt.dt.tz_localize(None).dt.normalize().astype("datetime64[ns]")
+
+def to_enriched_schema(dfx: pd.DataFrame) -> pd.DataFrame:
+    """
+    sentiment / topic / source / likes / date を ENRICHED_DTYPES に揃える（列を置き換えるだけで行はコピーしない）。
+    ストアや判定済みCSVから読んだフレーム用。date が無ければ published_at から作る。
+    """
+    s = pd.to_numeric(dfx["sentiment"], errors="coerce").fillna(0).to_numpy()
+    dfx["sentiment"] = np.sign(s).astype(np.int8)
+    if not isinstance(dfx["topic"].dtype, pd.CategoricalDtype) or dfx["topic"].dtype != TOPIC_DTYPE:
+        dfx["topic"] = pd.Categorical.from_codes(
+            _topic_codes([_normalize_topic(t) for t in dfx["topic"].tolist()]), dtype=TOPIC_DTYPE)
+    if "source" in dfx.columns:
+        dfx["source"] = dfx["source"].astype("category")
+    if "label_source" in dfx.columns and dfx["label_source"].dtype != LABEL_SOURCE_DTYPE:
+        dfx["label_source"] = dfx["label_source"].astype(object).astype(LABEL_SOURCE_DTYPE)
+    if "likes" in dfx.columns:
+        dfx["likes"] = pd.to_numeric(dfx["likes"], errors="coerce").fillna(0).astype("int32")
+    if "published_at" in dfx.columns:
+        dfx["date"] = _date_column(dfx["published_at"])
+    elif "date" in dfx.columns:
+        dfx["date"] = pd.to_datetime(dfx["date"], errors="coerce").astype("datetime64[ns]")
+    return dfx
+
+def _apply_labels(dfx: pd.DataFrame, gpt_out: List[Dict]) -> pd.DataFrame:
+    """
+    GPT出力（-1/0/1）を救済ロジックで補正し、ENRICHED_DTYPES の列（+ heuristic_rule）を付ける。
+    label_source は各ラベルの "source"（無ければ "gpt"）。救済ロジックで sentiment が変わった行は "heuristic"
+    """
+    # +1/−1 の取りこぼしを防ぐ。どのルールが効いたかも残す
+    raw_s = pd.Series(np.fromiter((int(item.get("sentiment", 0)) for item in gpt_out), dtype=np.int8,
+                                  count=len(gpt_out)), index=dfx.index)
+    fixed_s, rule = _heuristic_adjust_sentiment_series(dfx["text"], raw_s)
+
+    dfx["sentiment"] = fixed_s.astype(np.int8)
+    dfx["topic"] = pd.Categorical.from_codes(_topic_codes([item.get("topic", "その他") for item in gpt_out]),
+                                             dtype=TOPIC_DTYPE)
+    dfx["heuristic_rule"] = rule
+    label_source = pd.Series([item.get("source", "gpt") for item in gpt_out], index=dfx.index, dtype=object)
+    label_source[(fixed_s != raw_s).to_numpy()] = "heuristic"
+    dfx["label_source"] = label_source.astype(LABEL_SOURCE_DTYPE)
+    return to_enriched_schema(dfx)
+
+def enrich(df: pd.DataFrame, near_duplicates: bool = DEDUP_NEAR) -> pd.DataFrame:
     """
     期待カラム: ['text','source','likes','published_at']
-    返却: sentiment(-1/0/1をfloatに変換: -1.0/0.0/1.0), topic, date
+    返却: sentiment(-1/0/1, int8), topic(TOPIC_LABELS のカテゴリ), date(datetime64),
+          heuristic_rule（救済ロジックで発火したパターン。無ければ None）、
+          label_source（ラベルの出どころ。LABEL_SOURCES）。列型は ENRICHED_DTYPES
+    重複除去の結果は dfx.attrs["dedup"]、ローカル分類器へのオフロード状況は dfx.attrs["cascade"] に入る。
+    df は書き換えない（浅いコピーに列を足す・置き換えるだけで、元の列のデータは共有する）。
     """
     if df is None or df.empty:
         return df
 
-    dfx = df.copy()
+    dfx = df.copy(deep=False)
     dfx['text'] = dfx['text'].astype(str).fillna("")
 
-    # GPTで一括判定
-    gpt_out = _classify_with_gpt(dfx["text"].tolist(), batch_size=20)
-
-    # --- ここから修正 ---
-    sentiments = []
-    topics = []
-
-    for text, item in zip(dfx["text"].tolist(), gpt_out):
-        raw_s = int(item.get("sentiment", 0))  # GPT出力（-1/0/1）
-        # 救済ロジックで補正（+1/−1 の取りこぼしを防ぐ）
-        fixed_s = _heuristic_adjust_sentiment(text, raw_s)
-
-        sentiments.append(float(fixed_s))
-        topics.append(item.get("topic", "その他"))
-    # --- ここまで修正 ---
+    # GPTで一括判定（重複は代表1件だけ。ローカル分類器が自信を持てるものは GPT に投げない）
+    cascade_stats: Dict = {}
+    gpt_out, dedup_stats = _classify_deduped(
+        dfx["text"].tolist(), lambda uniq: _classify_with_cascade(uniq, stats=cascade_stats),
+        near=near_duplicates,
+    )
 
-    dfx["sentiment"] = sentiments
-    dfx["topic"] = topics
-    dfx["date"] = pd.to_datetime(dfx["published_at"], errors="coerce").dt.date
+    dfx = _apply_labels(dfx, gpt_out)
+    dfx.attrs["dedup"] = dedup_stats
+    dfx.attrs["cascade"] = cascade_stats
     return dfx
 
-
-def kpi(dfx: pd.DataFrame) -> Dict[str, float]:
+def enrich_iter(df: pd.DataFrame, near_duplicates: bool = DEDUP_NEAR,
+                chunk_size: int = ENRICH_CHUNK_SIZE, start_chunk: int = 0) -> Iterator[pd.DataFrame]:
+    """
+    enrich() の逐次版。重複をまとめた代表テキストを chunk_size 件ずつ分類し、終わるたびに
+    その代表に対応する行（元の index のまま、enrich() と同じ列）を yield する。
+    全チャンクを pd.concat(...).sort_index() すると enrich() と同じ結果になる。
+
+    各チャンクの attrs:
+      "progress": {"chunk", "n_chunks", "done", "total"}（done / total は代表テキストの件数）
+      "dedup"   : 全体の重複除去の結果
+      "cascade" : そのチャンクのローカル分類器へのオフロード状況
+    start_chunk を指定すると、それより前のチャンクは分類せずに飛ばす（途中からの再開用）。
+    """
+    if df is None or df.empty:
+        return
+    texts = df["text"].astype(str).fillna("").tolist()
+    reps, mapping = collapse(texts, near=near_duplicates, threshold=DEDUP_NEAR_THRESHOLD)
+    dedup_stats = _dedup_stats(len(texts), len(reps))
+    mapping = np.asarray(mapping)
+    size = chunk_size if chunk_size and chunk_size > 0 else len(reps)
+    n_chunks = -(-len(reps) // size)
+    for k in range(start_chunk, n_chunks):
+        lo, hi = k * size, min((k + 1) * size, len(reps))
+        cascade_stats: Dict = {}
+        labels = _classify_with_cascade([texts[i] for i in reps[lo:hi]], stats=cascade_stats)
+        rows = np.flatnonzero((mapping >= lo) & (mapping < hi))
+        part = df.iloc[rows].assign(text=[texts[i] for i in rows])  # df のスライスに代入しない
+        part = _apply_labels(part, [dict(labels[m - lo]) for m in mapping[rows]])
+        part.attrs["progress"] = {"chunk": k, "n_chunks": n_chunks, "done": hi, "total": len(reps)}
+        part.attrs["dedup"] = dedup_stats
+        part.attrs["cascade"] = cascade_stats
+        yield part
+
+
+def kpi(dfx: pd.DataFrame, roll: Optional[pd.DataFrame] = None) -> Dict[str, float]:
+    """
+    roll（rollup.build() / CommentStore.read_rollup() の集計表）を渡すとそこから計算する
+    （コメント数ではなく集計表の行数に比例）。省略時は dfx の int8 の sentiment を数えるだけ。
+    """
+    if roll is not None:
+        return rollup.kpi(roll)
     if dfx is None or dfx.empty:
-        return {"n_comments": 0, "pos_rate": 0.0, "neg_rate": 0.0, "avg_sentiment": 0.0}
-    n = len(dfx)
-    pos = (dfx['sentiment'] > 0).mean()
-    neg = (dfx['sentiment'] < 0).mean()
-    avg = dfx['sentiment'].mean()
-    return {"n_comments": int(n), "pos_rate": float(pos), "neg_rate": float(neg), "avg_sentiment": float(avg)}
+        return rollup.kpi_from_sums({})
+    s = dfx["sentiment"].to_numpy()
+    if s.dtype != np.int8:
+        s = np.sign(pd.to_numeric(dfx["sentiment"], errors="coerce").fillna(0).to_numpy()).astype(np.int8)
+    likes = (pd.to_numeric(dfx["likes"], errors="coerce").fillna(0).to_numpy(dtype=np.float64)
+             if "likes" in dfx.columns else np.zeros(len(s)))
+    # -1 / 0 / 1 を uint8 として見て +1 すると 0 / 1 / 2（-1 は 255 + 1 で 0 に折り返す）
+    codes = s.view(np.uint8) + np.uint8(1)
+    n_neg, _, n_pos = np.bincount(codes, minlength=3)[:3]
+    l_neg, _, l_pos = np.bincount(codes, weights=likes, minlength=3)[:3]
+    return rollup.kpi_from_sums({
+        "n": len(s), "n_pos": n_pos, "n_neg": n_neg, "sentiment_sum": int(n_pos) - int(n_neg),
+        "likes_sum": likes.sum(), "likes_pos": l_pos, "likes_neg": l_neg, "likes_sentiment": l_pos - l_neg,
+    })
 
 # ========= ここから追加（既存コードの下に追記） =========
 def _normalize_topic(label: str) -> str:
@@ -319,35 +927,113 @@ def _normalize_topic(label: str) -> str:
     cand = mapping.get(raw, raw)
     return cand if cand in TOPIC_LABELS else "その他"
 
-def _summarize_transcript_for_context(transcript_text: str, model: str = DEFAULT_MODEL) -> str:
+_SUMMARY_SYSTEM = "You summarize Japanese transcripts into concise bullet points."
+_SUMMARY_PROMPT = (
+    "以下は日本語の動画文字起こしです。高市首相への賛否分類の文脈理解に使えるよう、"
+    "日本語で箇条書きの重要ポイント要約を作成してください。"
+    "・主要トピック/論点・誰が誰に何を主張/批判/擁護したか・外交/安全保障/経済/人格・態度の論点・"
+    "高市首相に関係する出来事/発言/質問の要旨・視聴者が同情/擁護/批判しそうな場面。"
+    "最大{limit}文字以内。箇条書きのみ。"
+)
+_MERGE_PROMPT = (
+    "以下は1本の動画文字起こしを前から順に区切って要約した部分要約です。"
+    "重複をまとめ、時系列を保ったまま、高市首相への賛否分類の文脈理解に使える1つの箇条書き要約に統合してください。"
+    "最大{limit}文字以内。箇条書きのみ。"
+)
+
+_SENTENCE_RE = re.compile(r"[^。！？!?\n]*(?:[。！？!?]+|\n+|$)")
+
+def _split_transcript(text: str, max_tokens: int = TRANSCRIPT_CHUNK_TOKENS) -> List[str]:
     """
-    長尺トランスクリプトを分類に効く日本語要約(<=1500文字程度)に圧縮。
-    ※ ここは新規API呼び出し（サマリ用）。精度を優先。速度重視なら transcript_text[:4000] でもOK。
-    """
-    from openai import OpenAI
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    prompt = (
-        "以下は日本語の動画文字起こしです。高市首相への賛否分類の文脈理解に使えるよう、"
-        "日本語で箇条書きの重要ポイント要約を作成してください。"
-        "・主要トピック/論点・誰が誰に何を主張/批判/擁護したか・外交/安全保障/経済/人格・態度の論点・"
-        "高市首相に関係する出来事/発言/質問の要旨・視聴者が同情/擁護/批判しそうな場面。"
-        "最大1500文字以内。箇条書きのみ。"
-    )
-    resp = client.chat.completions.create(
+    文字起こしを文の切れ目で max_tokens 以下のチャンクに分ける（1文で超える場合は文字数で切る）。
+    """
+    chunks: List[str] = []
+    cur, used = "", 0
+    for sent in _SENTENCE_RE.findall(text):
+        if not sent:
+            continue
+        n = count_tokens(sent)
+        if n > max_tokens:
+            step = max(len(sent) * max_tokens // n, 1)
+            pieces = [sent[i:i + step] for i in range(0, len(sent), step)]
+        else:
+            pieces = [sent]
+        for piece in pieces:
+            n = count_tokens(piece)
+            if cur and used + n > max_tokens:
+                chunks.append(cur)
+                cur, used = "", 0
+            cur += piece
+            used += n
+    if cur.strip():
+        chunks.append(cur)
+    return chunks
+
+def _summarize_once(text: str, prompt: str, model: str) -> str:
+    resp = _chat_completion(
         model=model,
         messages=[
-            {"role": "system", "content": "You summarize Japanese transcripts into concise bullet points."},
-            {"role": "user", "content": prompt + "\n\n【文字起こし】\n" + transcript_text}
+            {"role": "system", "content": _SUMMARY_SYSTEM},
+            {"role": "user", "content": prompt + "\n\n【文字起こし】\n" + text}
         ],
+        kind="summarize",
         temperature=0.2,
     )
-    summary = resp.choices[0].message.content.strip()
-    return summary[:2000]
+    return resp.choices[0].message.content.strip()
 
-
-def _build_user_prompt_with_context(items: List[str], context_summary: str) -> str:
+def _summarize_transcript_for_context(transcript_text: str, model: str = DEFAULT_MODEL,
+                                      progress: Optional[Callable[[int, int], None]] = None) -> str:
+    """
+    長尺トランスクリプトを分類に効く日本語要約(<=1500文字程度)に圧縮。
+    TRANSCRIPT_CHUNK_TOKENS ごとに区切って並列に要約し（map）、部分要約を統合する（reduce）。
+    結果は文字起こしのハッシュでキャッシュし、同じ動画の再判定では API を呼ばない。
+    progress(完了数, 全体数) で進み具合を通知する。
     """
-    再判定用ユーザープロンプト：context にトランスクリプト要約を同梱。
+    cache = get_cache()
+    key = cache.summary_key(transcript_text, model, _SUMMARY_PROMPT + _MERGE_PROMPT) if cache is not None else None
+    if key is not None:
+        hit = cache.get_summary(key)
+        if hit is not None:
+            if progress:
+                progress(1, 1)
+            return hit
+
+    chunks = _split_transcript(transcript_text)
+    if len(chunks) <= 1:
+        summary = _summarize_once(transcript_text, _SUMMARY_PROMPT.format(limit=1500), model)
+        if progress:
+            progress(1, 1)
+    else:
+        # 部分要約の合計がチャンクに収まるよう、1チャンクあたりの文字数を割り当てる
+        per_chunk = max(300, 6000 // len(chunks))
+        total = len(chunks) + 1
+        partials = dispatch(
+            lambda c: _summarize_once(c, _SUMMARY_PROMPT.format(limit=per_chunk), model),
+            chunks, concurrency=OPENAI_CONCURRENCY,
+            progress=(lambda done, _n: progress(done, total)) if progress else None,
+        )
+        # 部分要約がまだ長ければ、チャンク単位でまとめてから統合する
+        while len(partials) > 1 and count_tokens("\n".join(partials)) > TRANSCRIPT_CHUNK_TOKENS:
+            groups = _split_transcript("\n".join(partials), TRANSCRIPT_CHUNK_TOKENS)
+            if len(groups) >= len(partials):
+                break
+            partials = dispatch(lambda g: _summarize_once(g, _MERGE_PROMPT.format(limit=per_chunk), model),
+                                groups, concurrency=OPENAI_CONCURRENCY)
+        summary = _summarize_once("\n".join(partials), _MERGE_PROMPT.format(limit=1500), model)
+        if progress:
+            progress(total, total)
+
+    summary = summary[:2000]
+    if key is not None:
+        cache.put_summary(key, summary)
+    return summary
+
+
+def _build_user_prompt_with_context(items: List[str], context_summary: str,
+                                    segments: Optional[List[str]] = None) -> str:
+    """
+    再判定用ユーザープロンプト：context にトランスクリプト要約、
+    transcript_excerpts にこのバッチに関係する文字起こしの区間を同梱。
     """
     payload = {
         "instruction": {
@@ -356,119 +1042,106 @@ def _build_user_prompt_with_context(items: List[str], context_summary: str) -> s
             "topic_enum": TOPIC_LABELS
         },
         "context": context_summary,
+        "transcript_excerpts": segments or [],
         "inputs": [{"id": i, "text": t} for i, t in enumerate(items)]
     }
     return json.dumps(payload, ensure_ascii=False)
 
 
+def _refine_request(items: List[str], context_summary: str, segments: Optional[List[str]] = None,
+                    model: str = DEFAULT_MODEL) -> Dict:
+    """文脈付き再判定1バッチ分の chat.completions の引数"""
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": _build_user_prompt_with_context(items, context_summary, segments)},
+        ],
+        "temperature": 0,
+        "response_format": {"type": "json_object"},  # JSONモード
+    }
+
+
 def _call_gpt_batch_with_context(texts: List[str], context_summary: str,
-                                 model: str = DEFAULT_MODEL, max_retries: int = 3) -> List[Dict]:
+                                 model: str = DEFAULT_MODEL, max_retries: int = 3,
+                                 segments: Optional[List[str]] = None) -> List[Dict]:
     """
     texts(バッチ) -> [{"sentiment": -1|0|1, "topic": "<ラベル>"}]
     既存の _call_gpt_batch は触らず、文脈付きの別関数として実装。
     """
-    from openai import OpenAI
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    user_prompt = _build_user_prompt_with_context(texts, context_summary)
-
-    last_err = None
-    for attempt in range(1, max_retries + 1):
-        try:
-            resp = client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": SYSTEM_PROMPT},
-                    {"role": "user", "content": user_prompt},
-                ],
-                temperature=0,
-                response_format={"type": "json_object"},  # JSONモード
-            )
-
-            # 既存実装と同じ“保険付き”パース（重複OK：既存コードに影響を与えないためコピペ）
-            import json, re
-            raw = resp.choices[0].message.content.strip()
-            raw = re.sub(r':\s*\+1(\b|[^0-9])', r': 1\1', raw)
-            try:
-                data = json.loads(raw)
-            except Exception:
-                m = re.search(r'\{.*\}', raw, re.DOTALL)
-                if not m:
-                    raise ValueError(f"JSON parse error: {raw[:300]}")
-                fixed = m.group(0)
-                fixed = re.sub(r':\s*\+1(\b|[^0-9])', r': 1\1', fixed)
-                data = json.loads(fixed)
-
-            results = data.get("results")
-            if isinstance(results, dict):
-                results = [results]
-            elif not isinstance(results, list):
-                results = [data]
-
-            # 念のため件数合わせ
-            if len(results) != len(texts) and len(results) > 0:
-                results = (results * math.ceil(len(texts) / len(results)))[:len(texts)]
-
-            out = []
-            for r in results:
-                s = r.get("sentiment", 0)
-                try:
-                    s = int(s)
-                except Exception:
-                    s = 0
-                if s not in (-1, 0, 1):
-                    s = 0
-                t = _normalize_topic(r.get("topic", "その他"))
-                out.append({"sentiment": s, "topic": t})
-            return out
+    def send(items: List[str]) -> str:
+        resp = _chat_completion(**_refine_request(items, context_summary, segments, model),
+                                kind="refine", n_items=len(items))
+        _log_usage(resp, len(items))
+        return resp.choices[0].message.content
 
-        except Exception as e:
-            last_err = e
-            time.sleep(1.5 * attempt)
-
-    raise RuntimeError(f"OpenAI呼び出し(文脈付き)に失敗しました: {last_err}")
+    try:
+        return _resolve_batch(texts, send, _normalize_topic, max_retries)
+    except RuntimeError as e:
+        raise RuntimeError(f"OpenAI呼び出し(文脈付き)に失敗しました: {e.__cause__}") from e.__cause__
 
 
 def refine_with_transcript(dfx: pd.DataFrame, transcript_text: str,
-                           summarize: bool = True, batch_size: int = 10) -> pd.DataFrame:
+                           summarize: bool = False, batch_size: Optional[int] = None,
+                           progress: Optional[Callable[[int, int], None]] = None) -> pd.DataFrame:
     """
     文字起こしによる“文脈再判定”を、初回分類で sentiment==0 の行にだけ適用する。
     既存カラムや他行には一切触れない（= 既存機能を損なわない）。
     - dfx: enrich() 済みの DataFrame（sentiment, topic が付与済み）
     - transcript_text: あなたが貼る文字起こし全文
-    - summarize: True の場合は要約してからプロンプトに同梱（長文でも安定）
+    - summarize: True の場合は全体要約もプロンプトに同梱（要約の API 呼び出しが増える）
+    文字起こしは区間に分けて BM25 索引を作り、バッチごとに関係の深い区間（RETRIEVAL_TOP_K 件）だけを添える。
+    - progress: 要約の進み具合の通知先 progress(完了数, 全体数)
     """
     if dfx is None or dfx.empty or not transcript_text or not isinstance(transcript_text, str):
         return dfx
 
-    mask = (dfx["sentiment"] == 0) | (dfx["sentiment"] == 0.0)
+    mask = dfx["sentiment"] == 0
     if not mask.any():
         return dfx  # 0が無ければ何もしない
 
-    # 文脈要約 or そのまま使用
-    if summarize:
-        context_summary = _summarize_transcript_for_context(transcript_text)
-    else:
-        # 長すぎると不安定になるため、保険で上限
-        context_summary = transcript_text[:4000]
-
+    context_summary, index, prefix, cache_context = _refine_setup(transcript_text, summarize, progress)
     idx = dfx.index[mask]
     texts = dfx.loc[idx, "text"].astype(str).tolist()
 
-    # 文脈付きで再判定
-    reclassified = []
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i + batch_size]
-        chunk = _call_gpt_batch_with_context(batch, context_summary)
-        reclassified.extend(chunk)
-
-    # 反映：0の行だけ、かつ“非0に変わった場合のみ”上書き（= 保守的）
-    for j, row_id in enumerate(idx):
-        new_s = int(reclassified[j]["sentiment"])
-        new_t = _normalize_topic(reclassified[j]["topic"])
-        if new_s != 0:
-            dfx.at[row_id, "sentiment"] = float(new_s)
-            dfx.at[row_id, "topic"] = new_t
+    # 文脈付きで再判定（重複は代表1件だけ・同じ文脈・同じコメントはキャッシュから）
+    reclassified, _ = _classify_deduped(texts, lambda uniq: _classify_cached(
+        uniq, lambda batch: _call_gpt_batch_with_context(
+            batch, context_summary, segments=index.top_segments(batch, RETRIEVAL_TOP_K)),
+        batch_size, prefix_tokens=prefix, context=cache_context,
+    ), near=DEDUP_NEAR)
+    return _apply_refined(dfx, idx, reclassified)
 
+
+def _refine_setup(transcript_text: str, summarize: bool = False,
+                  progress: Optional[Callable[[int, int], None]] = None,
+                  context_summary: Optional[str] = None) -> Tuple[str, BM25Index, int, str]:
+    """
+    再判定の準備。返却: (全体要約（summarize=False なら空）, 区間検索の索引, 固定部分のトークン数, キャッシュの文脈)
+    添える区間はバッチごとに変わるので、固定部分は最長の区間 × 件数で見積もる。
+    作成済みの要約があれば context_summary に渡す（要約し直さない）。
+    """
+    if context_summary is None:
+        context_summary = _summarize_transcript_for_context(transcript_text, progress=progress) if summarize else ""
+    index = BM25Index(split_segments(transcript_text, RETRIEVAL_SEGMENT_CHARS))
+    longest = max(index.segments, key=len, default="")
+    prefix = count_tokens(SYSTEM_PROMPT) + count_tokens(
+        _build_user_prompt_with_context([], context_summary, [longest] * min(RETRIEVAL_TOP_K, len(index))))
+    cache_context = "refine\0" + context_summary + "\0" + context_key(transcript_text)
+    return context_summary, index, prefix, cache_context
+
+
+def _apply_refined(dfx: pd.DataFrame, idx: pd.Index, reclassified: List[Dict]) -> pd.DataFrame:
+    """再判定の結果を反映：0の行だけ、かつ“非0に変わった場合のみ”上書き（= 保守的）。dfx はその場で書き換える"""
+    new_s = np.fromiter((int(r["sentiment"]) for r in reclassified), dtype=np.int8, count=len(reclassified))
+    hit = new_s != 0
+    if hit.any():
+        rows = idx[hit]
+        new_t = [_normalize_topic(r["topic"]) for r, h in zip(reclassified, hit) if h]
+        dfx.loc[rows, "sentiment"] = new_s[hit].astype(dfx["sentiment"].dtype)
+        dfx.loc[rows, "topic"] = new_t
+        if "label_source" in dfx.columns:
+            dfx.loc[rows, "label_source"] = "refine"
     return dfx
 # ========= 追加ここまで =========
 
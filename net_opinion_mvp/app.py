@@ -1,24 +1,62 @@
-import os
-import pandas as pd
-import plotly.express as px
+import os, hashlib, logging
+from typing import Tuple
 import streamlit as st
-from analyze import enrich, kpi, refine_with_transcript
 
 st.set_page_config(page_title="ネット世論ダッシュボード(MVP)", layout="wide")
 
 st.title("ネット世論ダッシュボード (MVP)")
 st.caption("対象: 高市首相（初期MVP）。一般・識者の“見えにくい批判/支持”を簡易可視化。")
 
+# 重い import はタイトルを描画してから（openai・plotly は使う直前まで import しない）
+import pandas as pd
+from analyze import enrich_iter, kpi, refine_with_transcript, get_cache, backend_available, to_enriched_schema
+import rollup
+import telemetry
+from rolling import RollingKPI
+from commentdb import CommentDB, CommentQuery
+
+logger = logging.getLogger(__name__)
+
+# 性能パネルはこのセッションを開いてからの API 呼び出しだけを数える
+if "telemetry_start" not in st.session_state:
+    st.session_state["telemetry_start"] = telemetry.snapshot()
+
+# Parquet ストア（ingest_youtube.py / crawler.py の --store で作成）
+STORE_DIR = os.environ.get("COMMENT_STORE", "store")
+if os.path.isdir(STORE_DIR):
+    from store import CommentStore
+    store = CommentStore(STORE_DIR)
+else:
+    store = None
+
 st.sidebar.header("データ入力")
-uploaded = st.sidebar.file_uploader("コメントCSVをアップロード（columns: text, source, likes, published_at）", type=["csv"])
+# オフライン: API を呼ばず、保存済みの判定結果（ストア or 判定済みCSV）だけで表示する
+if backend_available():
+    offline = st.sidebar.checkbox("オフライン（保存済みの判定結果のみ表示）", value=False)
+else:
+    offline = True
+    st.sidebar.caption("API キー未設定（または OFFLINE=1）のため、保存済みの判定結果のみ表示します。")
+use_store = store is not None and st.sidebar.checkbox(f"保存済みデータを使う（{STORE_DIR}）", value=True)
 
-if uploaded is None:
-    st.info("サンプルデータを表示中。自分のCSVをアップロードすると切り替わります。")
-    df = pd.read_csv("sample_comments.csv")
+if use_store:
+    videos = store.list_videos()
+    f_videos = st.sidebar.multiselect("動画", videos, default=videos)
+    today = pd.Timestamp.now().date()
+    period = st.sidebar.date_input("期間", value=(today - pd.Timedelta(days=30), today))
+    start, end = (list(period) + [None, None])[:2] if isinstance(period, (list, tuple)) else (period, period)
+    filters = dict(video_ids=f_videos or None,
+                   start=start.isoformat() if start else None, end=end.isoformat() if end else None)
+    # 対象の動画・期間のパーティションだけを読む（オフラインでは判定済みの行しか使わないので読まない）
+    df = store.read_raw(**filters) if not offline else None
 else:
-    df = pd.read_csv(uploaded)
+    uploaded = st.sidebar.file_uploader("コメントCSVをアップロード（columns: text, source, likes, published_at）", type=["csv"])
+    if uploaded is None:
+        st.info("サンプルデータを表示中。自分のCSVをアップロードすると切り替わります。")
+        df = pd.read_csv("sample_comments.csv")
+    else:
+        df = pd.read_csv(uploaded)
 
-if df.empty:
+if df is not None and df.empty:
     st.warning("データが空です")
     st.stop()
 
@@ -28,70 +66,263 @@ transcript_text = st.sidebar.text_area(
     "ここに文字起こしを貼るだけで、0（不明）のみ文脈で再判定します。",
     height=180,
     placeholder="YouTube等の文字起こしをコピペ",
+    disabled=offline,
 )
-summarize_ctx = st.sidebar.checkbox("長文は要約して使う（推奨）", value=True)
-apply_ctx = st.sidebar.button("文脈で再判定（sentiment==0のみ）")
+summarize_ctx = st.sidebar.checkbox("全体要約も添える（要約の API 呼び出しが増えます）", value=False, disabled=offline)
+apply_ctx = st.sidebar.button("文脈で再判定（sentiment==0のみ）", disabled=offline)
+
+# KPI・時系列グラフの描画先（分類中はチャンクが届くたびに描き直す）
+progress_slot = st.empty()
+overview = st.empty()
+
+
+WINDOW_LABELS = {"1h": "直近1時間", "24h": "直近24時間", "7d": "直近7日"}
+
+
+def render_overview(roll: pd.DataFrame, key: str, engine: RollingKPI) -> None:
+    """KPI・直近ウィンドウの KPI・時系列グラフを overview に描く（key はこの実行内でグラフの要素 ID を分けるため）"""
+    import plotly.express as px
+
+    with overview.container():
+        metrics = kpi(None, roll)
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("コメント件数", f"{metrics['n_comments']:,}")
+        c2.metric("ポジ率", f"{metrics['pos_rate']*100:.1f}%")
+        c3.metric("ネガ率", f"{metrics['neg_rate']*100:.1f}%")
+        c4.metric("平均センチメント", f"{metrics['avg_sentiment']:.2f}")
+        st.caption(f"いいね加重（1件 = 1 + いいね数）: ポジ率 {metrics['weighted_pos_rate']*100:.1f}% / "
+                   f"ネガ率 {metrics['weighted_neg_rate']*100:.1f}% / 平均 {metrics['weighted_avg_sentiment']:.2f}")
+
+        # 直近ウィンドウ（最新の投稿時刻まで）と、その1つ前の同じ長さのウィンドウとの差
+        if engine.latest is not None:
+            latest = pd.Timestamp(engine.latest, unit="s", tz="UTC").tz_convert("Asia/Tokyo")
+            st.caption(f"直近の変化（最新の投稿 {latest:%Y-%m-%d %H:%M} まで。差は1つ前の同じ長さの期間との比較）")
+            for col, (name, w) in zip(st.columns(len(WINDOW_LABELS)), engine.snapshot().items()):
+                prev = w["previous"]
+                col.metric(f"{WINDOW_LABELS.get(name, name)}の加重ポジ率", f"{w['weighted_pos_rate']*100:.1f}%",
+                           delta=(f"{(w['weighted_pos_rate'] - prev['weighted_pos_rate'])*100:+.1f}pt"
+                                  if prev["n_comments"] else None))
+                col.caption(f"{w['n_comments']:,} 件（前 {prev['n_comments']:,} 件） / "
+                            f"加重ネガ率 {w['weighted_neg_rate']*100:.1f}% / ポジ率 {w['pos_rate']*100:.1f}%")
+
+        st.divider()
+
+        # 時系列（件数）
+        ts = rollup.daily(roll)
+        fig_ts = px.bar(ts, x="date", y="count", title="コメント件数の推移")
+        st.plotly_chart(fig_ts, use_container_width=True, key=f"ts_count_{key}")
+
+        # 時系列（平均センチメント）
+        ts_s = ts[["date", "sentiment"]]
+        fig_ts_s = px.line(ts_s, x="date", y="sentiment", title="平均センチメントの推移")
+        st.plotly_chart(fig_ts_s, use_container_width=True, key=f"ts_sentiment_{key}")
+
+
+def enrich_progressively(df: pd.DataFrame, base_roll: pd.DataFrame, base_engine: RollingKPI,
+                         on_chunk=None) -> Tuple[pd.DataFrame, RollingKPI]:
+    """
+    enrich_iter() のチャンクを st.session_state["enrich"] に貯めながら、届くたびに進捗・KPI・時系列を描き直す。
+    途中で再実行（ウィジェット操作など）されても、同じ df なら処理済みのチャンクは飛ばして続きから分類する。
+    base_roll / base_engine は分類済みの行（ストアの判定済み分）の集計。on_chunk はチャンクごとの保存用。
+    返却: (判定済みフレーム, base_engine に今回の行を足した直近ウィンドウの集計)
+    """
+    fp = hashlib.sha1(pd.util.hash_pandas_object(df[["text"]], index=True).to_numpy().tobytes()).hexdigest()
+    state = st.session_state.get("enrich")
+    if state is None or state["fingerprint"] != fp:
+        state = st.session_state["enrich"] = {"fingerprint": fp, "chunks": [], "roll": rollup.empty(),
+                                              "engine": RollingKPI(), "done": False}
+    if not state["done"]:
+        bar = progress_slot.progress(0.0, text="分類中…")
+        if state["chunks"]:
+            render_overview(rollup.merge(base_roll, state["roll"]), "resume",
+                            base_engine.copy().merge(state["engine"]))
+        for part in enrich_iter(df, start_chunk=len(state["chunks"])):
+            if on_chunk is not None:
+                on_chunk(part)
+            state["chunks"].append(part)
+            state["roll"] = rollup.merge(state["roll"], rollup.build(part))
+            state["engine"].add_frame(part)
+            p = part.attrs["progress"]
+            bar.progress(p["done"] / p["total"], text=f"分類中…（{p['done']:,} / {p['total']:,} 件）")
+            render_overview(rollup.merge(base_roll, state["roll"]), str(p["chunk"]),
+                            base_engine.copy().merge(state["engine"]))
+        state["done"] = True
+        progress_slot.empty()
+    chunks = state["chunks"]
+    dfx = pd.concat(chunks).sort_index()
+    dfx["source"] = dfx["source"].astype("category")  # チャンクごとにカテゴリが違うと object に戻るため
+    cascade = {k: sum(c.attrs["cascade"].get(k, 0) for c in chunks) for k in ("n_local", "n_gpt")}
+    n = cascade["n_local"] + cascade["n_gpt"]
+    cascade["offload_ratio"] = cascade["n_local"] / n if n else 0.0
+    dfx.attrs = {"dedup": chunks[0].attrs["dedup"], "cascade": cascade}
+    return dfx, base_engine.copy().merge(state["engine"])
+
 
 # 前処理・特徴量付与
-dfx = enrich(df)
+if use_store:
+    # 判定済みの行はストアから読み、未判定の行だけ分類して保存する
+    done = to_enriched_schema(store.read_enriched(**filters))
+    engine = RollingKPI.from_frame(done)
+    new = None
+    if not offline:
+        # チャンクごとに保存するので、途中で止まっても次回は残りの行だけを分類する
+        todo = df[~df["comment_id"].isin(done["comment_id"])]
+        if not todo.empty:
+            new, engine = enrich_progressively(todo, store.read_rollup(**filters), engine,
+                                               on_chunk=store.append_enriched)
+    dfx = pd.concat([done, new], ignore_index=True) if new is not None else done
+    if new is not None:
+        dfx["source"] = dfx["source"].astype("category")
+        dfx.attrs = new.attrs
+    if dfx.empty:
+        st.warning("判定済みのデータがありません")
+        st.stop()
+elif offline:
+    # 判定済みCSV（sentiment / topic 列つき）ならそのまま表示する
+    if not {"sentiment", "topic"} <= set(df.columns):
+        st.warning("オフラインでは判定済みのデータ（sentiment / topic 列つきCSV、または保存済みデータ）のみ表示できます")
+        st.stop()
+    dfx = to_enriched_schema(df)
+    if "heuristic_rule" not in dfx.columns:
+        dfx["heuristic_rule"] = None
+    engine = RollingKPI.from_frame(dfx)
+else:
+    dfx, engine = enrich_progressively(df, rollup.empty(), RollingKPI())
 
 # 文脈で再判定（0のみ・任意）
 if apply_ctx and transcript_text and transcript_text.strip():
-    dfx_before = dfx.copy()
-    dfx = refine_with_transcript(dfx, transcript_text.strip(), summarize=summarize_ctx)
-    try:
-        updated = (dfx_before['sentiment'] != dfx['sentiment']).sum()
-        st.sidebar.success(f"文脈再判定を適用：{updated} 件更新")
-    except Exception:
-        pass
-
-# KPI
-metrics = kpi(dfx)
-c1, c2, c3, c4 = st.columns(4)
-c1.metric("コメント件数", f"{metrics['n_comments']:,}")
-c2.metric("ポジ率", f"{metrics['pos_rate']*100:.1f}%")
-c3.metric("ネガ率", f"{metrics['neg_rate']*100:.1f}%")
-c4.metric("平均センチメント", f"{metrics['avg_sentiment']:.2f}")
-
-st.divider()
-
-# 時系列（件数）
-ts = dfx.groupby('date').size().reset_index(name='count')
-fig_ts = px.bar(ts, x="date", y="count", title="コメント件数の推移")
-st.plotly_chart(fig_ts, use_container_width=True)
-
-# 時系列（平均センチメント）
-ts_s = dfx.groupby('date')['sentiment'].mean().reset_index()
-fig_ts_s = px.line(ts_s, x="date", y="sentiment", title="平均センチメントの推移")
-st.plotly_chart(fig_ts_s, use_container_width=True)
+    # 書き換わるのは sentiment / topic だけなので、その2列（int8 + カテゴリ）だけ控えておく
+    before = dfx[["sentiment", "topic"]].copy()
+    bar = st.sidebar.progress(0.0, text="文字起こしを要約中…")
+    dfx = refine_with_transcript(
+        dfx, transcript_text.strip(), summarize=summarize_ctx,
+        progress=lambda done, total: bar.progress(done / total, text=f"文字起こしを要約中…（{done}/{total}）"),
+    )
+    bar.empty()
+    changed = before['sentiment'] != dfx['sentiment']
+    updated = changed.sum()
+    if updated:
+        new_rows = dfx[changed]
+        old_rows = new_rows.assign(sentiment=before.loc[changed, "sentiment"], topic=before.loc[changed, "topic"])
+        # 直近ウィンドウは変わった行だけ差し替える（旧い値を引いて新しい値を足す）
+        engine = engine.copy()
+        engine.add_frame(old_rows, sign=-1)
+        engine.add_frame(new_rows)
+        if use_store:
+            import pyarrow as pa
+            try:
+                store.append_enriched(new_rows, replaces=old_rows)
+            except (OSError, pa.ArrowException) as e:
+                logger.exception("再判定の結果をストアに保存できませんでした")
+                st.sidebar.warning(f"再判定の結果をストアに保存できませんでした（表示のみ更新。集計表は更新前のまま）: {e}")
+    st.sidebar.success(f"文脈再判定を適用：{updated} 件更新")
+
+# 分類キャッシュの状況
+cache = get_cache()
+if cache is not None:
+    cs = cache.stats()
+    st.sidebar.caption(f"分類キャッシュ: ヒット {cs['hits']:,} / ミス {cs['misses']:,}（保存 {cs['size']:,} 件）")
+dd = dfx.attrs.get("dedup")
+if dd:
+    st.sidebar.caption(f"重複除去: {dd['n_rows']:,} 件 → {dd['n_unique']:,} 件を分類（削減 {dd['dedup_ratio']*100:.1f}%）")
+cc = dfx.attrs.get("cascade")
+if cc and cc.get("n_local"):
+    st.sidebar.caption(f"ローカル分類器: {cc['n_local']:,} 件を判定（GPT {cc['n_gpt']:,} 件 / オフロード {cc['offload_ratio']*100:.1f}%）")
+
+# API 呼び出しの性能（このセッション）
+perf = telemetry.summarize(telemetry.diff(telemetry.snapshot(), st.session_state["telemetry_start"]))
+with st.sidebar.expander("性能（このセッション）", expanded=False):
+    if perf["calls"]:
+        p1, p2 = st.columns(2)
+        p1.metric("1000件あたりコスト", f"${perf['cost_per_1k_comments']:.4f}")
+        p2.metric("スループット", f"{perf['comments_per_sec']:,.1f} 件/秒")
+        p1.metric("エラー率", f"{perf['error_rate']*100:.1f}%")
+        p2.metric("429 再送率", f"{perf['retry_rate']*100:.1f}%")
+        st.caption(
+            f"API 呼び出し {perf['calls']:,} 回 / 分類 {perf['comments']:,} 件 / 合計 ${perf['cost_usd']:.4f} / "
+            f"平均遅延 {perf['avg_latency_ms']:,.0f} ms / JSON 救済パース {perf['regex_fallback_rate']*100:.1f}% / "
+            f"パース失敗 {perf['parse_failure_rate']*100:.1f}%"
+        )
+    else:
+        st.caption("このセッションではまだ API を呼んでいません（キャッシュ・保存済みの結果のみ）")
+
+# KPI・グラフは 日付×トピック×ソース の集計表から計算する
+# （ストアでは append_enriched() のたびに差分更新済みの集計表を読むだけ）
+roll = store.read_rollup(**filters) if use_store else rollup.build(dfx)
+render_overview(roll, "final", engine)
+
+import plotly.express as px
 
 # トピック円グラフ
-topic_counts = dfx['topic'].value_counts().reset_index()
-topic_counts.columns = ['topic','count']
+topic_counts = rollup.by_topic(roll)
 fig_topic = px.pie(topic_counts, names='topic', values='count', title="話題トピック構成比")
 st.plotly_chart(fig_topic, use_container_width=True)
 
 # ソース別ポジ/ネガ率
-src_stats = dfx.groupby('source').agg(pos_rate=('sentiment', lambda s: (s>0).mean()),
-                                      neg_rate=('sentiment', lambda s: (s<0).mean()),
-                                      n=('sentiment','count')).reset_index()
+src_stats = rollup.by_source(roll)
 st.subheader("ソース別ポジ/ネガ率")
 st.dataframe(src_stats)
 
-# 明細テーブル（フィルタ）
+# 明細テーブル（絞り込み・並べ替え・本文検索は SQLite 側で行い、画面には表示する1ページだけ送る）
+SORT_LABELS = {("published_at", True): "新しい順", ("published_at", False): "古い順",
+               ("likes", True): "いいねの多い順", ("sentiment", True): "ポジ → ネガ", ("sentiment", False): "ネガ → ポジ"}
+
+
+def comment_db(dfx: pd.DataFrame) -> CommentDB:
+    """dfx を入れた CommentDB（本文・判定結果・件数が変わるまで st.session_state に持っておく）"""
+    cols = [c for c in ("comment_id", "text", "date", "source", "topic", "sentiment", "likes") if c in dfx.columns]
+    fp = hashlib.sha1(pd.util.hash_pandas_object(dfx[cols], index=True).to_numpy().tobytes()).hexdigest()
+    cached = st.session_state.get("comment_db")
+    if cached is None or cached[0] != fp:
+        with st.spinner("コメント一覧の索引を作成中…"):
+            cached = st.session_state["comment_db"] = (fp, CommentDB.from_frame(dfx))
+    return cached[1]
+
+
 st.subheader("コメント一覧（フィルター可）")
-col1, col2 = st.columns(2)
+db = comment_db(dfx)
+col1, col2, col3 = st.columns(3)
 with col1:
-    f_source = st.multiselect("ソースで絞り込み", sorted(dfx['source'].dropna().unique().tolist()))
+    f_source = st.multiselect("ソースで絞り込み", sorted(src_stats['source'].tolist()))
 with col2:
-    f_topic = st.multiselect("トピックで絞り込み", sorted(dfx['topic'].dropna().unique().tolist()))
+    f_topic = st.multiselect("トピックで絞り込み", sorted(topic_counts['topic'].tolist()))
+with col3:
+    f_sentiment = st.multiselect("センチメントで絞り込み", [1, 0, -1])
+col4, col5, col6, col7 = st.columns([3, 2, 1, 1])
+f_search = col4.text_input("本文を検索（空白区切りの語をすべて含むもの）")
+days = dfx["date"].dropna()
+f_period = col5.date_input("投稿日", value=(days.min().date(), days.max().date()) if len(days) else ())
+f_start, f_end = (list(f_period) + [None, None])[:2] if isinstance(f_period, (list, tuple)) else (f_period, f_period)
+f_sort = col6.selectbox("並び順", list(SORT_LABELS), format_func=SORT_LABELS.get)
+page_size = col7.selectbox("表示件数", [50, 100, 200])
+
+query = CommentQuery(sources=f_source, topics=f_topic, sentiments=f_sentiment, search=f_search,
+                     start=f_start.isoformat() if f_start else None, end=f_end.isoformat() if f_end else None,
+                     sort=f_sort[0], descending=f_sort[1])
+# ページ送りはキーセット方式：見てきたページの先頭カーソルを積んでおき、「前へ」で1つ戻る
+pager = st.session_state.setdefault("pager", {"key": None, "cursors": [None], "next": None})
+pager_key = (query.key(), page_size, st.session_state["comment_db"][0])
+if pager["key"] != pager_key:
+    pager.update(key=pager_key, cursors=[None], next=None)
+
+
+def _next_page() -> None:
+    if pager["next"] is not None:
+        pager["cursors"].append(pager["next"])
+
+
+def _prev_page() -> None:
+    if len(pager["cursors"]) > 1:
+        pager["cursors"].pop()
 
-view = dfx.copy()
-if f_source:
-    view = view[view['source'].isin(f_source)]
-if f_topic:
-    view = view[view['topic'].isin(f_topic)]
 
-st.dataframe(view[['published_at','source','topic','sentiment','likes','text']].sort_values('published_at', ascending=False), use_container_width=True)
+page, pager["next"] = db.page(query, after=pager["cursors"][-1], limit=page_size)
+total = db.count(query)
+st.dataframe(page, use_container_width=True, hide_index=True)
+nav1, nav2, nav3 = st.columns([1, 1, 4])
+nav1.button("← 前へ", on_click=_prev_page, disabled=len(pager["cursors"]) == 1)
+nav2.button("次へ →", on_click=_next_page, disabled=pager["next"] is None)
+first = (len(pager["cursors"]) - 1) * page_size
+nav3.caption(f"{total:,} 件中 {first + 1 if len(page) else 0:,}〜{first + len(page):,} 件目")
 
 st.caption("※ センチメントは簡易辞書ベースのスコア（-1〜1）。本番では高精度モデル/外部APIに置換してください。")
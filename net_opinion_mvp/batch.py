@@ -0,0 +1,161 @@
+"""
+大きなコメントダンプをダッシュボードを使わずに判定するバッチ処理（メモリ使用量は入力の件数によらず一定）。
+使い方:
+  python batch.py comments_*.csv -o out/enriched --chunk-rows 20000
+  python batch.py dump.parquet -o out/enriched --transcript transcript.txt --summarize
+
+- 入力（CSV / Parquet ファイル、Parquet はディレクトリも可）を chunk-rows 行ずつ読み、
+  チャンクごとに 重複除去 → 分類（ローカル分類器 → GPT）→ 救済ロジック →（任意）文字起こしで再判定 を行う
+- 結果はチャンクごとに <out>/part-<入力番号>-<チャンク番号>.parquet へ書く（store.ENRICHED_SCHEMA）
+- 書き終えたチャンクは <out>/_manifest.json に記録する。落ちても同じコマンドで再実行すれば続きから
+  （入力・チャンク行数・プロンプト・文字起こしが変わっていたら --restart でやり直す）
+- チャンクをまたいだ重複は分類キャッシュ（CLASSIFY_CACHE_PATH）で API を呼ばずに済ませる
+"""
+import os, sys, json, time, argparse
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from analyze import PROMPT_VERSION, enrich, refine_with_transcript
+from cache import context_key
+from store import ENRICHED_SCHEMA, to_table
+
+MANIFEST = "_manifest.json"
+
+
+def _peak_rss_mb() -> float:
+    """ピーク RSS（MB）。resource が無い環境（Windows）では NaN"""
+    try:
+        import resource
+    except ImportError:
+        return float("nan")
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return (rss if sys.platform == "darwin" else rss * 1024) / 2 ** 20
+
+
+def _input_fingerprint(path: str) -> Dict:
+    st = os.stat(path)
+    return {"path": os.path.abspath(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def read_chunks(path: str, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """CSV / Parquet を chunk_rows 行ずつ読む（最後のチャンク以外はちょうど chunk_rows 行）"""
+    if path.endswith(".csv") or path.endswith(".csv.gz"):
+        yield from pd.read_csv(path, chunksize=chunk_rows, dtype={"text": str})
+        return
+    batches, n = [], 0
+    for b in ds.dataset(path, format="parquet").to_batches(batch_size=chunk_rows):
+        while b.num_rows:
+            take = b.slice(0, chunk_rows - n)
+            batches.append(take)
+            n += take.num_rows
+            b = b.slice(take.num_rows)
+            if n == chunk_rows:
+                yield pd.concat([x.to_pandas() for x in batches], ignore_index=True)
+                batches, n = [], 0
+    if batches:
+        yield pd.concat([x.to_pandas() for x in batches], ignore_index=True)
+
+
+def _load_manifest(path: str) -> Dict:
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def _save_manifest(path: str, manifest: Dict) -> None:
+    """途中で落ちても壊れないよう一時ファイル経由で置き換える"""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _write_part(dfx: pd.DataFrame, path: str) -> None:
+    # 書きかけのファイルは "." 始まりにして、出力ディレクトリを読むときに拾われないようにする
+    tmp = os.path.join(os.path.dirname(path), "." + os.path.basename(path) + ".tmp")
+    pq.write_table(to_table(dfx, ENRICHED_SCHEMA), tmp)
+    os.replace(tmp, path)
+
+
+def run(inputs: List[str], out_dir: str, chunk_rows: int = 20_000, transcript: Optional[str] = None,
+        summarize: bool = False, restart: bool = False) -> Dict:
+    """
+    inputs を判定して out_dir に書く。返却: {"chunks", "skipped", "rows", "elapsed_sec"}
+    manifest の設定（入力・chunk_rows・プロンプト・文字起こし）が今回と違えば ValueError（restart=True なら作り直す）。
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST)
+    config = {
+        "inputs": [_input_fingerprint(p) for p in inputs],
+        "chunk_rows": chunk_rows,
+        "prompt_version": PROMPT_VERSION,
+        "transcript": context_key(transcript) if transcript else None,
+        "summarize": bool(transcript and summarize),
+    }
+    manifest = _load_manifest(manifest_path)
+    if manifest and manifest.get("config") != config:
+        if not restart:
+            raise ValueError(f"{manifest_path} の設定が今回と違います（入力やオプションを変えたなら --restart）")
+        manifest = {}
+    if not manifest:
+        for name in os.listdir(out_dir):
+            if name.startswith(("part-", ".part-")):
+                os.remove(os.path.join(out_dir, name))
+        manifest = {"config": config, "chunks": {}}
+        _save_manifest(manifest_path, manifest)
+
+    done: Dict[str, Dict] = manifest["chunks"]
+    n_chunks = n_skipped = n_rows = 0
+    t_start = time.perf_counter()
+    for i, path in enumerate(inputs):
+        for j, chunk in enumerate(read_chunks(path, chunk_rows)):
+            name = f"part-{i:03d}-{j:06d}.parquet"
+            if name in done:
+                n_skipped += 1
+                continue
+            t0 = time.perf_counter()
+            dfx = enrich(chunk)
+            if transcript:
+                dfx = refine_with_transcript(dfx, transcript, summarize=summarize)
+            _write_part(dfx, os.path.join(out_dir, name))
+            # ファイルを書き終えてから記録する（記録前に落ちたら次回このチャンクを書き直す）
+            done[name] = {"input": path, "rows": len(dfx), "dedup": dfx.attrs.get("dedup"),
+                          "cascade": dfx.attrs.get("cascade")}
+            _save_manifest(manifest_path, manifest)
+            n_chunks += 1
+            n_rows += len(dfx)
+            dt = time.perf_counter() - t0
+            print(f"{name}: {len(dfx):,} 件 {dt:.1f} 秒（{len(dfx) / dt if dt else 0:,.0f} 件/秒）"
+                  f" RSS {_peak_rss_mb():.0f} MB", file=sys.stderr)
+    manifest["completed_at"] = time.time()
+    _save_manifest(manifest_path, manifest)
+    return {"chunks": n_chunks, "skipped": n_skipped, "rows": n_rows,
+            "elapsed_sec": time.perf_counter() - t_start}
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="コメントダンプ（CSV / Parquet）をチャンクごとに判定して Parquet に書く")
+    ap.add_argument("inputs", nargs="+", help="CSV / Parquet（columns: text, source, likes, published_at）")
+    ap.add_argument("-o", "--out-dir", required=True, help="出力先ディレクトリ（part-*.parquet と _manifest.json）")
+    ap.add_argument("--chunk-rows", type=int, default=20_000, help="1チャンクの行数（メモリ使用量はこれで決まる）")
+    ap.add_argument("--transcript", default=None, help="文字起こしのテキストファイル（sentiment==0 の行を文脈で再判定）")
+    ap.add_argument("--summarize", action="store_true", help="再判定で全体要約も添える")
+    ap.add_argument("--restart", action="store_true", help="manifest を捨てて最初からやり直す")
+    args = ap.parse_args()
+
+    transcript = None
+    if args.transcript:
+        with open(args.transcript, encoding="utf-8") as f:
+            transcript = f.read().strip() or None
+    try:
+        res = run(args.inputs, args.out_dir, chunk_rows=args.chunk_rows, transcript=transcript,
+                  summarize=args.summarize, restart=args.restart)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+    print(f"完了: {res['rows']:,} 件 / {res['chunks']} チャンク（再開で飛ばした {res['skipped']} チャンク）"
+          f" {res['elapsed_sec']:.1f} 秒", file=sys.stderr)
@@ -0,0 +1,77 @@
+# batching.py — トークン予算に合わせてバッチを詰める（固定件数バッチの置き換え）
+"""
+コメントごとのトークン数をローカルのトークナイザ（tiktoken。無ければ文字数からの概算）で数え、
+1リクエストの入力/出力トークン予算いっぱいまでコメントを詰める。
+
+- 入力予算: 固定プレフィックス（SYSTEM_PROMPT + 指示部）+ コメント本体
+- 出力予算: 1件あたりの出力見込み × 件数
+- 並びは入力順のまま（プレフィックスは毎回同一なので API 側のプロンプトキャッシュが効く）
+"""
+import json, threading
+from functools import lru_cache
+from typing import List
+
+_ENCODING = None
+_ENCODING_LOADED = False
+_ENCODING_LOCK = threading.Lock()
+
+
+def _encoding():
+    """
+    tiktoken のエンコーディング（初回に import。未導入・語彙ファイルを取得できないオフライン環境などでは None）
+    """
+    global _ENCODING, _ENCODING_LOADED
+    with _ENCODING_LOCK:
+        if not _ENCODING_LOADED:
+            try:
+                import tiktoken
+            except Exception:  # 任意依存：無ければ概算で動く
+                tiktoken = None
+            if tiktoken is not None:
+                for name in ("o200k_base", "cl100k_base"):
+                    try:
+                        _ENCODING = tiktoken.get_encoding(name)
+                        break
+                    except Exception:
+                        continue
+            _ENCODING_LOADED = True
+    return _ENCODING
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """text のトークン数（tiktoken が無い環境では 日本語混在を想定して 2文字≒1トークン）"""
+    if not text:
+        return 0
+    enc = _encoding()
+    if enc is None:
+        return len(text) // 2 + 1
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def item_tokens(i: int, text: str) -> int:
+    """入力配列に入る {"id": i, "text": t} 1件分のトークン数（区切りの ", " 込み）"""
+    return count_tokens(json.dumps({"id": i, "text": text}, ensure_ascii=False)) + 1
+
+
+def pack_batches(texts: List[str], prefix_tokens: int, input_budget: int, output_budget: int,
+                 output_per_item: int = 24, max_items: int = 100) -> List[List[int]]:
+    """
+    texts を入力順に詰め、バッチごとの位置リストを返す。
+    1件で予算を超える長文はその1件だけのバッチにする。
+    """
+    batches: List[List[int]] = []
+    cur: List[int] = []
+    used = prefix_tokens
+    max_by_output = max(1, min(max_items, output_budget // max(output_per_item, 1)))
+    for i, t in enumerate(texts):
+        cost = item_tokens(len(cur), t)
+        if cur and (used + cost > input_budget or len(cur) >= max_by_output):
+            batches.append(cur)
+            cur, used = [], prefix_tokens
+            cost = item_tokens(0, t)
+        cur.append(i)
+        used += cost
+    if cur:
+        batches.append(cur)
+    return batches
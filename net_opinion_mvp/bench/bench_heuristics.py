@@ -0,0 +1,73 @@
+"""
+救済ロジック（_heuristic_adjust_sentiment）の per-row 版と列単位版の比較マイクロベンチマーク。
+使い方:
+  python bench/bench_heuristics.py --rows 200000
+
+両者の sentiment・発火ルールが1件でも食い違えば終了コード 1 で止まる。
+"""
+import os, re, sys, time, random, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pandas as pd
+import analyze
+
+_FRAGMENTS = [
+    "高市さん頑張って", "高市 さん 頑張って", "早苗ちゃん頑張って", "総理かわいそう", "彼女を休ませてあげて",
+    "いじめはやめろ", "パワハラ酷すぎ", "よく頑張ってる", "倒れないで", "高市は無理", "高市　最悪",
+    "こいつはダメ", "総理は終わってる", "高市続投で", "高市しか勝たん", "物価がつらい", "税制改革は具体性が足りず不安",
+    "外交方針は強気で安心する", "立憲はほんとどーでもいい質問ばかり", "説明が不十分で不信感", "💢💢", "www",
+    "\n", "。", "高市", "総理", "",
+]
+
+
+def make_corpus(n: int, seed: int = 0) -> pd.DataFrame:
+    rng = random.Random(seed)
+    texts = ["".join(rng.choice(_FRAGMENTS) for _ in range(rng.randint(1, 4))) for _ in range(n)]
+    sentiments = [rng.choice((-1, 0, 1)) for _ in range(n)]
+    return pd.DataFrame({"text": texts, "sentiment": sentiments})
+
+
+def first_rule(text) -> str:
+    """per-row 版と同じ順で最初に一致したパターン（ルール名の突き合わせ用）"""
+    if not isinstance(text, str):
+        return None
+    t = text.replace(" ", "").replace("　", "")
+    for pat in analyze._NEG_PATTERNS + analyze._POS_PATTERNS:
+        if re.search(pat, t):
+            return pat
+    return None
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=100_000)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    df = make_corpus(args.rows)
+    texts, s = df["text"], df["sentiment"]
+
+    best_old = best_new = float("inf")
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        old = [analyze._heuristic_adjust_sentiment(t, v) for t, v in zip(texts.tolist(), s.tolist())]
+        best_old = min(best_old, time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        new, rule = analyze._heuristic_adjust_sentiment_series(texts, s)
+        best_new = min(best_new, time.perf_counter() - t0)
+
+    mismatch = int((pd.Series(old, index=s.index) != new).sum())
+    ref_rule = [first_rule(t) for t in texts.tolist()]
+    rule_mismatch = sum(a != b for a, b in zip(ref_rule, rule.tolist()))
+    print(f"rows={args.rows:,}")
+    print(f"per-row : {best_old:.3f}s ({args.rows / best_old:,.0f} rows/s)")
+    print(f"vector  : {best_new:.3f}s ({args.rows / best_new:,.0f} rows/s)  x{best_old / best_new:.1f}")
+    print(f"fired   : {rule.notna().mean() * 100:.1f}%")
+    print(f"mismatch: {mismatch} (sentiment) / {rule_mismatch} (rule)")
+    return 1 if mismatch or rule_mismatch else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
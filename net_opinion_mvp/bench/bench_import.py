@@ -0,0 +1,59 @@
+"""
+起動時間（import 時間）のベンチマーク。毎回新しいプロセスで import し、中央値を比べる。
+使い方:
+  python bench/bench_import.py --repeat 5
+
+- lazy  : 現在の analyze / app の import（openai・tiktoken・plotly は使う直前まで読まない）
+- eager : 以前と同じく openai・tiktoken・plotly まで起動時に読んだ場合
+OPENAI_API_KEY を外した環境で実行し、キー無しでも import できることも確かめる。
+"""
+import os, sys, json, argparse, statistics, subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+SCENARIOS = [
+    ("analyze (lazy)", "import analyze"),
+    ("analyze (eager)", "import analyze, openai, tiktoken"),
+    ("app imports (lazy)", "import streamlit, pandas, analyze, rollup"),
+    ("app imports (eager)", "import streamlit, pandas, plotly.express, analyze, rollup, store, openai, tiktoken"),
+]
+
+_PROBE = """
+import time, json
+t0 = time.perf_counter()
+{code}
+print(json.dumps(time.perf_counter() - t0))
+"""
+
+
+def measure(code: str, repeat: int) -> list:
+    env = {k: v for k, v in os.environ.items() if k != "OPENAI_API_KEY"}
+    out = []
+    for _ in range(repeat):
+        res = subprocess.run([sys.executable, "-c", _PROBE.format(code=code)], cwd=ROOT, env=env,
+                             capture_output=True, text=True)
+        if res.returncode != 0:
+            raise RuntimeError(f"{code!r} の import に失敗しました:\n{res.stderr}")
+        out.append(json.loads(res.stdout.strip().splitlines()[-1]))
+    return out
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    measure("import analyze", 1)  # バイトコードのキャッシュを温める
+    results = {}
+    for name, code in SCENARIOS:
+        t = measure(code, args.repeat)
+        results[name] = statistics.median(t)
+        print(f"{name:<22}: median {results[name] * 1000:7.1f} ms  (min {min(t) * 1000:.1f} ms)")
+    for base in ("analyze", "app imports"):
+        lazy, eager = results[f"{base} (lazy)"], results[f"{base} (eager)"]
+        print(f"{base:<22}: x{eager / lazy:.1f} faster ({(eager - lazy) * 1000:.0f} ms saved)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""
+判定済みフレームのメモリ使用量のベンチマーク（以前の列型 vs ENRICHED_DTYPES）。API は呼ばない。
+使い方:
+  python bench/bench_memory.py --rows 1m
+
+- frame : 判定済みフレームそのものの大きさ（列ごとの deep なバイト数）
+- flow  : app.py の流れ（enrich → 再判定前の控え → 明細の絞り込み）で確保されるメモリのピーク（tracemalloc）
+    legacy  : df.copy() → sentiment float64 / topic・source object / likes int64 / date は date オブジェクト
+              → dfx.copy() で再判定前を控え → dfx.copy() から明細を絞り込み
+    compact : 浅いコピーに int8 / カテゴリ / int32 / datetime64 の列を足す → sentiment・topic の2列だけ控える
+              → 行マスクで絞り込み（絞り込みなしならコピーしない）
+- kpi   : 集計表を作って数える（以前の kpi()）vs int8 の sentiment を np.bincount で数える
+ラベルは乱数で付ける（分類の中身ではなく入れ物の大きさを比べるため）。
+"""
+import os, sys, time, argparse, tracemalloc
+from typing import Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(0, BENCH_DIR)
+
+import numpy as np
+import pandas as pd
+
+import analyze
+import rollup
+from corpus import make_comments, parse_size
+
+
+def random_labels(n: int, seed: int = 0) -> List[Dict]:
+    rng = np.random.default_rng(seed)
+    s = rng.integers(-1, 2, n)
+    t = rng.integers(0, len(analyze.TOPIC_LABELS), n)
+    return [{"sentiment": int(a), "topic": analyze.TOPIC_LABELS[b]} for a, b in zip(s, t)]
+
+
+def legacy_enrich(df: pd.DataFrame, labels: List[Dict]) -> pd.DataFrame:
+    """以前の enrich() と同じ列型で判定結果を付ける"""
+    dfx = df.copy()
+    dfx["text"] = dfx["text"].astype(str).fillna("")
+    raw_s = pd.Series([int(item.get("sentiment", 0)) for item in labels], index=dfx.index)
+    fixed_s, rule = analyze._heuristic_adjust_sentiment_series(dfx["text"], raw_s)
+    dfx["sentiment"] = fixed_s.astype(float)
+    dfx["topic"] = [item.get("topic", "その他") for item in labels]
+    dfx["heuristic_rule"] = rule
+    dfx["source"] = dfx["source"].astype(object)
+    dfx["likes"] = dfx["likes"].astype("int64")
+    dfx["date"] = pd.to_datetime(dfx["published_at"], errors="coerce").dt.date
+    return dfx
+
+
+def compact_enrich(df: pd.DataFrame, labels: List[Dict]) -> pd.DataFrame:
+    """enrich() と同じく浅いコピーに ENRICHED_DTYPES の列を足す"""
+    dfx = df.copy(deep=False)
+    dfx["text"] = dfx["text"].astype(str).fillna("")
+    return analyze._apply_labels(dfx, labels)
+
+
+def legacy_flow(df: pd.DataFrame, labels: List[Dict]) -> int:
+    dfx = legacy_enrich(df, labels)
+    dfx_before = dfx.copy()
+    view = dfx.copy()
+    view = view[view["source"].isin(["YouTube"])]
+    return len(dfx_before) + len(view)
+
+
+def compact_flow(df: pd.DataFrame, labels: List[Dict]) -> int:
+    dfx = compact_enrich(df, labels)
+    before = dfx[["sentiment", "topic"]].copy()
+    view = dfx[dfx["source"].isin(["YouTube"])]
+    return len(before) + len(view)
+
+
+def traced_peak(fn, *args) -> int:
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak - base
+
+
+def timed(fn, *args, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="判定済みフレームのメモリ使用量（以前の列型 vs ENRICHED_DTYPES）")
+    ap.add_argument("--rows", default="1m", help="件数（1k / 100k / 1m など）")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    n = parse_size(args.rows)
+    df = make_comments(n, seed=args.seed)
+    labels = random_labels(n, args.seed)
+    mb = 2 ** 20
+
+    legacy, compact = legacy_enrich(df, labels), compact_enrich(df, labels)
+    assert (legacy["sentiment"].to_numpy() == compact["sentiment"].to_numpy()).all()
+    assert analyze.kpi(compact) == rollup.kpi(rollup.build(legacy))
+
+    print(f"--- frame（{n:,} 件） ---")
+    lm, cm = legacy.memory_usage(deep=True), compact.memory_usage(deep=True)
+    for col in ["sentiment", "topic", "source", "likes", "date"]:
+        print(f"{col:<10}: {lm[col] / mb:9.1f} MB → {cm[col] / mb:9.1f} MB")
+    print(f"{'total':<10}: {lm.sum() / mb:9.1f} MB → {cm.sum() / mb:9.1f} MB  (x{lm.sum() / cm.sum():.1f})")
+    del legacy, compact
+
+    print("--- flow（確保メモリのピーク） ---")
+    pl, pc = traced_peak(legacy_flow, df, labels), traced_peak(compact_flow, df, labels)
+    print(f"legacy    : {pl / mb:9.1f} MB\ncompact   : {pc / mb:9.1f} MB  (x{pl / pc:.1f})")
+
+    print("--- kpi ---")
+    legacy, compact = legacy_enrich(df, labels), compact_enrich(df, labels)
+    tl = timed(lambda: rollup.kpi(rollup.build(legacy)))
+    tc = timed(lambda: analyze.kpi(compact))
+    print(f"rollup.build + kpi : {tl * 1000:8.2f} ms\nnp.bincount (int8) : {tc * 1000:8.2f} ms  (x{tl / tc:.0f})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+"""
+enrich() / refine_with_transcript() / fetch_comments_incremental() のスループット計測（API料金なし）。
+使い方:
+  python bench/bench_pipeline.py --sizes 1k,100k --latency 0.2 --error-rate 0.01 --malformed-rate 0.02
+  python bench/bench_pipeline.py --sizes 1k --compare bench/results/bench-20251201-120000.json
+
+- GPT はローカルのモックサーバ（mock_openai_server.py）、YouTube はメモリ上の偽クライアントで置き換える
+- コメントは bench/corpus.py の合成コーパス（seed 固定なので毎回同じ）
+- シナリオ × 件数ごとに別プロセスで実行し、次を bench/results/bench-<日時>.json に保存する
+    comments_per_sec / 呼び出し遅延の p50・p95・p99 / 再送（429・500・壊れた応答）/ ピーク RSS
+- --compare で以前の結果 JSON と比べる
+"""
+import os, sys, json, time, argparse, platform, subprocess, tempfile, threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+SCENARIOS = ["enrich", "refine", "fetch"]
+
+
+def _peak_rss_bytes() -> Optional[int]:
+    """ピーク RSS（バイト）。resource が無い環境（Windows）では None"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return int(rss if sys.platform == "darwin" else rss * 1024)
+
+
+def _mb(x: Optional[float]) -> str:
+    return f"{x:.0f}" if x is not None else "-"
+
+
+def _percentiles(lat: List[float]) -> Dict[str, float]:
+    if not lat:
+        return {"p50": None, "p95": None, "p99": None}
+    a = np.asarray(lat) * 1000.0
+    return {f"p{q}": float(np.percentile(a, q)) for q in (50, 95, 99)}
+
+
+# ---- 子プロセス側（1シナリオ × 1件数） ----
+class _FakeRequest:
+    def __init__(self, yt: "_FakeYouTube", page: int):
+        self.yt, self.page = yt, page
+
+    def execute(self) -> Dict:
+        t0 = time.perf_counter()
+        if self.yt.latency:
+            time.sleep(self.yt.latency)
+        rows = self.yt.df.iloc[self.page * 100:(self.page + 1) * 100]
+        items = [{
+            "id": f"c{self.page}_{i}",
+            "snippet": {
+                "totalReplyCount": 0,
+                "topLevelComment": {"id": f"c{self.page}_{i}", "snippet": {
+                    "textDisplay": r.text, "likeCount": int(r.likes),
+                    # order=time（新しい順）を再現するため時刻を逆順に振る
+                    "publishedAt": self.yt.published[self.page * 100 + i],
+                }},
+            },
+        } for i, r in enumerate(rows.itertuples())]
+        res = {"items": items}
+        if (self.page + 1) * 100 < len(self.yt.df):
+            res["nextPageToken"] = f"p{self.page + 1}"
+        self.yt.latencies.append(time.perf_counter() - t0)
+        return res
+
+
+class _FakeYouTube:
+    """commentThreads().list / list_next だけを持つ偽クライアント（1ページ100件）"""
+
+    def __init__(self, df, latency: float):
+        self.df, self.latency, self.latencies = df, latency, []
+        self.published = sorted(df["published_at"].tolist(), reverse=True)
+
+    def commentThreads(self):
+        return self
+
+    def list(self, **params):
+        return _FakeRequest(self, int(params.get("pageToken", "p0")[1:]))
+
+    def list_next(self, req, res):
+        return _FakeRequest(self, req.page + 1) if res.get("nextPageToken") else None
+
+
+def run_child(cfg: Dict) -> Dict:
+    from mock_openai_server import MockConfig, serve
+    import corpus
+
+    mock = MockConfig(latency=cfg["latency"], rate_limit_rate=cfg["rate_limit_rate"],
+                      retry_after=cfg["retry_after"], seed=cfg["seed"],
+                      error_rate=cfg["error_rate"], malformed_rate=cfg["malformed_rate"])
+    server = serve(0, mock)
+    os.environ.update({
+        "OPENAI_API_KEY": "dummy",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{server.server_address[1]}/v1",
+        "CLASSIFY_CACHE_PATH": "",   # 毎回 API（モック）まで届かせる
+        "DISTILL_MODEL_PATH": "",
+        "OPENAI_CONCURRENCY": str(cfg["concurrency"]),
+        "OPENAI_RPM": "0",
+        "OPENAI_TPM": "0",
+    })
+    import logging
+    logging.disable(logging.WARNING)
+    import analyze
+
+    df = corpus.make_comments(cfg["rows"], seed=cfg["seed"])
+    latencies: List[float] = []
+    lock = threading.Lock()
+    orig = analyze._chat_completion
+
+    def timed(*args, **kwargs):
+        t0 = time.perf_counter()
+        try:
+            return orig(*args, **kwargs)
+        finally:
+            with lock:
+                latencies.append(time.perf_counter() - t0)
+
+    analyze._chat_completion = timed
+    analyze._get_client()  # openai の import・クライアント生成は計測に含めない
+    n_items = len(df)
+    scenario = cfg["scenario"]
+    if scenario == "enrich":
+        t0 = time.perf_counter()
+        analyze.enrich(df)
+        elapsed = time.perf_counter() - t0
+    elif scenario == "refine":
+        dfx = df.copy()
+        dfx["sentiment"], dfx["topic"] = 0.0, "その他"  # 全件を再判定対象にする
+        transcript = corpus.make_transcript(cfg["transcript_sentences"], seed=cfg["seed"])
+        t0 = time.perf_counter()
+        analyze.refine_with_transcript(dfx, transcript, summarize=cfg["summarize"])
+        elapsed = time.perf_counter() - t0
+    elif scenario == "fetch":
+        from ingest_youtube import fetch_comments_incremental
+        yt = _FakeYouTube(df, cfg["page_latency"])
+        with tempfile.TemporaryDirectory() as d:
+            t0 = time.perf_counter()
+            fetch_comments_incremental("bench", os.path.join(d, "out.csv"), youtube=yt, sleep=0)
+            elapsed = time.perf_counter() - t0
+        latencies = yt.latencies
+    else:
+        raise ValueError(f"unknown scenario: {scenario}")
+
+    counters = mock.counters()
+    server.shutdown()
+    rss = _peak_rss_bytes()
+    return {
+        "scenario": scenario,
+        "rows": cfg["rows"],
+        "elapsed_sec": elapsed,
+        "comments_per_sec": n_items / elapsed if elapsed else None,
+        "calls": len(latencies),
+        "latency_ms": _percentiles(latencies),
+        "api_requests": counters["requests"],
+        "retries": {
+            "rate_limited": counters["rate_limited"],
+            "server_errors": counters["errors"],
+            "malformed": counters["malformed"],
+            "total": counters["rate_limited"] + counters["errors"] + counters["malformed"],
+        },
+        "peak_rss_mb": rss / 2 ** 20 if rss is not None else None,
+    }
+
+
+# ---- 親プロセス側 ----
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True).stdout.strip()
+    except Exception:
+        return ""
+
+
+def compare(current: Dict, previous_path: str) -> None:
+    with open(previous_path, encoding="utf-8") as f:
+        prev = {(r["scenario"], r["rows"]): r for r in json.load(f)["results"]}
+    print(f"\n--- {previous_path} との比較 ---")
+    for r in current["results"]:
+        p = prev.get((r["scenario"], r["rows"]))
+        if p is None:
+            continue
+        ratio = r["comments_per_sec"] / p["comments_per_sec"] if p["comments_per_sec"] else float("nan")
+        p95, p95_prev = r["latency_ms"]["p95"], p["latency_ms"]["p95"]
+        p95_txt = f"{p95_prev:.0f} → {p95:.0f} ms" if p95 is not None and p95_prev is not None else "-"
+        print(f"{r['scenario']:<7} {r['rows']:>9,}: comments/s x{ratio:.2f}  p95 {p95_txt}  "
+              f"RSS {_mb(p['peak_rss_mb'])} → {_mb(r['peak_rss_mb'])} MB")
+
+
+def main() -> int:
+    import corpus
+    ap = argparse.ArgumentParser(description="パイプラインのスループット計測（モックサーバ使用）")
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS))
+    ap.add_argument("--sizes", default="1k,100k", help="件数（1k / 100k / 1m をカンマ区切り）")
+    ap.add_argument("--latency", type=float, default=0.2, help="モック API の応答遅延（秒）")
+    ap.add_argument("--rate-limit-rate", type=float, default=0.0)
+    ap.add_argument("--retry-after", type=float, default=0.2)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--malformed-rate", type=float, default=0.0)
+    ap.add_argument("--concurrency", type=int, default=int(os.environ.get("OPENAI_CONCURRENCY", "4")))
+    ap.add_argument("--page-latency", type=float, default=0.05, help="偽 YouTube の1ページあたりの遅延（秒）")
+    ap.add_argument("--transcript-sentences", type=int, default=2000)
+    ap.add_argument("--summarize", action="store_true", help="refine で全体要約も作る")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default=None, help="結果 JSON の保存先（既定 bench/results/bench-<日時>.json）")
+    ap.add_argument("--compare", default=None, help="比較する以前の結果 JSON")
+    ap.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(json.loads(args.child))))
+        return 0
+
+    base = {
+        "latency": args.latency, "rate_limit_rate": args.rate_limit_rate, "retry_after": args.retry_after,
+        "error_rate": args.error_rate, "malformed_rate": args.malformed_rate, "concurrency": args.concurrency,
+        "page_latency": args.page_latency, "transcript_sentences": args.transcript_sentences,
+        "summarize": args.summarize, "seed": args.seed,
+    }
+    results = []
+    for scenario in [s.strip() for s in args.scenarios.split(",") if s.strip()]:
+        for size in [s.strip() for s in args.sizes.split(",") if s.strip()]:
+            cfg = dict(base, scenario=scenario, rows=corpus.parse_size(size))
+            res = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", json.dumps(cfg)],
+                                 cwd=ROOT, capture_output=True, text=True)
+            if res.returncode != 0:
+                print(res.stderr, file=sys.stderr)
+                return 1
+            r = json.loads(res.stdout.strip().splitlines()[-1])
+            results.append(r)
+            lat = r["latency_ms"]
+            lat_txt = (f"p50 {lat['p50']:.0f} / p95 {lat['p95']:.0f} / p99 {lat['p99']:.0f} ms"
+                       if lat["p50"] is not None else "-")
+            print(f"{scenario:<7} {r['rows']:>9,}: {r['comments_per_sec']:>10,.0f} comments/s  "
+                  f"{r['calls']:>6} calls  {lat_txt}  retries {r['retries']['total']}  "
+                  f"RSS {_mb(r['peak_rss_mb'])} MB", flush=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "config": base,
+        },
+        "results": results,
+    }
+    out = args.out or os.path.join(BENCH_DIR, "results", f"bench-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"saved: {out}", file=sys.stderr)
+    if args.compare:
+        compare(report, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+分類リクエストの形式の A/B 比較（json: 従来の {"results": [{"id","sentiment","topic"}]} / compact: [id, sentiment, topic番号]）。
+使い方:
+  python bench/bench_wire.py --mock --rows 2000 --malformed-rate 0.1  # モックサーバで（料金なし・一致率は参考にならない）
+  python bench/bench_wire.py --input data/comments_xxx.csv --rows 500  # 実 API で（OPENAI_API_KEY が必要）
+
+- 同じテキストを同じバッチ分けで両形式に投げる（キャッシュ・ローカル分類器は使わない）
+- 形式ごとに 入力/出力トークン（tiktoken で数えた値と API の usage）・呼び出し遅延 p50/p95・
+  救済パース/判定不能の件数を、両形式の間で sentiment / topic の一致率を出す
+- 結果は bench/results/wire-<日時>.json に保存する
+"""
+import os, sys, json, time, argparse, threading
+from datetime import datetime
+from typing import Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+import numpy as np
+import pandas as pd
+
+FORMATS = ["json", "compact"]
+
+
+def run_format(texts: List[str], batches: List[List[int]], wire: str, concurrency: int) -> Dict:
+    import analyze
+    from batching import count_tokens
+    from dispatcher import dispatch
+
+    calls: List[Dict] = []
+    lock = threading.Lock()
+    orig = analyze._chat_completion
+
+    def traced(messages, *args, **kwargs):
+        t0 = time.perf_counter()
+        resp = orig(messages, *args, **kwargs)
+        content = resp.choices[0].message.content or ""
+        usage = getattr(resp, "usage", None)
+        with lock:
+            calls.append({
+                "latency": time.perf_counter() - t0,
+                "input_tokens": sum(count_tokens(m.get("content") or "") for m in messages),
+                "output_tokens": count_tokens(content),
+                "usage_completion_tokens": getattr(usage, "completion_tokens", None),
+                "usage_prompt_tokens": getattr(usage, "prompt_tokens", None),
+            })
+        return resp
+
+    parse = {"json": 0, "regex": 0, "failed": 0}
+    orig_finish = analyze._finish_call
+
+    def finish(**fields):
+        if "parse_path" in fields:  # 引数なしの呼び出しは前の呼び出しの記録を流すだけ
+            with lock:
+                parse[fields["parse_path"]] += 1
+        orig_finish(**fields)
+
+    # 前の形式で使ったトークン枠を持ち越さないよう、レート制御は形式ごとに作り直す
+    limiter = analyze._limiter
+    analyze._limiter = type(limiter)(rpm=analyze.OPENAI_RPM, tpm=analyze.OPENAI_TPM)
+    analyze._chat_completion, analyze._finish_call = traced, finish
+    try:
+        t0 = time.perf_counter()
+        labels: List[Dict] = []
+        for chunk in dispatch(lambda b: analyze._call_gpt_batch([texts[i] for i in b], wire=wire), batches,
+                              concurrency=concurrency):
+            labels.extend(chunk)
+        elapsed = time.perf_counter() - t0
+    finally:
+        analyze._chat_completion, analyze._finish_call, analyze._limiter = orig, orig_finish, limiter
+
+    lat = np.asarray([c["latency"] for c in calls]) * 1000.0
+    usage_out = [c["usage_completion_tokens"] for c in calls if c["usage_completion_tokens"] is not None]
+    n = len(texts)
+    return {
+        "labels": labels,
+        "summary": {
+            "format": wire,
+            "calls": len(calls),
+            "elapsed_sec": elapsed,
+            "input_tokens_per_item": sum(c["input_tokens"] for c in calls) / n,
+            "output_tokens_per_item": sum(c["output_tokens"] for c in calls) / n,
+            "usage_output_tokens_per_item": sum(usage_out) / n if usage_out else None,
+            "latency_ms_p50": float(np.percentile(lat, 50)) if len(lat) else None,
+            "latency_ms_p95": float(np.percentile(lat, 95)) if len(lat) else None,
+            "parse": parse,
+        },
+    }
+
+
+def agreement(a: List[Dict], b: List[Dict]) -> Dict[str, float]:
+    s = np.array([x["sentiment"] == y["sentiment"] for x, y in zip(a, b)])
+    t = np.array([x["topic"] == y["topic"] for x, y in zip(a, b)])
+    return {"sentiment": float(s.mean()), "topic": float(t.mean()), "both": float((s & t).mean())}
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="分類リクエストの形式（json / compact）の A/B 比較")
+    ap.add_argument("--input", default=None, help="コメントCSV（text 列）。省略時は合成コーパス")
+    ap.add_argument("--rows", type=int, default=500)
+    ap.add_argument("--batch-size", type=int, default=40)
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--mock", action="store_true", help="ローカルのモックサーバを起動して使う")
+    ap.add_argument("--latency", type=float, default=0.2, help="--mock 時の応答遅延（秒）")
+    ap.add_argument("--malformed-rate", type=float, default=0.0, help="--mock 時に壊れた応答を返す確率")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--out", default=None)
+    args = ap.parse_args()
+
+    server = None
+    if args.mock:
+        from mock_openai_server import MockConfig, serve
+        server = serve(0, MockConfig(latency=args.latency, seed=args.seed,
+                                         malformed_rate=args.malformed_rate))
+        os.environ.update({"OPENAI_API_KEY": "dummy",
+                           "OPENAI_BASE_URL": f"http://127.0.0.1:{server.server_address[1]}/v1"})
+    os.environ.update({"CLASSIFY_CACHE_PATH": "", "DISTILL_MODEL_PATH": ""})
+
+    if args.input:
+        texts = pd.read_csv(args.input)["text"].astype(str).head(args.rows).tolist()
+    else:
+        import corpus
+        texts = corpus.make_texts(args.rows, seed=args.seed, dup_rate=0.0)
+    batches = [list(range(i, min(i + args.batch_size, len(texts)))) for i in range(0, len(texts), args.batch_size)]
+
+    results = {}
+    for wire in FORMATS:
+        results[wire] = run_format(texts, batches, wire, args.concurrency)
+        m = results[wire]["summary"]
+        print(f"{wire:<8}: in {m['input_tokens_per_item']:6.1f} tok/件  out {m['output_tokens_per_item']:5.1f} tok/件  "
+              f"p50 {m['latency_ms_p50']:6.0f} ms  p95 {m['latency_ms_p95']:6.0f} ms  "
+              f"{m['elapsed_sec']:.1f} 秒  parse {m['parse']}", flush=True)
+    agree = agreement(results["json"]["labels"], results["compact"]["labels"])
+    j, c = results["json"]["summary"], results["compact"]["summary"]
+    print(f"出力トークン x{c['output_tokens_per_item'] / j['output_tokens_per_item']:.2f} / "
+          f"入力トークン x{c['input_tokens_per_item'] / j['input_tokens_per_item']:.2f} / "
+          f"一致率 sentiment {agree['sentiment']*100:.1f}%  topic {agree['topic']*100:.1f}%  "
+          f"両方 {agree['both']*100:.1f}%")
+
+    report = {
+        "meta": {"timestamp": datetime.now().isoformat(timespec="seconds"), "mock": args.mock,
+                 "rows": len(texts), "batch_size": args.batch_size, "input": args.input},
+        "formats": [results[w]["summary"] for w in FORMATS],
+        "agreement": agree,
+    }
+    out = args.out or os.path.join(BENCH_DIR, "results", f"wire-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"saved: {out}", file=sys.stderr)
+    if server is not None:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
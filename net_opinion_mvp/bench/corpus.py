@@ -0,0 +1,108 @@
+"""
+sample_comments.csv と同じ形（text, source, likes, published_at）の合成コメントを作る。
+使い方:
+  python bench/corpus.py --rows 100000 -o data/synthetic_100k.csv
+
+- 本文は 主語 × 述語 × 文末 の組み合わせ（絵文字・www・返信風の書き出しも混ぜる）
+- 一部は完全重複・ほぼ重複（コピペ・定型コメントの再現）
+- いいね数は裾の重い分布、投稿時刻は期間内にばらつかせる
+- seed が同じなら同じコーパスになる
+"""
+import os, sys, argparse
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+_SUBJECTS = [
+    "高市さん", "高市首相", "総理", "早苗さん", "首相", "彼女", "この内閣", "政府", "野党", "立憲",
+    "財務省", "与党", "メディア", "記者", "官邸", "", "",
+]
+_TOPICS = [
+    "の外交方針", "の経済対策", "の税制改革", "の子ども政策", "の防衛費の話", "の答弁", "の態度", "の説明",
+    "の物価対策", "の人事", "の発言", "の国会運営", "の中国への対応", "の賃上げの話", "", "",
+]
+_PREDICATES = [
+    "は強気で安心する", "には疑問がある", "は具体性が足りず不安", "がかっこいい", "は頼りになる",
+    "は説明責任を果たしていない", "に賛成", "に反対", "は危険", "に期待している", "は無理", "を応援してます",
+    "が最悪", "はよく頑張ってる", "に不信感", "はどうでもいい", "がわかりやすい", "はもう少し丁寧に",
+    "は評価できる", "は納得できない",
+]
+_ENDINGS = ["。", "！", "ね", "な", "w", "www", "😅", "💢💢", "👍", "…", "。本当に。", "と思う。", "", ""]
+_PREFIXES = ["", "", "", "", "@user ", "正直、", "いや、", "結局", "個人的には", "ほんとに"]
+_SOURCES = np.array(["YouTube", "Yahoo"])
+
+
+def make_texts(n: int, seed: int = 0, dup_rate: float = 0.05) -> List[str]:
+    rng = np.random.default_rng(seed)
+    pick = lambda pool: rng.integers(0, len(pool), n)
+    pre, sub, top, pred, end = pick(_PREFIXES), pick(_SUBJECTS), pick(_TOPICS), pick(_PREDICATES), pick(_ENDINGS)
+    n_sent = rng.choice([1, 1, 1, 2, 3], n)
+    pred2, end2 = pick(_PREDICATES), pick(_ENDINGS)
+    tail = rng.integers(0, 10_000, n)
+    texts = []
+    for i in range(n):
+        subject, topic = _SUBJECTS[sub[i]], _TOPICS[top[i]]
+        if not subject:
+            topic = topic.lstrip("の")
+        t = _PREFIXES[pre[i]] + subject + topic + _PREDICATES[pred[i]] + _ENDINGS[end[i]]
+        if n_sent[i] > 1:
+            t += "それに" + _TOPICS[top[i]].lstrip("の") + _PREDICATES[pred2[i]] + _ENDINGS[end2[i]]
+        if n_sent[i] > 2:
+            t += f"（{tail[i]}回目の投稿）"
+        texts.append(t)
+    # コピペ・定型コメント：一部は先に出たコメントの完全重複、一部は空白・記号違いのほぼ重複
+    n_dup = int(n * dup_rate)
+    if n_dup and n > 1:
+        dst = rng.choice(np.arange(1, n), size=min(n_dup, n - 1), replace=False)
+        for j, d in enumerate(dst):
+            src = texts[int(rng.integers(0, d))]
+            texts[d] = src if j % 2 == 0 else src.replace("。", "！") + " "
+    return texts
+
+
+def make_comments(n: int, seed: int = 0, start: str = "2025-11-01", days: int = 30) -> pd.DataFrame:
+    """合成コメント n 件（columns: text, source, likes, published_at）"""
+    rng = np.random.default_rng(seed + 1)
+    t0 = pd.Timestamp(start)
+    offsets = np.sort(rng.integers(0, days * 86400, n))
+    return pd.DataFrame({
+        "text": make_texts(n, seed),
+        "source": _SOURCES[(rng.random(n) < 0.4).astype(int)],
+        "likes": np.minimum(rng.pareto(1.5, n) * 3, 50_000).astype(np.int64),
+        "published_at": (t0 + pd.to_timedelta(offsets, unit="s")).strftime("%Y-%m-%dT%H:%M:%S"),
+    })
+
+
+def make_transcript(n_sentences: int = 2000, seed: int = 0) -> str:
+    """国会答弁風の合成文字起こし"""
+    rng = np.random.default_rng(seed + 2)
+    speakers = ["高市首相", "野党議員", "委員長", "財務大臣", "外務大臣"]
+    lines = []
+    for i in range(n_sentences):
+        sp = speakers[int(rng.integers(0, len(speakers)))]
+        top = _TOPICS[int(rng.integers(0, len(_TOPICS) - 2))].lstrip("の")
+        pred = _PREDICATES[int(rng.integers(0, len(_PREDICATES)))]
+        lines.append(f"{sp}：{top}について、{pred.lstrip('はにがを')}という指摘があります。")
+    return "\n".join(lines)
+
+
+def parse_size(s: str) -> int:
+    """'1k' / '100k' / '1m' / '2500' → 件数"""
+    s = s.strip().lower()
+    mult = {"k": 1_000, "m": 1_000_000}.get(s[-1:], 1)
+    return int(float(s[:-1] if mult > 1 else s) * mult)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="合成コメントCSVを作る")
+    ap.add_argument("--rows", default="1k", help="件数（1k / 100k / 1m など）")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("-o", "--output", default=None)
+    args = ap.parse_args()
+    n = parse_size(args.rows)
+    out = args.output or f"synthetic_{args.rows}.csv"
+    if os.path.dirname(out):
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+    make_comments(n, args.seed).to_csv(out, index=False, encoding="utf-8-sig")
+    print(f"{n:,} 件: {out}", file=sys.stderr)
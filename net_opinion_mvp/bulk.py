@@ -0,0 +1,624 @@
+"""
+夜間のバックフィル用：分類・文脈再判定のプロンプトをバッチ API 形式の JSONL リクエストファイルに書き出し、
+非同期に処理された結果ファイルを取り込んで判定結果をストアに反映する（同期の chat.completions を何千回も呼ばない）。
+使い方:
+  python bulk.py prepare data/comments_*.csv --job jobs/0301 [--transcript t.txt --summarize]
+  python bulk.py run --job jobs/0301 --service openai --wait --store store   # 送信 → 完了待ち → 取り込み → ストアへ
+  python bulk.py import --job jobs/0301 results.jsonl                       # 手で落とした結果ファイルを取り込む
+  python bulk.py status --job jobs/0301
+
+  # バッチサービスのローカル代用（ディレクトリ）。fake-service が届いたリクエストにモックの応答を書く
+  python bulk.py run --job jobs/0301 --service dir:/tmp/batchsvc
+  python bulk.py fake-service /tmp/batchsvc --malformed-rate 0.05 --drop-rate 0.02
+  python bulk.py run --job jobs/0301 --service dir:/tmp/batchsvc --store store
+
+- 1行 = 1バッチ（{"custom_id", "method", "url", "body"}。body は同期の呼び出しと同じ _classify_request / _refine_request）
+- custom_id は 段階・モデル・プロンプト版・キャッシュの文脈・バッチの本文 のハッシュ（同じバッチなら毎回同じ id）
+- 結果は custom_id でバッチに、応答の id で各コメントに突き合わせる（同期と同じ読み方・検証）。
+  欠けた・読めなかったコメントは次のラウンドのリクエストファイルに回し（1件も読めなかったバッチは半分に分ける）、
+  BULK_MAX_ROUNDS ラウンドで取れなければ 0/その他（同期の処理と同じ扱い。分類キャッシュには書かない）
+- 重複除去・ローカル分類器・分類キャッシュは同期の enrich() と同じ。取れたラベルは分類キャッシュにも書く
+- 分類がそろったら救済ロジックを掛け、文字起こしがあれば sentiment==0 の行の再判定リクエストを書く
+  （全体要約を添える場合の要約だけは同期で呼ぶ）
+- 全部そろったら <job>/enriched.parquet に書き、--store のストアへ append_enriched（同じ comment_id の行は置き換え）
+"""
+import os, sys, json, time, uuid, shutil, random, hashlib, logging, argparse
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+import analyze
+from analyze import (DEFAULT_MODEL, DEDUP_NEAR, DEDUP_NEAR_THRESHOLD, DISTILL_THRESHOLD, PROMPT_VERSION,
+                     RETRIEVAL_TOP_K, TOPIC_LABELS)
+from batching import pack_batches
+from cache import context_key
+from dedup import collapse
+
+logger = logging.getLogger(__name__)
+
+BULK_MAX_ROUNDS = int(os.environ.get("BULK_MAX_ROUNDS", "4"))
+BULK_MAX_REQUESTS_PER_FILE = int(os.environ.get("BULK_MAX_REQUESTS_PER_FILE", "50000"))
+BULK_MAX_FILE_BYTES = int(os.environ.get("BULK_MAX_FILE_BYTES", str(190 * 2 ** 20)))
+BULK_ENDPOINT = "/v1/chat/completions"
+
+STATE = "job.json"
+_TERMINAL = ("completed", "failed", "expired", "cancelled")
+# labels.jsonl の via → 判定結果の label_source（キャッシュにあるのは GPT のラベルだけ）
+_LABEL_SOURCE = {"batch": "gpt", "cache": "gpt", "local": "local", "fallback": "fallback"}
+
+
+# ---- バッチサービス ----
+class DirectoryBatchService:
+    """
+    バッチサービスのローカル代用。submit() はリクエストファイルを <root>/input/<batch_id>.jsonl に置き、
+    fake_service() がそれを処理して <root>/output/<batch_id>.jsonl（失敗した行は .errors.jsonl）に書く。
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        for d in ("input", "output", "batches"):
+            os.makedirs(os.path.join(root, d), exist_ok=True)
+
+    def _meta_path(self, batch_id: str) -> str:
+        return os.path.join(self.root, "batches", batch_id + ".json")
+
+    def submit(self, path: str) -> str:
+        batch_id = "batch_" + uuid.uuid4().hex[:16]
+        shutil.copyfile(path, os.path.join(self.root, "input", batch_id + ".jsonl"))
+        _write_json(self._meta_path(batch_id), {"id": batch_id, "status": "in_progress", "created_at": time.time()})
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        with open(self._meta_path(batch_id), encoding="utf-8") as f:
+            return json.load(f)["status"]
+
+    def download(self, batch_id: str, out_dir: str) -> List[str]:
+        paths = []
+        for suffix in (".jsonl", ".errors.jsonl"):
+            src = os.path.join(self.root, "output", batch_id + suffix)
+            if os.path.exists(src):
+                dst = os.path.join(out_dir, batch_id + suffix)
+                shutil.copyfile(src, dst)
+                paths.append(dst)
+        return paths
+
+
+def fake_service(root: str, malformed_rate: float = 0.0, drop_rate: float = 0.0, error_rate: float = 0.0,
+                 seed: int = 0) -> int:
+    """
+    DirectoryBatchService に届いた未処理のバッチを、モックサーバと同じ応答で処理して completed にする。
+    malformed_rate: 壊れた応答 / drop_rate: 結果ファイルから行が欠ける / error_rate: 500 の行（.errors.jsonl）
+    返却: 処理したバッチ数
+    """
+    from mock_openai_server import _answer, _malform, completion
+    svc = DirectoryBatchService(root)
+    rng = random.Random(seed)
+    n = 0
+    for name in sorted(os.listdir(os.path.join(root, "batches"))):
+        meta_path = os.path.join(root, "batches", name)
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["status"] != "in_progress":
+            continue
+        batch_id = meta["id"]
+        out, err = [], []
+        with open(os.path.join(root, "input", batch_id + ".jsonl"), encoding="utf-8") as f:
+            for line in f:
+                req = json.loads(line)
+                if rng.random() < drop_rate:
+                    continue
+                rid = "batch_req_" + uuid.uuid4().hex[:16]
+                if rng.random() < error_rate:
+                    err.append({"id": rid, "custom_id": req["custom_id"], "error": None, "response": {
+                        "status_code": 500, "body": {"error": {"message": "mock server error"}}}})
+                    continue
+                content = _answer(req["body"])
+                if rng.random() < malformed_rate:
+                    content = _malform(content, rng)
+                out.append({"id": rid, "custom_id": req["custom_id"], "error": None,
+                            "response": {"status_code": 200, "body": completion(req["body"], content)}})
+        for suffix, rows in ((".jsonl", out), (".errors.jsonl", err)):
+            if rows:
+                _write_jsonl(os.path.join(root, "output", batch_id + suffix), rows)
+        meta.update(status="completed", completed_at=time.time())
+        _write_json(svc._meta_path(batch_id), meta)
+        n += 1
+    return n
+
+
+class OpenAIBatchService:
+    """OpenAI の Batch API（ファイルをアップロードして /v1/chat/completions のバッチを作る。完了まで最大 24 時間）"""
+
+    def __init__(self):
+        self.client = analyze._get_client()
+
+    def submit(self, path: str) -> str:
+        with open(path, "rb") as f:
+            uploaded = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(input_file_id=uploaded.id, endpoint=BULK_ENDPOINT,
+                                           completion_window="24h",
+                                           metadata={"request_file": os.path.basename(path)})
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return self.client.batches.retrieve(batch_id).status
+
+    def download(self, batch_id: str, out_dir: str) -> List[str]:
+        batch = self.client.batches.retrieve(batch_id)
+        paths = []
+        for file_id, suffix in ((batch.output_file_id, ".jsonl"), (batch.error_file_id, ".errors.jsonl")):
+            if file_id:
+                dst = os.path.join(out_dir, batch_id + suffix)
+                with open(dst, "w", encoding="utf-8") as f:
+                    f.write(self.client.files.content(file_id).text)
+                paths.append(dst)
+        return paths
+
+
+def get_service(spec: str):
+    """"openai" / "dir:<ディレクトリ>" → バッチサービス"""
+    if spec == "openai":
+        return OpenAIBatchService()
+    if spec.startswith("dir:"):
+        return DirectoryBatchService(spec[4:])
+    raise ValueError(f"不明なバッチサービス: {spec}（openai / dir:<path>）")
+
+
+# ---- ファイル ----
+def _write_json(path: str, obj) -> None:
+    """途中で落ちても壊れないよう一時ファイル経由で置き換える"""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _read_json(path: str, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_jsonl(path: str, rows: List[Dict]) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for r in rows:
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+    os.replace(tmp, path)
+
+
+def _read_jsonl(path: str) -> List[Dict]:
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    logger.warning("%s: 読めない行を飛ばしました: %r", path, line[:80])
+    return rows
+
+
+# ---- ジョブ ----
+class BulkJob:
+    """
+    1回のバックフィル（<dir> に入力・リクエスト・結果・状態を置く）。
+    段階は classify →（文字起こしがあれば）refine → done → merged。
+    """
+
+    def __init__(self, job_dir: str):
+        self.dir = job_dir
+        self.state = _read_json(self._path(STATE))
+        if self.state is None:
+            raise FileNotFoundError(f"{job_dir} にジョブがありません（先に prepare）")
+        self.config = self.state["config"]
+        self._refine_ctx = None
+
+    def _path(self, *parts: str) -> str:
+        return os.path.join(self.dir, *parts)
+
+    def save(self) -> None:
+        _write_json(self._path(STATE), self.state)
+
+    @property
+    def stage(self) -> str:
+        return self.state["stage"]
+
+    # ---- 段階ごとのテキスト・ラベル ----
+    def texts(self, stage: str) -> List[str]:
+        return _read_json(self._path(f"{stage}.texts.json"), [])
+
+    def labels(self, stage: str) -> Dict[int, Dict]:
+        """取れたラベル {代表テキストの番号: {"sentiment", "topic", "source"}}（後から書いた方が勝ち）"""
+        out: Dict[int, Dict] = {}
+        path = self._path(f"{stage}.labels.jsonl")
+        if os.path.exists(path):
+            for r in _read_jsonl(path):
+                out[int(r["i"])] = {"sentiment": int(r["sentiment"]), "topic": r["topic"],
+                                    "source": _LABEL_SOURCE[r.get("via", "batch")]}
+        return out
+
+    def _add_labels(self, stage: str, got: Dict[int, Dict], how: str) -> None:
+        if not got:
+            return
+        with open(self._path(f"{stage}.labels.jsonl"), "a", encoding="utf-8") as f:
+            for i, r in got.items():
+                f.write(json.dumps({"i": i, "sentiment": int(r["sentiment"]), "topic": r["topic"], "via": how},
+                                   ensure_ascii=False) + "\n")
+
+    def _cache_context(self, stage: str) -> str:
+        if stage == "classify":
+            return analyze._classify_budget(self.config["wire"])[1]
+        return self._refine()[3]
+
+    def _refine(self) -> Tuple:
+        """再判定の (要約, 区間検索の索引, 固定部分のトークン数, キャッシュの文脈)。要約は最初の1回だけ作って保存する"""
+        if self._refine_ctx is None:
+            with open(self._path("transcript.txt"), encoding="utf-8") as f:
+                transcript = f.read()
+            summary = _read_json(self._path("refine.summary.json"))
+            self._refine_ctx = analyze._refine_setup(transcript, self.config["summarize"], context_summary=summary)
+            if summary is None:
+                _write_json(self._path("refine.summary.json"), self._refine_ctx[0])
+        return self._refine_ctx
+
+    def custom_id(self, stage: str, texts: List[str]) -> str:
+        raw = json.dumps([stage, self.config["model"], self.config["wire"], PROMPT_VERSION,
+                          context_key(self._cache_context(stage)), texts], ensure_ascii=False)
+        return f"{stage}-{hashlib.sha256(raw.encode('utf-8')).hexdigest()[:24]}"
+
+    # ---- 段階の開始 ----
+    def start_stage(self, stage: str, texts: List[str]) -> None:
+        """
+        texts（行ごと）の重複をまとめ、ローカル分類器・分類キャッシュで取れない代表だけのリクエストを書く。
+        """
+        reps, mapping = collapse(texts, near=DEDUP_NEAR, threshold=DEDUP_NEAR_THRESHOLD)
+        uniq = [texts[i] for i in reps]
+        _write_json(self._path(f"{stage}.texts.json"), uniq)
+        _write_json(self._path(f"{stage}.map.json"), [int(m) for m in mapping])
+        open(self._path(f"{stage}.labels.jsonl"), "w").close()
+        self.state.update(stage=stage, round=0, stuck=[])
+        self.state["dedup"] = analyze._dedup_stats(len(texts), len(uniq))
+
+        got: Dict[int, Dict] = {}
+        distilled = analyze.get_distilled() if stage == "classify" else None
+        if distilled is not None and uniq:
+            labels, conf = distilled.predict(uniq)
+            got.update({i: r for i, (r, c) in enumerate(zip(labels, conf))
+                        if c >= DISTILL_THRESHOLD and r["topic"] in TOPIC_LABELS})
+            self._add_labels(stage, got, "local")
+        cache = analyze.get_cache()
+        if cache is not None:
+            rest = [i for i in range(len(uniq)) if i not in got]
+            hits = cache.get_many([uniq[i] for i in rest], self.config["model"], self._cache_context(stage))
+            self._add_labels(stage, {rest[j]: r for j, r in hits.items()}, "cache")
+        self.advance()
+
+    def _batch_request(self, stage: str, texts: List[str]) -> Dict:
+        model = self.config["model"]
+        if stage == "classify":
+            body = analyze._classify_request(texts, model, self.config["wire"])
+        else:
+            summary, index, _, _ = self._refine()
+            body = analyze._refine_request(texts, summary, index.top_segments(texts, RETRIEVAL_TOP_K), model)
+        return {"custom_id": self.custom_id(stage, texts), "method": "POST", "url": BULK_ENDPOINT, "body": body}
+
+    def write_round(self, pending: List[int]) -> List[str]:
+        """
+        pending（代表テキストの番号）をトークン予算で詰めてリクエストファイルに書く。
+        前のラウンドで1件も読めなかったバッチ（stuck）は詰め直さずに半分に分ける。返却: 書いたファイル名
+        """
+        stage, rnd = self.stage, self.state["round"]
+        texts = self.texts(stage)
+        if stage == "classify":
+            prefix, _, per_item = analyze._classify_budget(self.config["wire"])
+        else:
+            prefix, per_item = self._refine()[2], analyze.BATCH_OUTPUT_PER_ITEM
+        todo = set(pending)
+        stuck = [g for g in self.state["stuck"] if len(g) > 1 and todo.issuperset(g)]
+        split = {i for g in stuck for i in g}
+        loose = [i for i in pending if i not in split]
+        batches = [[loose[j] for j in b] for b in pack_batches(
+            [texts[i] for i in loose], prefix, analyze.BATCH_INPUT_TOKENS, analyze.BATCH_OUTPUT_TOKENS,
+            output_per_item=per_item, max_items=analyze.BATCH_MAX_ITEMS)]
+        for g in stuck:
+            batches += [g[:len(g) // 2], g[len(g) // 2:]]
+        self.state["stuck"] = []
+
+        os.makedirs(self._path("requests"), exist_ok=True)
+        files, part, rows, ids, size = [], 0, [], {}, 0
+
+        def flush():
+            nonlocal part, rows, ids, size
+            name = f"{stage}-r{rnd}-{part:04d}.jsonl"
+            _write_json(self._path("requests", name + ".ids.json"), ids)
+            _write_jsonl(self._path("requests", name), rows)
+            self.state["files"][name] = {"stage": stage, "round": rnd, "status": "written",
+                                         "requests": len(rows), "items": sum(len(v) for v in ids.values())}
+            files.append(name)
+            part, rows, ids, size = part + 1, [], {}, 0
+
+        for b in batches:
+            req = self._batch_request(stage, [texts[i] for i in b])
+            n = len(json.dumps(req, ensure_ascii=False).encode("utf-8")) + 1
+            if rows and (len(rows) >= BULK_MAX_REQUESTS_PER_FILE or size + n > BULK_MAX_FILE_BYTES):
+                flush()
+            if req["custom_id"] in ids:
+                continue  # 同じ本文のバッチ（重複除去済みなので通常は起きない）
+            rows.append(req)
+            ids[req["custom_id"]] = b
+            size += n
+        if rows:
+            flush()
+        self.save()
+        return files
+
+    # ---- 結果の取り込み ----
+    def import_results(self, paths: List[str], name: Optional[str] = None) -> Dict[str, int]:
+        """
+        結果ファイル（output / errors）を読み、custom_id でバッチに、応答の id でコメントに突き合わせる。
+        name（リクエストファイル名）を渡すと、そのファイルのバッチで結果が無かったものも失敗として数える。
+        返却: {"ok", "failed", "items"}（バッチ数・ラベルが取れた件数）
+        """
+        stage = self.stage
+        batch_of: Dict[str, List[int]] = {}
+        files = [name] if name else [n for n, f in self.state["files"].items()
+                                     if f["stage"] == stage and f["status"] != "imported"]
+        for n in files:
+            batch_of.update(_read_json(self._path("requests", n + ".ids.json"), {}))
+        _, _, decode = analyze._wire(self.config["wire"] if stage == "classify" else "json")
+        normalize = analyze._strict_topic if stage == "classify" else analyze._normalize_topic
+        texts = self.texts(stage)
+        seen, got, stats = set(), {}, {"ok": 0, "failed": 0, "items": 0}
+        for path in paths:
+            for rec in _read_jsonl(path):
+                cid = rec.get("custom_id")
+                members = batch_of.get(cid)
+                if members is None or cid in seen:
+                    continue  # 別ジョブ・取り込み済みの行
+                seen.add(cid)
+                resp = rec.get("response") or {}
+                parsed: Dict[int, Dict] = {}
+                if not rec.get("error") and resp.get("status_code") == 200:
+                    try:
+                        content = resp["body"]["choices"][0]["message"]["content"]
+                        parsed, _ = decode(content, len(members), normalize)
+                    except Exception:
+                        parsed = {}
+                for j, r in parsed.items():
+                    got[members[j]] = r
+                stats["ok" if parsed else "failed"] += 1
+                if not parsed and len(members) > 1:
+                    self.state["stuck"].append(members)
+        for cid, members in batch_of.items():
+            if name and cid not in seen:
+                stats["failed"] += 1  # 結果ファイルに行が無い（期限切れ・欠落）→ 次のラウンドへ
+        self._add_labels(stage, got, "batch")
+        stats["items"] = len(got)
+        cache = analyze.get_cache()
+        if cache is not None and got:
+            cache.put_many([texts[i] for i in got], list(got.values()), self.config["model"],
+                           self._cache_context(stage))
+        if name:
+            self.state["files"][name]["status"] = "imported"
+            self.state["files"][name].update(stats)
+        self.save()
+        return stats
+
+    # ---- 段階を進める ----
+    def advance(self) -> None:
+        """
+        今の段階で書いたリクエストがすべて取り込み済みなら、足りない分の次のラウンドを書くか、次の段階へ進む。
+        """
+        stage = self.stage
+        if stage in ("done", "merged"):
+            return
+        if any(f["stage"] == stage and f["status"] != "imported" for f in self.state["files"].values()):
+            return
+        texts, labels = self.texts(stage), self.labels(stage)
+        pending = [i for i in range(len(texts)) if i not in labels]
+        if pending:
+            started = any(f["stage"] == stage for f in self.state["files"].values())
+            if not started or self.state["round"] + 1 < BULK_MAX_ROUNDS:
+                if started:
+                    self.state["round"] += 1
+                self.write_round(pending)
+                return
+            logger.warning("%s: %d件は %dラウンドで取れなかったので 0/その他 とします", stage, len(pending),
+                           BULK_MAX_ROUNDS)
+            # ジョブの中だけの仮のラベル（分類キャッシュには書かない。次のジョブではまた送る）
+            fallback = {i: analyze._fallback_label() for i in pending}
+            self._add_labels(stage, fallback, "fallback")
+            labels.update(fallback)
+
+        rows = pd.read_parquet(self._path("rows.parquet"))
+        mapping = _read_json(self._path(f"{stage}.map.json"))
+        per_row = [dict(labels[m]) for m in mapping]
+        if stage == "classify":
+            rows["text"] = rows["text"].astype(str).fillna("")
+            dfx = analyze._apply_labels(rows, per_row)
+            dfx.to_parquet(self._path("classified.parquet"), index=False)
+            zero = dfx.index[dfx["sentiment"] == 0]
+            if self.config["transcript"] and len(zero):
+                self.start_stage("refine", dfx.loc[zero, "text"].tolist())
+                return
+        else:
+            dfx = analyze.to_enriched_schema(pd.read_parquet(self._path("classified.parquet")))
+            zero = dfx.index[dfx["sentiment"] == 0]
+            dfx = analyze._apply_refined(dfx, zero, per_row)
+        dfx.to_parquet(self._path("enriched.parquet"), index=False)
+        self.state["stage"] = "done"
+        self.save()
+
+    def enriched(self) -> pd.DataFrame:
+        return analyze.to_enriched_schema(pd.read_parquet(self._path("enriched.parquet")))
+
+    def merge(self, store_root: str) -> int:
+        """判定結果をストアに1回だけ追記する（同じ comment_id の既存の行は置き換えて集計表から差し引く）"""
+        from store import CommentStore
+        if self.stage == "merged":
+            raise ValueError(f"{self.dir} は追記済みです（comment_id の無い行が二重になるので追記し直さない）")
+        if self.stage != "done":
+            raise ValueError(f"まだ判定が終わっていません（段階: {self.stage}）")
+        n = CommentStore(store_root).upsert_enriched(self.enriched())
+        self.state["stage"] = "merged"
+        self.state["merged_at"] = time.time()
+        self.save()
+        return n
+
+    # ---- 送信・完了待ち ----
+    def step(self, service) -> Dict[str, int]:
+        """書いたリクエストを送り、終わったバッチの結果を取り込んで段階を進める（1回分）"""
+        os.makedirs(self._path("results"), exist_ok=True)
+        sent, imported = self._submit(service), 0
+        for name, f in list(self.state["files"].items()):
+            if f["status"] != "submitted":
+                continue
+            st = service.status(f["batch_id"])
+            if st not in _TERMINAL:
+                continue
+            # failed / expired / cancelled でも出力があれば使い、無い分は次のラウンドへ
+            paths = service.download(f["batch_id"], self._path("results"))
+            stats = self.import_results(paths, name)
+            f.update(batch_status=st)
+            imported += 1
+            print(f"{name}: {st} / 取り込み {stats['items']:,} 件（失敗バッチ {stats['failed']}）", file=sys.stderr)
+        self.advance()
+        sent += self._submit(service)  # 取り込みで書いた次のラウンド・次の段階の分もすぐ送る
+        return {"sent": sent, "imported": imported}
+
+    def _submit(self, service) -> int:
+        n = 0
+        for name, f in list(self.state["files"].items()):
+            if f["status"] == "written":
+                f["batch_id"] = service.submit(self._path("requests", name))
+                f["status"] = "submitted"
+                f["submitted_at"] = time.time()
+                self.save()
+                n += 1
+        return n
+
+    def summary(self) -> Dict:
+        files = self.state["files"].values()
+        out = {"stage": self.stage, "round": self.state.get("round", 0), "files": {}}
+        for f in files:
+            key = f"{f['stage']}:{f['status']}"
+            out["files"][key] = out["files"].get(key, 0) + 1
+        if self.stage not in ("done", "merged"):
+            n = len(self.texts(self.stage))
+            out["labelled"] = f"{len(self.labels(self.stage)):,} / {n:,}"
+        return out
+
+
+def prepare(inputs: List[str], job_dir: str, model: str = DEFAULT_MODEL, wire: Optional[str] = None,
+            transcript: Optional[str] = None, summarize: bool = False) -> BulkJob:
+    """入力を読んでジョブを作り、分類の最初のリクエストファイルを書く"""
+    from batch import read_chunks
+    if os.path.exists(os.path.join(job_dir, STATE)):
+        raise ValueError(f"{job_dir} には既にジョブがあります")
+    os.makedirs(job_dir, exist_ok=True)
+    rows = pd.concat([c for p in inputs for c in read_chunks(p, 100_000)], ignore_index=True)
+    rows.to_parquet(os.path.join(job_dir, "rows.parquet"), index=False)
+    if transcript:
+        with open(os.path.join(job_dir, "transcript.txt"), "w", encoding="utf-8") as f:
+            f.write(transcript)
+    _write_json(os.path.join(job_dir, STATE), {
+        "config": {"inputs": [os.path.abspath(p) for p in inputs], "model": model,
+                   "wire": wire or analyze.WIRE_FORMAT, "prompt_version": PROMPT_VERSION,
+                   "transcript": context_key(transcript) if transcript else None,
+                   "summarize": bool(transcript and summarize)},
+        "stage": "classify", "round": 0, "stuck": [], "files": {}, "created_at": time.time(),
+    })
+    job = BulkJob(job_dir)
+    job.start_stage("classify", rows["text"].astype(str).fillna("").tolist())
+    return job
+
+
+def run(job: BulkJob, service, wait: bool = False, poll: float = 60.0, store: Optional[str] = None) -> str:
+    """送信・取り込みを進める。wait=True なら判定が終わるまで poll 秒ごとに繰り返す。返却: 段階"""
+    while True:
+        job.step(service)
+        if job.stage in ("done", "merged") or not wait:
+            break
+        time.sleep(poll)
+    if job.stage == "done" and store:
+        n = job.merge(store)
+        print(f"ストアに {n:,} 件を追記しました（{store}）", file=sys.stderr)
+    return job.stage
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    ap = argparse.ArgumentParser(description="分類・再判定をバッチ API のリクエスト/結果ファイルで行う（夜間のバックフィル用）")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("prepare", help="入力を読んで分類のリクエストファイルを書く")
+    p.add_argument("inputs", nargs="+", help="CSV / Parquet（columns: text, source, likes, published_at）")
+    p.add_argument("--job", required=True, help="ジョブのディレクトリ")
+    p.add_argument("--model", default=DEFAULT_MODEL)
+    p.add_argument("--wire", choices=["json", "compact"], default=None, help="分類の形式（既定 WIRE_FORMAT）")
+    p.add_argument("--transcript", default=None, help="文字起こし（sentiment==0 の行を文脈で再判定）")
+    p.add_argument("--summarize", action="store_true", help="再判定で全体要約も添える（要約は同期で呼ぶ）")
+    p = sub.add_parser("run", help="送信・完了待ち・取り込みを進める")
+    p.add_argument("--job", required=True)
+    p.add_argument("--service", default="openai", help="openai / dir:<ディレクトリ>")
+    p.add_argument("--wait", action="store_true", help="判定が終わるまで待つ")
+    p.add_argument("--poll", type=float, default=60.0, help="--wait 時の確認間隔（秒）")
+    p.add_argument("--store", default=None, help="終わったら追記する Parquet ストア")
+    p = sub.add_parser("import", help="結果ファイルを取り込む（送信は自分で行った場合）")
+    p.add_argument("--job", required=True)
+    p.add_argument("results", nargs="+")
+    p = sub.add_parser("merge", help="判定結果をストアに追記する")
+    p.add_argument("--job", required=True)
+    p.add_argument("--store", required=True)
+    p = sub.add_parser("status")
+    p.add_argument("--job", required=True)
+    p = sub.add_parser("fake-service", help="ディレクトリ代用のバッチサービスで届いたバッチを処理する")
+    p.add_argument("root")
+    p.add_argument("--malformed-rate", type=float, default=0.0)
+    p.add_argument("--drop-rate", type=float, default=0.0)
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--watch", type=float, default=0, help="N 秒ごとに処理し続ける")
+    args = ap.parse_args()
+
+    try:
+        if args.cmd == "prepare":
+            transcript = None
+            if args.transcript:
+                with open(args.transcript, encoding="utf-8") as f:
+                    transcript = f.read().strip() or None
+            job = prepare(args.inputs, args.job, model=args.model, wire=args.wire, transcript=transcript,
+                          summarize=args.summarize)
+            print(json.dumps(job.summary(), ensure_ascii=False), file=sys.stderr)
+        elif args.cmd == "run":
+            job = BulkJob(args.job)
+            stage = run(job, get_service(args.service), wait=args.wait, poll=args.poll, store=args.store)
+            print(json.dumps(job.summary(), ensure_ascii=False), file=sys.stderr)
+        elif args.cmd == "import":
+            job = BulkJob(args.job)
+            stats = job.import_results(args.results)
+            for f in job.state["files"].values():
+                if f["stage"] == job.stage and f["status"] != "imported":
+                    f["status"] = "imported"  # 手で取り込んだ分に無かったバッチは次のラウンドで送り直す
+            job.save()
+            job.advance()
+            print(json.dumps(dict(stats, **job.summary()), ensure_ascii=False), file=sys.stderr)
+        elif args.cmd == "merge":
+            n = BulkJob(args.job).merge(args.store)
+            print(f"ストアに {n:,} 件を追記しました（{args.store}）", file=sys.stderr)
+        elif args.cmd == "status":
+            print(json.dumps(BulkJob(args.job).summary(), ensure_ascii=False, indent=2))
+        elif args.cmd == "fake-service":
+            while True:
+                n = fake_service(args.root, malformed_rate=args.malformed_rate, drop_rate=args.drop_rate,
+                                 error_rate=args.error_rate, seed=args.seed)
+                if n:
+                    print(f"{n} バッチを処理しました", file=sys.stderr)
+                if not args.watch:
+                    break
+                time.sleep(args.watch)
+    except (ValueError, FileNotFoundError) as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,201 @@
+# cache.py — GPT分類結果の永続キャッシュ（SQLite・内容アドレス方式）
+"""
+正規化テキスト + モデル名 + プロンプト版(SYSTEM_PROMPT/TOPIC_LABELS のハッシュ) + 文脈 をキーに、
+GPT が返した {"sentiment", "topic"} をディスクに保存する。
+
+- 同じコメントは再実行・再アップロードでも API に投げない（ミス分のみ API へ）
+- 件数上限を超えたら最終利用が古い順に削除（LRU 近似）。件数は書き込みのたびに数えず、
+  インスタンスごとの概算（書いた件数を足していく）が上限を超えたとき、または上限の 1/20 を書くたびに
+  COUNT(*) で数え直す（後者は別プロセスが書いた分を拾うため）
+- プロンプト版が変わったら旧版の結果は自動で破棄
+- 文字起こしの要約も同じファイルに保存する（文字起こしのハッシュがキー）
+- 複数プロセス（jobs.py のワーカー）から同じファイルに書いてよい（WAL。書き込みが重なったら待って再試行）
+"""
+import os, json, time, hashlib, sqlite3, threading, unicodedata, re
+from typing import List, Dict, Optional
+
+_WS_RE = re.compile(r"\s+")
+_BUSY_RETRIES = 8  # busy_timeout を待っても取れなかった書き込みの再試行回数
+
+
+def normalize_text(text) -> str:
+    """キャッシュキー用の正規化（全角/半角の統一・空白の圧縮）"""
+    if not isinstance(text, str):
+        text = "" if text is None else str(text)
+    t = unicodedata.normalize("NFKC", text)
+    return _WS_RE.sub(" ", t).strip()
+
+
+def prompt_version(*parts) -> str:
+    """プロンプト・ラベル定義から版ハッシュを作る（どれか1つでも変われば別の版）"""
+    blob = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:16]
+
+
+def context_key(context: str) -> str:
+    """文脈付き再判定用：文脈文字列のハッシュ（空文字なら空）"""
+    if not context:
+        return ""
+    return hashlib.sha256(context.encode("utf-8")).hexdigest()[:16]
+
+
+class ClassificationCache:
+    """
+    SQLite によるスレッドセーフな分類結果キャッシュ。
+    hits / misses はこのインスタンスが生きている間の累計。
+    """
+
+    def __init__(self, path: str, version: str, max_entries: int = 200_000):
+        self.path = path
+        self.version = version
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._approx_entries = 0  # 件数の概算（上書き分も足すので多め。別プロセスの分は数え直すまで入らない）
+        self._added_since_count = 0
+
+        d = os.path.dirname(path)
+        if d and path != ":memory:":
+            os.makedirs(d, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._conn.execute("PRAGMA busy_timeout=60000")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " version TEXT NOT NULL,"
+            " sentiment INTEGER NOT NULL,"
+            " topic TEXT NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_used ON entries(last_used)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            " key TEXT PRIMARY KEY,"
+            " summary TEXT NOT NULL,"
+            " created REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (k TEXT PRIMARY KEY, v TEXT)")
+        self._invalidate_old_versions()
+        self._approx_entries = self.size()
+
+    def _write(self, fn):
+        """
+        fn(conn) を1トランザクションで実行する。別のプロセスが書き込み中で busy / locked になったら
+        （読んでから書くトランザクションは busy_timeout を待たずに失敗することがある）少し待ってやり直す。
+        """
+        for attempt in range(_BUSY_RETRIES + 1):
+            try:
+                with self._lock, self._conn:
+                    return fn(self._conn)
+            except sqlite3.OperationalError as e:
+                msg = str(e)
+                if attempt == _BUSY_RETRIES or ("locked" not in msg and "busy" not in msg):
+                    raise
+            time.sleep(min(0.05 * 2 ** attempt, 2.0))
+
+    def _invalidate_old_versions(self) -> None:
+        def run(conn):
+            row = conn.execute("SELECT v FROM meta WHERE k='version'").fetchone()
+            if row is None or row[0] != self.version:
+                conn.execute("DELETE FROM entries WHERE version != ?", (self.version,))
+                conn.execute("DELETE FROM summaries")
+                conn.execute("INSERT OR REPLACE INTO meta (k, v) VALUES ('version', ?)", (self.version,))
+        self._write(run)
+
+    def make_key(self, text: str, model: str, context: str = "") -> str:
+        raw = "\0".join([self.version, model, context_key(context), normalize_text(text)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: List[str], model: str, context: str = "") -> Dict[int, Dict]:
+        """
+        texts のうちキャッシュにあるものを {入力位置: {"sentiment", "topic"}} で返す。
+        """
+        keys = [self.make_key(t, model, context) for t in texts]
+        uniq = list(dict.fromkeys(keys))
+
+        def run(conn) -> Dict[str, Dict]:
+            found: Dict[str, Dict] = {}
+            for i in range(0, len(uniq), 500):
+                part = uniq[i:i + 500]
+                q = "SELECT key, sentiment, topic FROM entries WHERE version = ? AND key IN (%s)" % ",".join("?" * len(part))
+                for k, s, t in conn.execute(q, [self.version, *part]):
+                    found[k] = {"sentiment": int(s), "topic": t}
+            if found:
+                now = time.time()
+                conn.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+            return found
+
+        found = self._write(run)
+        out = {i: dict(found[k]) for i, k in enumerate(keys) if k in found}
+        with self._lock:
+            self.hits += len(out)
+            self.misses += len(keys) - len(out)
+        return out
+
+    def put_many(self, texts: List[str], results: List[Dict], model: str, context: str = "") -> None:
+        now = time.time()
+        rows = [
+            (self.make_key(t, model, context), self.version, int(r["sentiment"]), str(r["topic"]), now)
+            for t, r in zip(texts, results)
+        ]
+        def run(conn):
+            conn.executemany(
+                "INSERT OR REPLACE INTO entries (key, version, sentiment, topic, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._evict(conn, len(rows))
+        self._write(run)
+
+    def _evict(self, conn: sqlite3.Connection, added: int) -> None:
+        """概算の件数が上限を超えたとき（か、上限の 1/20 を書くたび）だけ数え直して、超えた分を古い順に消す"""
+        self._approx_entries += added
+        self._added_since_count += added
+        if (self._approx_entries <= self.max_entries
+                and self._added_since_count < max(self.max_entries // 20, 1)):
+            return
+        n = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        over = n - self.max_entries
+        if over > 0:
+            conn.execute(
+                "DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY last_used ASC LIMIT ?)",
+                (over,),
+            )
+        self._approx_entries = min(n, self.max_entries)
+        self._added_since_count = 0
+
+    # ---- 文字起こし要約 ----
+    def summary_key(self, transcript: str, model: str, prompt: str = "") -> str:
+        raw = "\0".join([self.version, model, context_key(prompt), transcript])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get_summary(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT summary FROM summaries WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put_summary(self, key: str, summary: str) -> None:
+        self._write(lambda conn: conn.execute(
+            "INSERT OR REPLACE INTO summaries (key, summary, created) VALUES (?, ?, ?)", (key, summary, time.time())))
+
+    def size(self) -> int:
+        with self._lock:
+            return int(self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0])
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / total) if total else 0.0,
+            "size": self.size(),
+        }
+
+    def clear(self) -> None:
+        def run(conn):
+            conn.execute("DELETE FROM entries")
+            conn.execute("DELETE FROM summaries")
+            self._approx_entries = 0
+        self._write(run)
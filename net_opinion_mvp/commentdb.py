@@ -0,0 +1,183 @@
+# commentdb.py — コメント一覧用の組み込みクエリエンジン（SQLite・索引 + 全文検索 + キーセット方式のページ送り）
+"""
+判定済みフレームを SQLite（既定はメモリ上）に入れ、コメント一覧の絞り込み・並べ替え・本文検索を
+SQL で行って、表示する1ページ分だけを DataFrame で返す（全件をフロントエンドに送らない）。
+
+- 索引: source / topic / sentiment / date（それぞれ 並べ替えキー・rowid と複合）
+- 本文検索: FTS5 の trigram トークナイザ（日本語は分かち書きしないので 3文字単位で引く）。
+  空白区切りの語はすべて含むもの（AND）。3文字未満の語は LIKE で探す。全文検索の索引は最初の検索時に作る
+- ページ送りは OFFSET ではなくキーセット方式（前ページ末尾の (並べ替えキー, rowid) より後ろを取る）
+  なので、何ページ目でも同じ速さ
+
+  db = CommentDB.from_frame(dfx)
+  page, cursor = db.page(CommentQuery(sources=["YouTube"], search="政策"), limit=50)
+  page2, cursor2 = db.page(query, after=cursor, limit=50)   # cursor が None なら最後のページ
+"""
+import sqlite3, threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+COLUMNS = ["published_at", "source", "topic", "sentiment", "likes", "text", "heuristic_rule"]
+SORT_KEYS = {"published_at": "ts", "likes": "likes", "sentiment": "sentiment"}
+
+_SCHEMA = [
+    "CREATE TABLE comments ("
+    " rowid INTEGER PRIMARY KEY,"
+    " ts REAL NOT NULL,"            # 投稿時刻（UNIX 秒。読めないものは -inf 扱いで最後に並ぶ）
+    " date TEXT,"
+    " published_at TEXT, source TEXT, topic TEXT, sentiment INTEGER, likes INTEGER,"
+    " text TEXT, heuristic_rule TEXT)",
+    "CREATE VIRTUAL TABLE comments_fts USING fts5(text, content='comments', content_rowid='rowid',"
+    " tokenize='trigram')",
+]
+_INDEXES = [
+    "CREATE INDEX idx_ts ON comments(ts, rowid)",
+    "CREATE INDEX idx_likes ON comments(likes, rowid)",
+    "CREATE INDEX idx_source ON comments(source, ts, rowid)",
+    "CREATE INDEX idx_topic ON comments(topic, ts, rowid)",
+    "CREATE INDEX idx_sentiment ON comments(sentiment, ts, rowid)",
+    "CREATE INDEX idx_date ON comments(date, ts, rowid)",
+]
+
+
+@dataclass
+class CommentQuery:
+    """コメント一覧の条件（空のリスト・None は絞り込まない）"""
+    sources: List[str] = field(default_factory=list)
+    topics: List[str] = field(default_factory=list)
+    sentiments: List[int] = field(default_factory=list)
+    start: Optional[str] = None   # 'YYYY-MM-DD'（両端を含む）
+    end: Optional[str] = None
+    search: str = ""
+    sort: str = "published_at"    # SORT_KEYS のどれか
+    descending: bool = True
+
+    def key(self) -> Tuple:
+        """条件が変わったかどうかの比較用（変わったらページ送りを最初に戻す）"""
+        return (tuple(self.sources), tuple(self.topics), tuple(self.sentiments), self.start, self.end,
+                self.search.strip(), self.sort, self.descending)
+
+
+def _fts_phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+class CommentDB:
+    """判定済みコメントの索引付きテーブル（読み取り専用。作り直すときは from_frame()）"""
+
+    def __init__(self, path: str = ":memory:"):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._fts_ready = False
+        for stmt in _SCHEMA:
+            self._conn.execute(stmt)
+
+    @classmethod
+    def from_frame(cls, dfx: pd.DataFrame, path: str = ":memory:") -> "CommentDB":
+        db = cls(path)
+        db.load(dfx)
+        return db
+
+    def load(self, dfx: pd.DataFrame) -> int:
+        """enrich() 済みのフレームを入れる（索引は入れ終わってから作る）"""
+        ts = pd.to_datetime(dfx["published_at"], errors="coerce", utc=True)
+        secs = ((ts - pd.Timestamp(0, tz="UTC")) / pd.Timedelta(seconds=1)).fillna(-np.inf)
+        day = ts.dt.tz_localize(None).to_numpy().astype("datetime64[D]")  # strftime より桁違いに速い
+        date = pd.Series(day.astype(str), index=dfx.index).where(ts.notna().to_numpy(), None)
+
+        def text(col: str) -> list:
+            if col not in dfx.columns:
+                return [None] * len(dfx)
+            c = dfx[col].astype(object)
+            return c.where(c.notna(), None).tolist()
+
+        likes = pd.to_numeric(dfx["likes"], errors="coerce").fillna(0).astype("int64") if "likes" in dfx.columns \
+            else pd.Series(0, index=dfx.index)
+        rows = zip(range(1, len(dfx) + 1), secs.tolist(), date.tolist(),
+                   text("published_at"), text("source"), text("topic"),
+                   pd.to_numeric(dfx["sentiment"], errors="coerce").fillna(0).astype(int).tolist(),
+                   likes.tolist(), text("text"), text("heuristic_rule"))
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT INTO comments VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            for stmt in _INDEXES:
+                self._conn.execute(stmt)
+            self._conn.execute("ANALYZE")
+            self._fts_ready = False
+        return len(dfx)
+
+    def _ensure_fts(self) -> None:
+        """全文検索の索引を作る（30万件で数秒かかるので、検索されるまで作らない）"""
+        with self._lock:
+            if not self._fts_ready:
+                with self._conn:
+                    self._conn.execute("INSERT INTO comments_fts(comments_fts) VALUES ('rebuild')")
+                self._fts_ready = True
+
+    def _where(self, q: CommentQuery) -> Tuple[List[str], List]:
+        conds, params = [], []
+        for col, values in (("source", q.sources), ("topic", q.topics), ("sentiment", q.sentiments)):
+            if values:
+                conds.append(f"{col} IN ({','.join('?' * len(values))})")
+                params.extend(values)
+        if q.start:
+            conds.append("date >= ?")
+            params.append(str(q.start))
+        if q.end:
+            conds.append("date <= ?")
+            params.append(str(q.end))
+        terms = q.search.split()
+        long_terms = [t for t in terms if len(t) >= 3]
+        if long_terms:
+            self._ensure_fts()
+            conds.append("rowid IN (SELECT rowid FROM comments_fts WHERE comments_fts MATCH ?)")
+            params.append(" AND ".join(_fts_phrase(t) for t in long_terms))
+        for t in terms:
+            if len(t) < 3:
+                conds.append("text LIKE ? ESCAPE '\\'")
+                params.append("%" + t.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        return conds, params
+
+    def count(self, q: CommentQuery) -> int:
+        conds, params = self._where(q)
+        sql = "SELECT COUNT(*) FROM comments" + (" WHERE " + " AND ".join(conds) if conds else "")
+        with self._lock:
+            return int(self._conn.execute(sql, params).fetchone()[0])
+
+    def page(self, q: CommentQuery, after: Optional[Tuple] = None,
+             limit: int = 50) -> Tuple[pd.DataFrame, Optional[Tuple]]:
+        """
+        条件に合う行を並べ替えて、after（前のページの返却カーソル）の次から limit 件。
+        返却: (COLUMNS の DataFrame, 次のページのカーソル / 最後のページなら None)
+        """
+        key = SORT_KEYS[q.sort]
+        op, order = ("<", "DESC") if q.descending else (">", "ASC")
+        conds, params = self._where(q)
+        if after is not None:
+            conds.append(f"({key}, rowid) {op} (?, ?)")
+            params.extend(after)
+        sql = (f"SELECT {key}, rowid, {', '.join(COLUMNS)} FROM comments"
+               + (" WHERE " + " AND ".join(conds) if conds else "")
+               + f" ORDER BY {key} {order}, rowid {order} LIMIT ?")
+        with self._lock:
+            rows = self._conn.execute(sql, params + [limit + 1]).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        df = pd.DataFrame([r[2:] for r in rows], columns=COLUMNS)
+        cursor = (rows[-1][0], rows[-1][1]) if more and rows else None
+        return df, cursor
+
+    def explain(self, q: CommentQuery) -> List[str]:
+        """page() のクエリプラン（索引が使われているかの確認用）"""
+        key = SORT_KEYS[q.sort]
+        conds, params = self._where(q)
+        sql = (f"SELECT rowid FROM comments" + (" WHERE " + " AND ".join(conds) if conds else "")
+               + f" ORDER BY {key} DESC, rowid DESC LIMIT 50")
+        with self._lock:
+            return [r[-1] for r in self._conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"rows": int(self._conn.execute("SELECT COUNT(*) FROM comments").fetchone()[0])}
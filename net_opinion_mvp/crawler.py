@@ -0,0 +1,296 @@
+"""
+複数動画のコメントを並列に差分取得するクローラ（YouTube Data API のクォータ管理つき）。
+使い方:
+  export YOUTUBE_API_KEY=...
+  python crawler.py VIDEO_ID [VIDEO_ID ...] --out-dir data --workers 4 --replies
+
+- 動画ごとに ingest_youtube.fetch_comments_incremental を呼び、data/comments_<VIDEO_ID>.csv へ追記
+- QuotaScheduler が1日のクォータ予算（既定 10,000 units）に対する消費を管理し、
+  残りクォータとリセット（太平洋時間 0 時）までの時間から呼び出し間隔を決める（固定 sleep なし）
+- コメント数の伸びが速い動画から優先して取得する。残りクォータは優先順に動画ごとのページ数として割り当て、
+  割り当てが尽きた（伸びの遅い）動画は次のラウンドに回す
+"""
+import os, sys, json, time, logging, argparse, threading
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Callable
+
+from ingest_youtube import API_KEY, fetch_comments_incremental
+from locks import file_lock
+
+try:
+    from zoneinfo import ZoneInfo
+    _PACIFIC = ZoneInfo("America/Los_Angeles")
+except Exception:  # tzdata が無い環境では PST 固定
+    _PACIFIC = timezone(timedelta(hours=-8))
+
+logger = logging.getLogger(__name__)
+
+# API ごとの消費クォータ（commentThreads.list / comments.list / videos.list はいずれも 1 unit）
+QUOTA_COST = {"commentThreads.list": 1, "comments.list": 1, "videos.list": 1}
+
+
+class QuotaScheduler:
+    """
+    1日のクォータ予算を、リセットまでの残り時間に均して使うスケジューラ。
+    - burst 単位までは待たずに使える（使い切ると、残りクォータ ÷ 残り時間 のペースで補充）
+    - state_path を渡すと当日の消費量をファイルに保存し、別プロセス・再実行でも予算を守る
+      （消費するたびにロックを取ってファイルの合計を読み直し、足して書く。ペースの補充はプロセスごと）
+    """
+
+    def __init__(self, daily_budget: int = 10_000, burst: int = 200, state_path: Optional[str] = None,
+                 clock: Callable[[], datetime] = None):
+        self.daily_budget = daily_budget
+        self.burst = burst
+        self.state_path = state_path
+        self._clock = clock or (lambda: datetime.now(_PACIFIC))
+        self._lock = threading.Lock()
+        self._day = self._clock().date().isoformat()
+        self.used = 0
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._load()
+
+    def _load(self) -> None:
+        """当日の消費量（別プロセスの分も含む合計）をファイルから読む"""
+        if self.state_path and os.path.exists(self.state_path):
+            with open(self.state_path, encoding="utf-8") as f:
+                st = json.load(f)
+            self.used = int(st.get("used", 0)) if st.get("day") == self._day else 0
+
+    def _save(self) -> None:
+        if not self.state_path:
+            return
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"day": self._day, "used": self.used}, f)
+        os.replace(tmp, self.state_path)
+
+    def _charge(self, cost: int) -> bool:
+        """cost 単位を消費済みに足す。予算が足りなければ False"""
+        if not self.state_path:
+            if self.remaining < cost:
+                return False
+            self.used += cost
+            return True
+        with file_lock(self.state_path + ".lock"):
+            self._load()
+            if self.remaining < cost:
+                return False
+            self.used += cost
+            self._save()
+        return True
+
+    def seconds_until_reset(self) -> float:
+        now = self._clock()
+        tomorrow = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        return max((tomorrow - now).total_seconds(), 1.0)
+
+    @property
+    def remaining(self) -> int:
+        return max(self.daily_budget - self.used, 0)
+
+    def pace(self) -> float:
+        """現在の補充ペース（units/秒）= 残りクォータ ÷ リセットまでの秒数"""
+        return self.remaining / self.seconds_until_reset()
+
+    def acquire(self, cost: int = 1) -> bool:
+        """
+        cost 単位を確保する（必要ならペースに合わせて待つ）。予算が尽きていれば False。
+        """
+        while True:
+            with self._lock:
+                day = self._clock().date().isoformat()
+                if day != self._day:  # 日付が変わったらリセット
+                    self._day, self.used, self._tokens = day, 0, float(self.burst)
+                if self.remaining < cost:
+                    return False
+                now = time.monotonic()
+                self._tokens = min(float(self.burst), self._tokens + (now - self._updated) * self.pace())
+                self._updated = now
+                if self._tokens >= cost:
+                    if not self._charge(cost):
+                        return False
+                    self._tokens -= cost
+                    return True
+                wait = (cost - self._tokens) / max(self.pace(), 1e-9)
+            time.sleep(min(wait, 5.0))
+
+
+class VideoStats:
+    """動画ごとのコメント数の推移から伸び（件/時）と、次の差分取得に要るページ数の目安を推定する"""
+
+    def __init__(self):
+        self.last: Dict[str, tuple] = {}
+        self.growth: Dict[str, float] = {}
+        self.fetched: Dict[str, int] = {}  # このプロセスで取得した行数（コメント数から引いて未取得分を見積もる）
+
+    def update(self, video_id: str, comment_count: int, at: float, published_at: Optional[float] = None) -> None:
+        prev = self.last.get(video_id)
+        if prev is not None and at > prev[1]:
+            self.growth[video_id] = max(comment_count - prev[0], 0) / ((at - prev[1]) / 3600.0)
+        elif prev is None and published_at is not None and at > published_at:
+            # 初回は公開からの平均ペースで見積もる（未計測のままだと初回の順番が決まらない）
+            self.growth[video_id] = comment_count / max((at - published_at) / 3600.0, 1.0)
+        self.last[video_id] = (comment_count, at)
+
+    def add_fetched(self, video_id: str, rows: int) -> None:
+        self.fetched[video_id] = self.fetched.get(video_id, 0) + rows
+
+    def pages_needed(self, video_id: str) -> Optional[int]:
+        """次の差分取得に要るページ数の目安（未取得のコメント数 / 100 + 1）。コメント数が未計測なら None"""
+        if video_id not in self.last:
+            return None
+        return max(self.last[video_id][0] - self.fetched.get(video_id, 0), 0) // 100 + 1
+
+    def priority(self, video_ids: List[str]) -> List[str]:
+        """伸びの速い順（未計測の動画は先頭＝まず一度取りに行く）"""
+        return sorted(video_ids, key=lambda v: -self.growth.get(v, float("inf")))
+
+
+def allocate_pages(order: List[str], stats: VideoStats, budget: int,
+                   max_pages: Optional[int] = None) -> Dict[str, int]:
+    """
+    優先順（order）に、クォータの残り budget から動画ごとのページ数を割り当てる。
+    各動画には pages_needed() の目安（max_pages で頭打ち。目安が無ければ残りを未割り当ての動画数で均等に分けた分）。
+    予算が尽きたら以降の動画には割り当てない（今回は取らずに次のラウンドへ）。返却: {video_id: ページ数}
+    """
+    out: Dict[str, int] = {}
+    left = budget
+    for k, v in enumerate(order):
+        need = stats.pages_needed(v)
+        if need is None:
+            need = max(left // (len(order) - k), 1)
+        if max_pages is not None:
+            need = min(need, max_pages)
+        grant = min(need, left)
+        if grant <= 0:
+            break
+        out[v] = grant
+        left -= grant
+    return out
+
+
+def _build_youtube():
+    from googleapiclient.discovery import build
+    return build("youtube", "v3", developerKey=API_KEY)
+
+
+def _epoch(ts: str) -> Optional[float]:
+    try:
+        return datetime.fromisoformat(ts.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+def refresh_stats(youtube, video_ids: List[str], stats: VideoStats, scheduler: QuotaScheduler) -> None:
+    """videos().list(statistics, snippet) でコメント数・公開日時を取り、伸びを更新する（50件ずつ 1 unit）"""
+    for i in range(0, len(video_ids), 50):
+        if not scheduler.acquire(QUOTA_COST["videos.list"]):
+            return
+        res = youtube.videos().list(part="statistics,snippet", id=",".join(video_ids[i:i + 50])).execute()
+        now = time.time()
+        for item in res.get("items", []):
+            count = int(item.get("statistics", {}).get("commentCount", 0))
+            stats.update(item["id"], count, now, _epoch(item.get("snippet", {}).get("publishedAt")))
+
+
+def crawl(video_ids: List[str], out_dir: str, workers: int = 4, include_replies: bool = False,
+          scheduler: Optional[QuotaScheduler] = None, stats: Optional[VideoStats] = None,
+          youtube_factory: Callable[[], object] = _build_youtube,
+          max_pages: Optional[int] = None, store=None,
+          errors: Optional[Dict[str, Exception]] = None,
+          deferred: Optional[List[str]] = None) -> Dict[str, int]:
+    """
+    video_ids を伸びの速い順に、最大 workers 並列で差分取得する（1ラウンド）。
+    残りクォータは allocate_pages() で優先順に動画ごとのページ数として割り当て、割り当ての無い動画は取らない
+    （deferred に list を渡すと、そうして次のラウンドに回した動画を書き込む）。
+    youtube_factory はワーカーごとにクライアントを作る関数（googleapiclient のクライアントはスレッド間で共有しない）。
+    store（store.CommentStore）を渡すと CSV に加えて Parquet ストアにも追記する。
+    失敗した動画はログに残して飛ばす（他の動画の取得・進み具合はそのまま。次のラウンドで続きから取る）。
+    コメント数の取得（refresh_stats）に失敗した場合も、前回までの伸びで順番を決めて続ける。
+    errors に dict を渡すと {video_id: 例外} を書き込む。
+    返却: {video_id: 追記した行数}（失敗した動画・次のラウンドに回した動画は含まない）
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    scheduler = scheduler or QuotaScheduler(state_path=os.path.join(out_dir, "quota.json"))
+    stats = stats or VideoStats()
+    try:
+        refresh_stats(youtube_factory(), video_ids, stats, scheduler)
+    except Exception as e:
+        logger.warning("コメント数の取得に失敗しました（前回までの伸びで順番を決めます）: %s", e)
+
+    local = threading.local()
+
+    def run(video_id: str, pages: int) -> int:
+        if not hasattr(local, "youtube"):
+            local.youtube = youtube_factory()
+        return fetch_comments_incremental(
+            video_id, os.path.join(out_dir, f"comments_{video_id}.csv"),
+            youtube=local.youtube, sleep=0, max_pages=pages,
+            include_replies=include_replies, throttle=scheduler.acquire, store=store,
+        )
+
+    order = stats.priority(video_ids)
+    pages = allocate_pages(order, stats, scheduler.remaining, max_pages)
+    skipped = [v for v in order if v not in pages]
+    if skipped:
+        logger.info("クォータの残りが足りないので %d 本は次のラウンドに回します: %s", len(skipped), ", ".join(skipped))
+        if deferred is not None:
+            deferred.extend(skipped)
+    written: Dict[str, int] = {}
+    if not pages:
+        return written
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(pages)))) as ex:
+        futures = {ex.submit(run, v, n): v for v, n in pages.items()}
+        for fut in as_completed(futures):
+            vid = futures[fut]
+            try:
+                written[vid] = fut.result()
+            except Exception as e:
+                logger.warning("%s: コメントの取得に失敗しました: %s", vid, e)
+                if errors is not None:
+                    errors[vid] = e
+                continue
+            stats.add_fetched(vid, written[vid])
+    return {v: written[v] for v in order if v in written}
+
+
+if __name__ == "__main__":
+    if API_KEY is None:
+        print("環境変数YOUTUBE_API_KEYが未設定です。", file=sys.stderr)
+        sys.exit(1)
+    ap = argparse.ArgumentParser(description="複数動画のコメント差分取得（クォータ管理つき）")
+    ap.add_argument("video_ids", nargs="+")
+    ap.add_argument("--out-dir", default="data")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--replies", action="store_true", help="返信スレッドも展開して取得する")
+    ap.add_argument("--budget", type=int, default=10_000, help="1日のクォータ予算（units）")
+    ap.add_argument("--rounds", type=int, default=1, help="巡回回数（2回目以降は伸びの速い動画から）")
+    ap.add_argument("--interval", type=float, default=600.0, help="巡回の間隔（秒）")
+    ap.add_argument("--store", default=None, help="Parquet ストア（ディレクトリ）にも追記する")
+    args = ap.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    scheduler = QuotaScheduler(args.budget, state_path=os.path.join(args.out_dir, "quota.json"))
+    stats = VideoStats()
+    store = None
+    if args.store:
+        from store import CommentStore
+        store = CommentStore(args.store)
+    for r in range(args.rounds):
+        errors: Dict[str, Exception] = {}
+        deferred: List[str] = []
+        written = crawl(args.video_ids, args.out_dir, workers=args.workers, include_replies=args.replies,
+                        scheduler=scheduler, stats=stats, store=store, errors=errors, deferred=deferred)
+        for vid, n in written.items():
+            print(f"[round {r + 1}] {vid}: +{n} 件", file=sys.stderr)
+        for vid, e in errors.items():
+            print(f"[round {r + 1}] {vid}: 失敗（{e}）", file=sys.stderr)
+        for vid in deferred:
+            print(f"[round {r + 1}] {vid}: クォータ不足で次のラウンドへ", file=sys.stderr)
+        print(f"[round {r + 1}] クォータ使用 {scheduler.used:,} / {args.budget:,}", file=sys.stderr)
+        if scheduler.remaining <= 0:
+            break
+        if r + 1 < args.rounds:
+            time.sleep(args.interval)
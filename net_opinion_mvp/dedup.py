@@ -0,0 +1,134 @@
+# dedup.py — 分類前の重複/ほぼ重複コメントのまとめ上げ
+"""
+同じ（またはほぼ同じ）コメントは1件だけ GPT に投げ、そのラベルをグループ全員にコピーする。
+
+- 完全重複: 正規化（全角/半角の統一・空白/句読点の除去・絵文字の連続を1つに）後のハッシュで判定
+- ほぼ重複（任意）: 文字 n-gram の MinHash + LSH で候補を出し、推定 Jaccard 類似度で確定
+"""
+import re, hashlib, unicodedata
+from typing import List, Dict, Tuple
+import numpy as np
+
+_WS_RE = re.compile(r"\s+")
+# 絵文字（異体字セレクタ・ZWJ を含む）の連続
+_EMOJI_RUN_RE = re.compile(
+    "([\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF])[\U0001F000-\U0001FAFF\u2600-\u27BF\u2B00-\u2BFF\uFE0F\u200D]*"
+)
+# 同じ文字の連続（www / ーーー / 笑笑 など）
+_REPEAT_RE = re.compile(r"([wｗ笑ー〜~])\1+")
+
+_MERSENNE = (1 << 61) - 1
+
+
+def normalize_for_dedup(text) -> str:
+    """重複判定用の正規化"""
+    if not isinstance(text, str):
+        text = "" if text is None else str(text)
+    t = unicodedata.normalize("NFKC", text).lower()
+    t = _WS_RE.sub("", t)
+    t = "".join(c for c in t if not unicodedata.category(c).startswith("P"))  # 句読点・記号
+    t = _EMOJI_RUN_RE.sub(r"\1", t)
+    t = _REPEAT_RE.sub(r"\1", t)
+    return t
+
+
+def _exact_key(norm: str) -> str:
+    return hashlib.blake2b(norm.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class _UnionFind:
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+
+    def find(self, x: int) -> int:
+        while self.parent[x] != x:
+            self.parent[x] = self.parent[self.parent[x]]
+            x = self.parent[x]
+        return x
+
+    def union(self, a: int, b: int) -> None:
+        ra, rb = self.find(a), self.find(b)
+        if ra != rb:
+            # 代表は常に小さい位置（= 先に出てきたコメント）
+            if ra < rb:
+                self.parent[rb] = ra
+            else:
+                self.parent[ra] = rb
+
+
+def _minhash_signatures(texts: List[str], ngram: int, num_perm: int, seed: int) -> np.ndarray:
+    """文字 n-gram の MinHash 署名（len(texts) × num_perm）"""
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, _MERSENNE, size=num_perm, dtype=np.uint64)
+    sigs = np.empty((len(texts), num_perm), dtype=np.uint64)
+    for i, t in enumerate(texts):
+        grams = {t[j:j + ngram] for j in range(max(len(t) - ngram + 1, 1))}
+        h = np.array(
+            [int.from_bytes(hashlib.blake2b(g.encode("utf-8"), digest_size=4).digest(), "little") for g in grams],
+            dtype=np.uint64,
+        )
+        # (a*h + b) mod p を全 permutation 分まとめて計算（h < 2^32, a < 2^31 なので uint64 で溢れない）
+        perm = (np.outer(h, a) + b) % _MERSENNE
+        sigs[i] = perm.min(axis=0)
+    return sigs
+
+
+def group_duplicates(texts: List[str], near: bool = False, threshold: float = 0.8,
+                     ngram: int = 3, num_perm: int = 64, bands: int = 16,
+                     seed: int = 1) -> List[int]:
+    """
+    各テキストの代表位置（グループ内で最初に出てきた位置）を返す。
+    near=True のとき、推定 Jaccard 類似度が threshold 以上のものも同じグループにまとめる。
+    """
+    n = len(texts)
+    norms = [normalize_for_dedup(t) for t in texts]
+    uf = _UnionFind(n)
+
+    first: Dict[str, int] = {}
+    for i, t in enumerate(norms):
+        k = _exact_key(t)
+        if k in first:
+            uf.union(first[k], i)
+        else:
+            first[k] = i
+
+    if near:
+        # 完全重複の代表だけを MinHash にかける（短すぎる文は誤結合しやすいので対象外）
+        cand = [i for i in first.values() if len(norms[i]) >= ngram * 2]
+        if len(cand) > 1:
+            sigs = _minhash_signatures([norms[i] for i in cand], ngram, num_perm, seed)
+            rows = num_perm // bands
+            for band in range(bands):
+                buckets: Dict[bytes, List[int]] = {}
+                part = sigs[:, band * rows:(band + 1) * rows]
+                for j in range(len(cand)):
+                    buckets.setdefault(part[j].tobytes(), []).append(j)
+                for members in buckets.values():
+                    if len(members) < 2:
+                        continue
+                    head = members[0]
+                    for j in members[1:]:
+                        if uf.find(cand[head]) == uf.find(cand[j]):
+                            continue
+                        if float(np.mean(sigs[head] == sigs[j])) >= threshold:
+                            uf.union(cand[head], cand[j])
+
+    return [uf.find(i) for i in range(n)]
+
+
+def collapse(texts: List[str], near: bool = False, **kwargs) -> Tuple[List[int], List[int]]:
+    """
+    (代表の位置リスト, 各テキストが代表リストの何番目に対応するか) を返す。
+    代表だけ分類して labels[mapping[i]] で全行に戻す想定。
+    """
+    reps_of = group_duplicates(texts, near=near, **kwargs)
+    order: Dict[int, int] = {}
+    reps: List[int] = []
+    mapping: List[int] = []
+    for r in reps_of:
+        if r not in order:
+            order[r] = len(reps)
+            reps.append(r)
+        mapping.append(order[r])
+    return reps, mapping
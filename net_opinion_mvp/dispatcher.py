@@ -0,0 +1,130 @@
+# dispatcher.py — GPTバッチの並列ディスパッチとレート制御（RPM/TPM トークンバケット）
+"""
+- dispatch(): スレッドプールでバッチを並列実行し、入力順で結果を返す
+- RateLimiter: 1分あたりのリクエスト数(RPM)・トークン数(TPM)をトークンバケットで制御
+- retry_after_seconds(): 429 応答のヘッダ（retry-after / x-ratelimit-reset-*）から待ち時間を読む
+"""
+import re, time, threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Optional, TypeVar, Sequence
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class TokenBucket:
+    """
+    1分あたり rate_per_min 個補充されるバケット。rate_per_min <= 0 なら無制限。
+    """
+
+    def __init__(self, rate_per_min: float):
+        self.capacity = float(rate_per_min)
+        self.tokens = float(rate_per_min)
+        self.rate = float(rate_per_min) / 60.0
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, n: float = 1.0) -> None:
+        if self.capacity <= 0:
+            return
+        n = min(float(n), self.capacity)  # 1回で容量を超える要求は容量分だけ待つ
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= n:
+                    self.tokens -= n
+                    return
+                wait = (n - self.tokens) / self.rate
+            time.sleep(min(wait, 1.0))
+
+    def drain(self, seconds: float) -> None:
+        """429 を受けたとき：バケットを空にして seconds 秒は補充が追いつかないようにする"""
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._refill()
+            self.tokens = -seconds * self.rate
+
+
+class RateLimiter:
+    """RPM と TPM の2つのバケットをまとめたもの（0 以下は無制限）"""
+
+    def __init__(self, rpm: float = 0, tpm: float = 0):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+
+    def acquire(self, est_tokens: int = 0) -> None:
+        self.requests.acquire(1)
+        if est_tokens:
+            self.tokens.acquire(est_tokens)
+
+    def penalize(self, seconds: float) -> None:
+        self.requests.drain(seconds)
+
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNIT_SEC = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """'1.5'（秒）, '20ms', '6m0s' などを秒に変換"""
+    value = (value or "").strip()
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_RE.findall(value)
+    if not parts:
+        return None
+    return sum(float(n) * _UNIT_SEC[u] for n, u in parts)
+
+
+def retry_after_seconds(exc: BaseException, default: float = 2.0) -> float:
+    """
+    例外（openai.RateLimitError 等）に付いた HTTP 応答ヘッダからサーバ指定の待ち時間を取り出す。
+    見つからなければ default。
+    """
+    resp = getattr(exc, "response", None)
+    headers = getattr(resp, "headers", None)
+    if not headers:
+        return default
+    ms = _parse_duration(headers.get("retry-after-ms", ""))
+    if ms is not None:
+        return ms / 1000.0
+    for h in ("retry-after", "x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        sec = _parse_duration(headers.get(h, ""))
+        if sec is not None:
+            return sec
+    return default
+
+
+def dispatch(fn: Callable[[T], R], items: Sequence[T], concurrency: int = 4,
+             progress: Optional[Callable[[int, int], None]] = None) -> List[R]:
+    """
+    items の各要素に fn を並列適用し、入力順で結果を返す。
+    いずれかが例外を投げた場合はその例外をそのまま送出する。
+    progress(完了数, 全体数) は1件終わるごとに呼び出し元のスレッドで呼ばれる（Streamlit の表示更新用）。
+    """
+    total = len(items)
+    if concurrency <= 1 or total <= 1:
+        out = []
+        for x in items:
+            out.append(fn(x))
+            if progress:
+                progress(len(out), total)
+        return out
+    results: List[Optional[R]] = [None] * total
+    with ThreadPoolExecutor(max_workers=min(concurrency, total)) as ex:
+        futures = {ex.submit(fn, x): i for i, x in enumerate(items)}
+        for done, fut in enumerate(as_completed(futures), 1):
+            results[futures[fut]] = fut.result()
+            if progress:
+                progress(done, total)
+    return results
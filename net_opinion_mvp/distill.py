@@ -0,0 +1,140 @@
+"""
+GPT の判定結果を教師にしたローカル分類器（文字 n-gram TF-IDF + 線形モデル）。
+GPT の前段に置き、自信のあるコメントはローカルで判定して API に投げない。
+使い方:
+  python distill.py train --store store              # 保存済みの判定結果から学習
+  python distill.py eval  --store store              # しきい値ごとの GPT との一致率 / オフロード率
+
+- 学習・推論には scikit-learn が必要（無い環境ではカスケードは無効になり、全件 GPT に投げる）
+- 感情・トピックの両方の確信度がしきい値以上のコメントだけをオフロードする
+- 学習に使うのは GPT が付けたラベルの行だけ（判定結果の label_source 列）
+"""
+import os, sys, pickle, argparse
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import LogisticRegression
+except Exception:  # 任意依存
+    TfidfVectorizer = LogisticRegression = None
+
+DEFAULT_MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "distilled.pkl")
+
+
+class DistilledClassifier:
+    def __init__(self, vectorizer, sentiment_model, topic_model, prompt_version: str = ""):
+        self.vectorizer = vectorizer
+        self.sentiment_model = sentiment_model
+        self.topic_model = topic_model
+        self.prompt_version = prompt_version
+
+    def predict(self, texts: Sequence[str]) -> Tuple[List[Dict], np.ndarray]:
+        """
+        返却: ([{"sentiment", "topic"}], 確信度) — 確信度は感情・トピックの最大確率の小さい方
+        """
+        if not len(texts):
+            return [], np.zeros(0)
+        X = self.vectorizer.transform(texts)
+        ps = self.sentiment_model.predict_proba(X)
+        pt = self.topic_model.predict_proba(X)
+        s = self.sentiment_model.classes_[ps.argmax(axis=1)]
+        t = self.topic_model.classes_[pt.argmax(axis=1)]
+        conf = np.minimum(ps.max(axis=1), pt.max(axis=1))
+        labels = [{"sentiment": int(a), "topic": str(b)} for a, b in zip(s, t)]
+        return labels, conf
+
+    def save(self, path: str = DEFAULT_MODEL_PATH) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+
+
+def train(texts: Sequence[str], sentiments: Sequence[int], topics: Sequence[str],
+          prompt_version: str = "") -> DistilledClassifier:
+    if TfidfVectorizer is None:
+        raise RuntimeError("scikit-learn が見つかりません。`pip install scikit-learn` を実行してください。")
+    vec = TfidfVectorizer(analyzer="char_wb", ngram_range=(1, 3), min_df=2, sublinear_tf=True, max_features=200_000)
+    X = vec.fit_transform(texts)
+    sm = LogisticRegression(max_iter=1000, C=4.0).fit(X, np.asarray(sentiments, dtype=int))
+    tm = LogisticRegression(max_iter=1000, C=4.0).fit(X, np.asarray(topics, dtype=object))
+    return DistilledClassifier(vec, sm, tm, prompt_version)
+
+
+def load(path: str = DEFAULT_MODEL_PATH, prompt_version: Optional[str] = None) -> Optional[DistilledClassifier]:
+    """
+    学習済みモデルを読む。ファイルが無い・scikit-learn が無い・プロンプト版が違う場合は None。
+    """
+    if TfidfVectorizer is None or not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        model = pickle.load(f)
+    if prompt_version and model.prompt_version and model.prompt_version != prompt_version:
+        return None
+    return model
+
+
+def evaluate(texts: Sequence[str], sentiments: Sequence[int], topics: Sequence[str],
+             thresholds: Sequence[float] = (0.5, 0.6, 0.7, 0.8, 0.9, 0.95),
+             test_size: float = 0.2, seed: int = 0):
+    """
+    学習/評価に分割し、しきい値ごとに
+    オフロード率・オフロード分の GPT との一致率（感情/トピック）・全体の一致率 を返す。
+    全体の一致率 = オフロード分はローカルの判定、残りは GPT そのもの（= 一致）として計算。
+    """
+    import pandas as pd
+    texts, sentiments, topics = list(texts), np.asarray(sentiments, dtype=int), np.asarray(topics, dtype=object)
+    idx = np.random.default_rng(seed).permutation(len(texts))
+    n_test = max(int(len(texts) * test_size), 1)
+    test, tr = idx[:n_test], idx[n_test:]
+    model = train([texts[i] for i in tr], sentiments[tr], topics[tr])
+    labels, conf = model.predict([texts[i] for i in test])
+    ok_s = np.array([l["sentiment"] for l in labels]) == sentiments[test]
+    ok_t = np.array([l["topic"] for l in labels]) == topics[test]
+
+    rows = []
+    for th in thresholds:
+        off = conf >= th
+        n_off = int(off.sum())
+        rows.append({
+            "threshold": th,
+            "offload_rate": n_off / len(test),
+            "sentiment_agreement_offloaded": float(ok_s[off].mean()) if n_off else float("nan"),
+            "topic_agreement_offloaded": float(ok_t[off].mean()) if n_off else float("nan"),
+            "sentiment_agreement_overall": float((ok_s | ~off).mean()),
+            "topic_agreement_overall": float((ok_t | ~off).mean()),
+        })
+    return pd.DataFrame(rows)
+
+
+def _load_training_data(store_dir: str):
+    """
+    GPT が付けたラベルの行だけ（label_source == "gpt"）。ローカル分類器自身の判定・救済ロジック・
+    文脈再判定・判定できずに 0/その他 にした行、出どころの記録が無い古い行は使わない
+    """
+    from store import CommentStore
+    df = CommentStore(store_dir).read_enriched(columns=["text", "sentiment", "topic", "label_source"])
+    df = df[(df["label_source"].astype(str) == "gpt") & (df["text"].astype(str).str.len() > 0)]
+    return df["text"].astype(str).tolist(), df["sentiment"].astype(int).tolist(), df["topic"].astype(str).tolist()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="GPT 判定結果からローカル分類器を学習・評価する")
+    ap.add_argument("command", choices=["train", "eval"])
+    ap.add_argument("--store", default="store", help="判定結果の入った Parquet ストア")
+    ap.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    args = ap.parse_args()
+
+    texts, sents, topics = _load_training_data(args.store)
+    if len(texts) < 50:
+        print(f"学習データが少なすぎます（GPT が判定した行 {len(texts)} 件。label_source の無い古い判定結果は使いません）",
+              file=sys.stderr)
+        sys.exit(1)
+    if args.command == "train":
+        import distill  # __main__ のクラスのまま pickle すると analyze から読めないので、モジュールの方で作る
+        from analyze import PROMPT_VERSION
+        distill.train(texts, sents, topics, prompt_version=PROMPT_VERSION).save(args.model)
+        print(f"{len(texts):,} 件で学習しました: {args.model}", file=sys.stderr)
+    else:
+        print(evaluate(texts, sents, topics).to_string(index=False, float_format=lambda x: f"{x:.3f}"))
@@ -3,10 +3,12 @@ YouTubeコメント取得（公式API）。
 使い方:
   export YOUTUBE_API_KEY=...
   python ingest_youtube.py VIDEO_ID > comments_youtube.csv
+  python ingest_youtube.py VIDEO_ID comments_youtube.csv --incremental   # 差分取得・中断再開
 
 注意: API割当・利用規約を順守すること。
 """
-import os, sys, time
+import os, sys, time, json, argparse
+from typing import Callable, Dict, List, Optional
 import pandas as pd
 from googleapiclient.discovery import build
 
@@ -38,15 +40,214 @@ def fetch_comments(video_id: str, max_pages: int = 5) -> pd.DataFrame:
         time.sleep(0.2)
     return pd.DataFrame(comments)
 
+def _row(item: Dict, video_id: str) -> Dict:
+    sn = item["snippet"]["topLevelComment"]["snippet"]
+    return {
+        "source": "YouTube",
+        "text": sn.get("textDisplay", ""),
+        "likes": sn.get("likeCount", 0),
+        "published_at": sn.get("publishedAt", ""),
+        "comment_id": item.get("id", ""),
+        "video_id": video_id,
+        "parent_id": "",
+    }
+
+
+def _reply_row(item: Dict, video_id: str, parent_id: str) -> Dict:
+    sn = item["snippet"]
+    return {
+        "source": "YouTube",
+        "text": sn.get("textDisplay", ""),
+        "likes": sn.get("likeCount", 0),
+        "published_at": sn.get("publishedAt", ""),
+        "comment_id": item.get("id", ""),
+        "video_id": video_id,
+        "parent_id": parent_id,
+    }
+
+
+def _fetch_replies(youtube, thread_id: str, video_id: str,
+                   throttle: Optional[Callable[[int], bool]]) -> Optional[List[Dict]]:
+    """
+    スレッドの返信を comments().list で全ページ取得する。
+    throttle に止められた場合は None（呼び出し側でそのページを未処理扱いにする）。
+    """
+    rows: List[Dict] = []
+    req = youtube.comments().list(part="snippet", parentId=thread_id, maxResults=100, textFormat="plainText")
+    while req is not None:
+        if throttle is not None and not throttle(1):
+            return None
+        res = req.execute()
+        rows.extend(_reply_row(c, video_id, thread_id) for c in res.get("items", []))
+        req = youtube.comments().list_next(req, res)
+    return rows
+
+
+def _load_state(path: str) -> Dict:
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return {}
+
+
+def _save_state(path: str, state: Dict) -> None:
+    """途中で落ちても壊れないよう一時ファイル経由で置き換える"""
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def _append_csv(rows: List[Dict], path: str) -> None:
+    if not rows:
+        return
+    new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+    # 追記時は BOM を付けない（utf-8-sig は先頭位置でのみ BOM を書く）
+    pd.DataFrame(rows).to_csv(path, mode="a", header=new_file, index=False, encoding="utf-8-sig")
+
+
+def fetch_comments_incremental(video_id: str, output: Optional[str], state_path: Optional[str] = None,
+                               youtube=None, chunk_size: int = 1000,
+                               max_pages: Optional[int] = None, sleep: float = 0.2,
+                               include_replies: bool = False,
+                               throttle: Optional[Callable[[int], bool]] = None,
+                               store=None) -> int:
+    """
+    新しい順（order=time）に取得し、前回までの取得済み地点（watermark）より古いコメントに達したら止める差分取得。
+    - 行は chunk_size 件ごとに output(CSV) / store(store.CommentStore) へ追記（全件をメモリに溜めない）
+    - 追記のたびに nextPageToken を state に保存し、中断しても続きから再開できる
+    - include_replies: 返信のあるスレッドは comments().list で返信も全件取得（parent_id 付き）
+      ※ watermark はスレッドの投稿時刻で判定するため、古いスレッドへの新しい返信は拾わない
+    - throttle: API 呼び出しの直前に消費クォータ単位数を渡して呼ぶ。False なら中断（次回そこから再開）
+    - youtube: テスト用に差し替え可能（commentThreads().list / list_next を持つオブジェクト）
+    返却: 今回追記した行数
+    """
+    if output is None and store is None:
+        raise ValueError("output か store のどちらかを指定してください")
+    if state_path is None:
+        state_path = output + ".state.json" if output else os.path.join(store.root, "_state", f"{video_id}.json")
+        os.makedirs(os.path.dirname(os.path.abspath(state_path)), exist_ok=True)
+    state = _load_state(state_path)
+    if state.get("video_id") not in (None, video_id):
+        raise ValueError(f"state の video_id が一致しません: {state.get('video_id')} != {video_id}")
+    youtube = youtube or build("youtube", "v3", developerKey=API_KEY)
+
+    watermark = state.get("watermark", "")
+    watermark_ids = set(state.get("watermark_ids", []))
+    crawl_max = state.get("crawl_max", "")
+    crawl_max_ids = set(state.get("crawl_max_ids", []))
+
+    params = dict(part="snippet", videoId=video_id, maxResults=100, textFormat="plainText", order="time")
+    if state.get("page_token"):
+        params["pageToken"] = state["page_token"]  # 中断した位置から再開
+    req = youtube.commentThreads().list(**params)
+
+    def checkpoint(page_token: Optional[str]) -> None:
+        _save_state(state_path, {
+            "video_id": video_id,
+            "watermark": watermark,
+            "watermark_ids": sorted(watermark_ids),
+            "crawl_max": crawl_max,
+            "crawl_max_ids": sorted(crawl_max_ids),
+            "page_token": page_token,
+        })
+
+    def _flush(rows: List[Dict]) -> None:
+        if output:
+            _append_csv(rows, output)
+        if store is not None and rows:
+            store.append_raw(pd.DataFrame(rows))
+
+    buf: List[Dict] = []
+    written = 0
+    pages = 0
+    reached_watermark = False
+    page_token = state.get("page_token")  # いま取得しようとしているページのトークン
+    while req is not None and (max_pages is None or pages < max_pages):
+        if throttle is not None and not throttle(1):
+            break
+        res = req.execute()
+        page_rows: List[Dict] = []
+        aborted = False
+        for item in res.get("items", []):
+            row = _row(item, video_id)
+            ts = row["published_at"]
+            if watermark and ts < watermark:
+                reached_watermark = True
+                break
+            if watermark and ts == watermark and row["comment_id"] in watermark_ids:
+                continue  # 同じ時刻どうしの並びは決まっていないので、取得済みのものは止まらずに読み飛ばす
+            page_rows.append(row)
+            if include_replies and item["snippet"].get("totalReplyCount", 0) > 0:
+                replies = _fetch_replies(youtube, row["comment_id"], video_id, throttle)
+                if replies is None:
+                    aborted = True
+                    break
+                page_rows.extend(replies)
+        if aborted:
+            break  # このページは未処理のまま（次回 page_token から取り直す）
+
+        for row in page_rows:
+            if row["parent_id"]:
+                continue
+            ts = row["published_at"]
+            if ts > crawl_max:
+                crawl_max, crawl_max_ids = ts, {row["comment_id"]}
+            elif ts == crawl_max:
+                crawl_max_ids.add(row["comment_id"])
+        buf.extend(page_rows)
+        pages += 1
+        req = None if reached_watermark else youtube.commentThreads().list_next(req, res)
+        page_token = None if req is None else res.get("nextPageToken")
+
+        if len(buf) >= chunk_size or req is None:
+            _flush(buf)
+            written += len(buf)
+            buf = []
+            checkpoint(page_token)
+        if req is not None and sleep:
+            time.sleep(sleep)
+
+    if buf or req is not None:
+        _flush(buf)
+        written += len(buf)
+        checkpoint(page_token)
+
+    if req is None:
+        # 最後まで（または watermark まで）取り切ったら、今回の最新時刻を次回の watermark にする
+        if crawl_max > watermark:
+            watermark, watermark_ids = crawl_max, crawl_max_ids
+        elif crawl_max == watermark:
+            watermark_ids |= crawl_max_ids
+        crawl_max, crawl_max_ids = "", set()
+        checkpoint(None)
+    return written
+
+
 if __name__ == "__main__":
     if API_KEY is None:
         print("環境変数YOUTUBE_API_KEYが未設定です。", file=sys.stderr)
         sys.exit(1)
-    if len(sys.argv) < 2:
-        print("使い方: python ingest_youtube.py VIDEO_ID [OUTPUT_CSV]", file=sys.stderr)
-        sys.exit(1)
-    video_id = sys.argv[1]
-    output = sys.argv[2] if len(sys.argv) >= 3 else "comments_youtube.csv"
-    df = fetch_comments(video_id)
-    # Excelでも文字化けしにくいUTF-8 BOM付き
-    df.to_csv(output, index=False, encoding="utf-8-sig")
+    ap = argparse.ArgumentParser(usage="python ingest_youtube.py VIDEO_ID [OUTPUT_CSV] [--incremental]")
+    ap.add_argument("video_id")
+    ap.add_argument("output", nargs="?", default="comments_youtube.csv")
+    ap.add_argument("--incremental", action="store_true",
+                    help="新しい順に前回の続きだけ取得し、OUTPUT_CSV に追記する（中断しても再開可能）")
+    ap.add_argument("--state", default=None, help="チェックポイントの保存先（既定: OUTPUT_CSV.state.json）")
+    ap.add_argument("--max-pages", type=int, default=None)
+    ap.add_argument("--replies", action="store_true", help="--incremental 時に返信スレッドも展開して取得する")
+    ap.add_argument("--store", default=None, help="--incremental 時に Parquet ストア（ディレクトリ）にも追記する")
+    args = ap.parse_args()
+
+    if args.incremental:
+        store = None
+        if args.store:
+            from store import CommentStore
+            store = CommentStore(args.store)
+        n = fetch_comments_incremental(args.video_id, args.output, state_path=args.state,
+                                       max_pages=args.max_pages, include_replies=args.replies, store=store)
+        print(f"{n} 件を追記しました: {args.output}", file=sys.stderr)
+    else:
+        df = fetch_comments(args.video_id, max_pages=args.max_pages or 5)
+        # Excelでも文字化けしにくいUTF-8 BOM付き
+        df.to_csv(args.output, index=False, encoding="utf-8-sig")
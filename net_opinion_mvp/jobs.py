@@ -0,0 +1,445 @@
+"""
+コメントをシャード（数千件ずつ）に分けてローカルのジョブキュー（SQLite・WAL）に積み、
+複数のワーカープロセスで並行して判定する。
+使い方:
+  python jobs.py enqueue comments_*.csv dump.parquet --shard-rows 2000
+  python jobs.py work --processes 4          # 別のターミナル・別のジョブから何回起動してもよい
+  python jobs.py status                      # シャードの進み具合とワーカーごとのスループット
+  python jobs.py export --store store        # まだ書き出していない判定済みの行を Parquet ストアへ（-o out.csv で CSV）
+
+- ワーカーはシャードをリース（JOB_LEASE_SECONDS 秒）付きで取り、処理中は心拍でリースを延ばす
+- 結果はシャード単位で1トランザクションで書く。書く時点でリースを持っていなければ捨てる
+  （リースが切れて別のワーカーが取り直したシャードは、後から戻ってきた方の結果を書かない）
+  → どのコメントも判定結果はちょうど1回だけ書かれる
+- 心拍が途絶えた（プロセスが落ちた）ワーカーのシャードは、リースが切れたら他のワーカーが取り直す
+- 同じコメント（comment_id、無ければ source・投稿時刻・本文）を何度積んでも1件として扱う
+- 判定は analyze.enrich()（重複除去 → ローカル分類器 → GPT → 救済ロジック）。分類キャッシュはプロセス間で共有
+- キューは1台のローカルディスク上の SQLite ファイル（WAL はネットワークファイルシステムでは使えない）
+"""
+import os, time, uuid, socket, sqlite3, hashlib, logging, argparse, threading
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+JOBS_DB_PATH = os.environ.get(
+    "JOBS_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "jobs.sqlite"),
+)
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+
+logger = logging.getLogger(__name__)
+
+ITEM_COLUMNS = ["comment_id", "parent_id", "video_id", "source", "text", "likes", "published_at"]
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS shards ("
+    " id INTEGER PRIMARY KEY,"
+    " status TEXT NOT NULL DEFAULT 'pending',"  # pending / leased / done / failed
+    " n_items INTEGER NOT NULL,"
+    " worker TEXT,"
+    " lease_until REAL,"
+    " attempts INTEGER NOT NULL DEFAULT 0,"
+    " created REAL NOT NULL,"
+    " finished REAL,"
+    " error TEXT)",
+    "CREATE INDEX IF NOT EXISTS idx_shards_status ON shards(status, lease_until)",
+    "CREATE TABLE IF NOT EXISTS items ("
+    " key TEXT PRIMARY KEY,"
+    " shard_id INTEGER NOT NULL,"
+    " comment_id TEXT, parent_id TEXT, video_id TEXT, source TEXT, text TEXT NOT NULL,"
+    " likes INTEGER, published_at TEXT,"
+    " sentiment INTEGER, topic TEXT, heuristic_rule TEXT,"
+    " worker TEXT, labelled_at REAL, label_source TEXT,"
+    " exported_at REAL)",  # ストアに書き出した時刻（書き出しは1回だけ）
+    "CREATE INDEX IF NOT EXISTS idx_items_shard ON items(shard_id)",
+    "CREATE TABLE IF NOT EXISTS workers ("
+    " id TEXT PRIMARY KEY,"
+    " host TEXT, pid INTEGER,"
+    " started REAL NOT NULL,"
+    " heartbeat REAL NOT NULL,"
+    " stopped REAL,"
+    " shards_done INTEGER NOT NULL DEFAULT 0,"
+    " items_done INTEGER NOT NULL DEFAULT 0,"
+    " busy_sec REAL NOT NULL DEFAULT 0,"
+    " lost INTEGER NOT NULL DEFAULT 0,"    # リースを失って捨てたシャード数
+    " errors INTEGER NOT NULL DEFAULT 0)",
+]
+# 後から足した列（古いキューの DB には ALTER TABLE で足す）
+_ADDED_COLUMNS = [("items", "label_source", "TEXT"), ("items", "exported_at", "REAL")]
+
+
+def connect(path: str = JOBS_DB_PATH) -> sqlite3.Connection:
+    """キューの DB を開く（無ければ作る）。isolation_level=None で、トランザクションは明示的に張る"""
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=60000")
+    for stmt in _SCHEMA:
+        conn.execute(stmt)
+    for table, col, decl in _ADDED_COLUMNS:
+        if col not in {r[1] for r in conn.execute(f"PRAGMA table_info({table})")}:
+            try:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} {decl}")
+            except sqlite3.OperationalError as e:  # 別のプロセスが先に足した
+                if "duplicate column" not in str(e):
+                    raise
+    return conn
+
+
+class _Tx:
+    """BEGIN IMMEDIATE（書き込みロックを先に取る）〜 COMMIT / 例外なら ROLLBACK"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, *exc) -> None:
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def _str_col(df: pd.DataFrame, name: str) -> pd.Series:
+    if name not in df.columns:
+        return pd.Series("", index=df.index, dtype=object)
+    col = df[name]
+    return col.astype(object).where(col.notna(), "").astype(str)
+
+
+def item_keys(df: pd.DataFrame) -> pd.Series:
+    """コメントの同一性キー（comment_id、無ければ source・投稿時刻・本文のハッシュ）"""
+    cid = _str_col(df, "comment_id")
+    raw = _str_col(df, "source") + "\0" + _str_col(df, "published_at") + "\0" + _str_col(df, "text")
+    hashed = raw.map(lambda s: "h:" + hashlib.sha256(s.encode("utf-8")).hexdigest()[:32])
+    return ("c:" + cid).where(cid != "", hashed)
+
+
+# ---- 積む ----
+def enqueue(conn: sqlite3.Connection, df: pd.DataFrame, shard_rows: int = 2000) -> Tuple[int, int]:
+    """
+    df を shard_rows 件ずつのシャードにして積む。積み済みのコメントは飛ばす。
+    返却: (作ったシャード数, 積んだ件数)
+    """
+    if df is None or df.empty:
+        return 0, 0
+    df = df.reset_index(drop=True)
+    keys = item_keys(df)
+    cols = {c: _str_col(df, c) for c in ITEM_COLUMNS if c != "likes"}
+    likes = pd.to_numeric(df["likes"], errors="coerce").fillna(0).astype("int64") if "likes" in df.columns \
+        else pd.Series(0, index=df.index)
+    n_shards = n_items = 0
+    for start in range(0, len(df), shard_rows):
+        sl = slice(start, start + shard_rows)
+        with _Tx(conn):
+            cur = conn.execute("INSERT INTO shards (n_items, created) VALUES (0, ?)", (time.time(),))
+            shard_id = cur.lastrowid
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO items (key, shard_id, comment_id, parent_id, video_id, source, text,"
+                " likes, published_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                zip(keys[sl], [shard_id] * len(keys[sl]), cols["comment_id"][sl], cols["parent_id"][sl],
+                    cols["video_id"][sl], cols["source"][sl], cols["text"][sl], likes[sl].tolist(),
+                    cols["published_at"][sl]),
+            )
+            n = conn.total_changes - before
+            if n:
+                conn.execute("UPDATE shards SET n_items = ? WHERE id = ?", (n, shard_id))
+                n_shards += 1
+                n_items += n
+            else:
+                conn.execute("DELETE FROM shards WHERE id = ?", (shard_id,))
+    return n_shards, n_items
+
+
+# ---- ワーカー ----
+class Worker:
+    """シャードをリースして判定し、結果を書く。run() は取れるシャードが無くなるまで回る"""
+
+    def __init__(self, path: str = JOBS_DB_PATH, lease_seconds: float = JOB_LEASE_SECONDS,
+                 max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.conn = connect(path)
+        now = time.time()
+        self.conn.execute("INSERT INTO workers (id, host, pid, started, heartbeat) VALUES (?, ?, ?, ?, ?)",
+                          (self.id, socket.gethostname(), os.getpid(), now, now))
+
+    def claim(self) -> Optional[Tuple[int, int]]:
+        """待ちのシャード、またはリースの切れたシャードを1つ取る。返却: (shard_id, 試行回数) / 無ければ None"""
+        now = time.time()
+        with _Tx(self.conn) as c:
+            # 何度やっても落ちるシャードは failed にして取らない
+            c.execute("UPDATE shards SET status = 'failed', worker = NULL, lease_until = NULL,"
+                      " error = COALESCE(error, 'lease expired') WHERE status = 'leased' AND lease_until < ?"
+                      " AND attempts >= ?", (now, self.max_attempts))
+            row = c.execute("SELECT id, attempts FROM shards WHERE status = 'pending'"
+                            " OR (status = 'leased' AND lease_until < ?) ORDER BY id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            c.execute("UPDATE shards SET status = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1"
+                      " WHERE id = ?", (self.id, now + self.lease_seconds, row[0]))
+        return row[0], row[1] + 1
+
+    def _heartbeat(self, shard_id: int, stop: threading.Event) -> None:
+        """処理中はリースを延ばし続ける（別の接続で）"""
+        conn = connect(self.path)
+        try:
+            while not stop.wait(self.lease_seconds / 3):
+                now = time.time()
+                conn.execute("UPDATE shards SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'leased'",
+                             (now + self.lease_seconds, shard_id, self.id))
+                conn.execute("UPDATE workers SET heartbeat = ? WHERE id = ?", (now, self.id))
+        finally:
+            conn.close()
+
+    def load(self, shard_id: int) -> pd.DataFrame:
+        return pd.read_sql_query(
+            "SELECT key, " + ", ".join(ITEM_COLUMNS) + " FROM items WHERE shard_id = ? ORDER BY rowid",
+            self.conn, params=(shard_id,))
+
+    def commit(self, shard_id: int, dfx: pd.DataFrame, busy: float) -> bool:
+        """
+        判定結果を書いてシャードを done にする（1トランザクション）。
+        リースを失っていたら何も書かずに False（取り直したワーカーの結果が使われる）。
+        """
+        now = time.time()
+        rule = dfx["heuristic_rule"].astype(object).where(dfx["heuristic_rule"].notna(), None)
+        label_source = dfx["label_source"].astype(object).where(dfx["label_source"].notna(), None)
+        rows = zip(dfx["sentiment"].astype(int).tolist(), dfx["topic"].astype(str).tolist(), rule.tolist(),
+                   label_source.tolist(), [self.id] * len(dfx), [now] * len(dfx), dfx["key"].tolist())
+        with _Tx(self.conn) as c:
+            held = c.execute("UPDATE shards SET status = 'done', finished = ?, lease_until = NULL, error = NULL"
+                             " WHERE id = ? AND worker = ? AND status = 'leased'", (now, shard_id, self.id))
+            if held.rowcount == 0:
+                c.execute("UPDATE workers SET lost = lost + 1, heartbeat = ? WHERE id = ?", (now, self.id))
+                return False
+            c.executemany("UPDATE items SET sentiment = ?, topic = ?, heuristic_rule = ?, label_source = ?,"
+                          " worker = ?, labelled_at = ? WHERE key = ? AND sentiment IS NULL", rows)
+            c.execute("UPDATE workers SET shards_done = shards_done + 1, items_done = items_done + ?,"
+                      " busy_sec = busy_sec + ?, heartbeat = ? WHERE id = ?", (len(dfx), busy, now, self.id))
+        return True
+
+    def release(self, shard_id: int, attempts: int, error: str) -> None:
+        """失敗したシャードを待ちに戻す（試行回数を使い切っていれば failed）"""
+        status = "failed" if attempts >= self.max_attempts else "pending"
+        with _Tx(self.conn) as c:
+            c.execute("UPDATE shards SET status = ?, worker = NULL, lease_until = NULL, error = ?"
+                      " WHERE id = ? AND worker = ? AND status = 'leased'", (status, error[:500], shard_id, self.id))
+            c.execute("UPDATE workers SET errors = errors + 1, heartbeat = ? WHERE id = ?", (time.time(), self.id))
+
+    def process(self, shard_id: int, attempts: int) -> bool:
+        from analyze import enrich
+
+        stop = threading.Event()
+        beat = threading.Thread(target=self._heartbeat, args=(shard_id, stop), daemon=True)
+        beat.start()
+        t0 = time.perf_counter()
+        try:
+            df = self.load(shard_id)
+            dfx = enrich(df)
+        except Exception as e:
+            self.release(shard_id, attempts, f"{type(e).__name__}: {e}")
+            logger.warning("[%s] shard %d: %s: %s", self.id, shard_id, type(e).__name__, e, exc_info=True)
+            return False
+        finally:
+            stop.set()
+            beat.join()
+        busy = time.perf_counter() - t0
+        ok = self.commit(shard_id, dfx, busy)
+        logger.info("[%s] shard %d: %s 件 %.1f 秒%s", self.id, shard_id, f"{len(dfx):,}", busy,
+                    "" if ok else "（リースを失ったので破棄）")
+        return ok
+
+    def run(self, wait: bool = False, poll: float = 2.0, max_shards: Optional[int] = None) -> int:
+        """
+        シャードが無くなるまで処理する。他のワーカーが処理中のシャードが残っていれば、
+        リース切れで取り直せるかもしれないので待つ。wait=True なら新しく積まれるのを待ち続ける。
+        返却: 書いたシャード数
+        """
+        done = 0
+        try:
+            while max_shards is None or done < max_shards:
+                got = self.claim()
+                if got is None:
+                    self.conn.execute("UPDATE workers SET heartbeat = ? WHERE id = ?", (time.time(), self.id))
+                    active = self.conn.execute("SELECT COUNT(*) FROM shards WHERE status IN ('pending', 'leased')"
+                                               ).fetchone()[0]
+                    if not active and not wait:
+                        break
+                    time.sleep(poll)
+                    continue
+                done += self.process(*got)
+        finally:
+            self.conn.execute("UPDATE workers SET stopped = ?, heartbeat = ? WHERE id = ?",
+                              (time.time(), time.time(), self.id))
+            self.conn.close()
+        return done
+
+
+def _setup_logging(level: int) -> None:
+    logging.basicConfig(level=level, format="%(message)s")
+    logging.getLogger("httpx").setLevel(max(level, logging.WARNING))  # リクエストごとの行は出さない
+
+
+def _work_process(path: str, wait: bool, log_level: int) -> None:
+    _setup_logging(log_level)  # spawn した子プロセスはログの設定を引き継がない
+    Worker(path).run(wait=wait)
+
+
+def work(path: str = JOBS_DB_PATH, processes: int = 1, wait: bool = False) -> None:
+    """processes 個のワーカープロセスを起動して、全部終わるまで待つ"""
+    if processes <= 1:
+        Worker(path).run(wait=wait)
+        return
+    import multiprocessing as mp
+    ctx = mp.get_context("spawn")  # 親のスレッド・接続を引き継がない
+    procs = [ctx.Process(target=_work_process, args=(path, wait, logging.getLogger().level))
+             for _ in range(processes)]
+    for p in procs:
+        p.start()
+    try:
+        for p in procs:
+            p.join()
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()  # 処理中のシャードはリースが切れたら他のワーカーが取り直す
+        raise
+
+
+# ---- 状況 ----
+def status(conn: sqlite3.Connection, lease_seconds: float = JOB_LEASE_SECONDS) -> Dict:
+    """シャードの状態ごとの件数、全体のスループット、ワーカーごとの処理量"""
+    now = time.time()
+    shards = {s: {"shards": 0, "items": 0} for s in ("pending", "leased", "expired", "done", "failed")}
+    for st, expired, n, items in conn.execute(
+            "SELECT status, status = 'leased' AND lease_until < ?, COUNT(*), SUM(n_items) FROM shards"
+            " GROUP BY 1, 2", (now,)):
+        key = "expired" if expired else st
+        shards[key]["shards"] += n
+        shards[key]["items"] += items or 0
+    total = sum(v["items"] for v in shards.values())
+    labelled = shards["done"]["items"]
+    first, last = conn.execute("SELECT MIN(labelled_at), MAX(labelled_at) FROM items "
+                               "WHERE labelled_at IS NOT NULL").fetchone()
+    recent = conn.execute("SELECT COUNT(*) FROM items WHERE labelled_at >= ?", (now - 60,)).fetchone()[0]
+    rate = labelled / (last - first) if first and last and last > first else 0.0
+    workers = []
+    for (wid, started, beat, stopped, sd, items, busy, lost, errors, current) in conn.execute(
+            "SELECT w.id, w.started, w.heartbeat, w.stopped, w.shards_done, w.items_done, w.busy_sec, w.lost,"
+            " w.errors, (SELECT MIN(id) FROM shards WHERE worker = w.id AND status = 'leased')"
+            " FROM workers w ORDER BY w.started"):
+        state = "stopped" if stopped else ("dead" if now - beat > lease_seconds else "alive")
+        span = (stopped or beat) - started
+        workers.append({
+            "id": wid, "state": state, "shard": current, "shards_done": sd, "items_done": items,
+            "items_per_sec": items / span if span > 0 else 0.0,
+            "items_per_busy_sec": items / busy if busy else 0.0,
+            "lost": lost, "errors": errors, "heartbeat_age_sec": now - beat,
+        })
+    remaining = total - labelled - shards["failed"]["items"]
+    return {
+        "shards": shards, "items_total": total, "items_labelled": labelled,
+        "items_per_sec": rate, "items_last_minute": recent,
+        "eta_sec": remaining / (recent / 60) if recent else None,
+        "workers": workers,
+    }
+
+
+def print_status(st: Dict, all_workers: bool = False) -> None:
+    total, done = st["items_total"], st["items_labelled"]
+    print(f"判定済み {done:,} / {total:,} 件（{done / total * 100 if total else 0:.1f}%）"
+          f"  全体 {st['items_per_sec']:,.1f} 件/秒  直近1分 {st['items_last_minute']:,} 件"
+          + (f"  残り約 {st['eta_sec'] / 60:.1f} 分" if st["eta_sec"] else ""))
+    print("  ".join(f"{k} {v['shards']}（{v['items']:,} 件）" for k, v in st["shards"].items()))
+    rows = [w for w in st["workers"] if all_workers or w["state"] != "stopped" or w["items_done"]]
+    if rows:
+        print(f"{'worker':<36} {'state':<8} {'shard':>6} {'shards':>6} {'items':>9} {'件/秒':>8} "
+              f"{'件/処理秒':>9} {'lost':>4} {'err':>4} {'心拍':>6}")
+        for w in rows:
+            print(f"{w['id']:<36} {w['state']:<8} {w['shard'] or '-':>6} {w['shards_done']:>6} "
+                  f"{w['items_done']:>9,} {w['items_per_sec']:>8.1f} {w['items_per_busy_sec']:>9.1f} "
+                  f"{w['lost']:>4} {w['errors']:>4} {w['heartbeat_age_sec']:>5.0f}s")
+
+
+# ---- 書き出し ----
+def labelled_frame(conn: sqlite3.Connection, unexported: bool = False) -> pd.DataFrame:
+    """判定済みの行（enrich() と同じ列型 + key）。unexported=True ならストアにまだ書き出していない行だけ"""
+    from analyze import to_enriched_schema
+    df = pd.read_sql_query("SELECT key, " + ", ".join(ITEM_COLUMNS) + ", sentiment, topic, heuristic_rule, label_source"
+                           " FROM items WHERE sentiment IS NOT NULL"
+                           + (" AND exported_at IS NULL" if unexported else "") + " ORDER BY shard_id, rowid", conn)
+    return to_enriched_schema(df)
+
+
+def export_to_store(conn: sqlite3.Connection, store_root: str) -> int:
+    """
+    まだ書き出していない判定済みの行をストアに追記し、書き出し済みにする（何度実行しても二重に数えない）。
+    同じ comment_id の行がストアにあれば置き換える。返却: 書き出した件数
+    """
+    from store import CommentStore
+    dfx = labelled_frame(conn, unexported=True)
+    if dfx.empty:
+        return 0
+    CommentStore(store_root).upsert_enriched(dfx.drop(columns=["key"]))
+    now = time.time()
+    with _Tx(conn) as c:
+        c.executemany("UPDATE items SET exported_at = ? WHERE key = ?", [(now, k) for k in dfx["key"].tolist()])
+    return len(dfx)
+
+
+if __name__ == "__main__":
+    _setup_logging(logging.INFO)
+    ap = argparse.ArgumentParser(description="コメントのシャードをジョブキューに積み、複数プロセスで判定する")
+    ap.add_argument("--db", default=JOBS_DB_PATH, help="キューの SQLite ファイル（JOBS_DB_PATH）")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("enqueue", help="CSV / Parquet のコメントを積む（積み済みのコメントは飛ばす）")
+    p.add_argument("inputs", nargs="+")
+    p.add_argument("--shard-rows", type=int, default=2000, help="1シャードの件数")
+    p = sub.add_parser("work", help="ワーカーを起動する（シャードが無くなったら終わる）")
+    p.add_argument("--processes", type=int, default=1)
+    p.add_argument("--wait", action="store_true", help="シャードが無くなっても新しく積まれるのを待ち続ける")
+    p = sub.add_parser("status", help="進み具合とワーカーごとのスループット")
+    p.add_argument("--all", action="store_true", help="何もせずに止まったワーカーも表示する")
+    p.add_argument("--watch", type=float, default=0, help="N 秒ごとに表示し直す")
+    p = sub.add_parser("export", help="判定済みの行を書き出す")
+    p.add_argument("--store", default=None, help="Parquet ストアのルート（まだ書き出していない行だけ追記する）")
+    p.add_argument("-o", "--out", default=None, help="CSV に書く（判定済みの行すべて）")
+    args = ap.parse_args()
+
+    if args.cmd == "enqueue":
+        from batch import read_chunks
+        conn = connect(args.db)
+        for path in args.inputs:
+            shards = items = 0
+            for chunk in read_chunks(path, 50_000):
+                s, n = enqueue(conn, chunk, shard_rows=args.shard_rows)
+                shards, items = shards + s, items + n
+            logger.info("%s: %s 件 / %d シャードを積みました", path, f"{items:,}", shards)
+    elif args.cmd == "work":
+        work(args.db, processes=args.processes, wait=args.wait)
+    elif args.cmd == "status":
+        conn = connect(args.db)
+        while True:
+            print_status(status(conn), all_workers=args.all)
+            if not args.watch:
+                break
+            time.sleep(args.watch)
+            print()
+    elif args.cmd == "export":
+        if not args.store and not args.out:
+            ap.error("--store か -o を指定してください")
+        conn = connect(args.db)
+        if args.store:
+            n = export_to_store(conn, args.store)
+            logger.info("ストアに %s 件を書き出しました（書き出し済みの行は飛ばす）", f"{n:,}")
+        if args.out:
+            dfx = labelled_frame(conn).drop(columns=["key"])
+            dfx.to_csv(args.out, index=False)
+            logger.info("%s 件を %s に書き出しました", f"{len(dfx):,}", args.out)
@@ -0,0 +1,31 @@
+# locks.py — プロセス間の排他（ロックファイル）
+"""
+別プロセス・別インスタンスから同じファイルを読み書きする箇所（クォータの消費量・ストアの集計表）で使う。
+Unix は fcntl.flock、Windows は msvcrt.locking。
+"""
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def file_lock(path: str):
+    """プロセス間の排他（path のロックファイルを排他ロックする）"""
+    with open(path, "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
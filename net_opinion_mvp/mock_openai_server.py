@@ -0,0 +1,178 @@
+"""
+chat.completions 互換のローカル・スタブサーバ（API料金をかけずに並列化・レート制御を確認する用）。
+使い方:
+  python mock_openai_server.py --port 8089 --latency 0.5 --rate-limit-rate 0.1 --error-rate 0.02 --malformed-rate 0.05
+  export OPENAI_BASE_URL=http://127.0.0.1:8089/v1
+  export OPENAI_API_KEY=dummy
+  streamlit run app.py
+
+- ユーザープロンプトの "inputs" を読み、件数分の {"id", "sentiment", "topic"} を返す
+  （compact 形式のときは「id<TAB>本文」の行を読み、{"r": [[id, sentiment, topic番号], ...]} を返す）
+- --rate-limit-rate の確率で 429 + retry-after ヘッダを返す
+- --error-rate の確率で 500 を返す
+- --malformed-rate の確率で壊れた応答（途中で切れた JSON / 一部の id が欠けた結果）を返す
+"""
+import sys, json, time, random, argparse, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_TOPICS = ["政策", "人格", "外交", "経済", "国会運営", "党派支持", "メディア", "倫理", "その他"]
+
+
+class MockConfig:
+    def __init__(self, latency: float = 0.0, rate_limit_rate: float = 0.0, retry_after: float = 0.5,
+                 seed: int = 0, error_rate: float = 0.0, malformed_rate: float = 0.0):
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.malformed = 0
+
+    def counters(self) -> dict:
+        with self.lock:
+            return {"requests": self.requests, "rate_limited": self.rate_limited,
+                    "errors": self.errors, "malformed": self.malformed}
+
+    def roll(self, p: float) -> bool:
+        with self.lock:
+            return p > 0 and self.rng.random() < p
+
+
+def _fake_label(text: str) -> dict:
+    """テキストから決定的にラベルを作る（同じ入力なら同じ出力）"""
+    h = sum(ord(c) for c in text)
+    return {"sentiment": h % 3 - 1, "topic": _TOPICS[h % len(_TOPICS)]}
+
+
+def _malform(content: str, rng: random.Random) -> str:
+    """途中で切れた JSON か、結果の一部（id）が欠けた JSON にする"""
+    try:
+        key, results = next(iter(json.loads(content).items()))
+    except Exception:
+        return content[: len(content) // 2]
+    if len(results) > 1 and rng.random() < 0.5:
+        drop = set(rng.sample(range(len(results)), max(1, len(results) // 4)))
+        return json.dumps({key: [r for i, r in enumerate(results) if i not in drop]}, ensure_ascii=False,
+                          separators=(",", ":") if key == "r" else None)
+    return content[: max(len(content) // 2, 1)]
+
+
+def _answer(body: dict) -> str:
+    user = next((m.get("content", "") for m in body.get("messages", []) if m.get("role") == "user"), "")
+    system = next((m.get("content", "") for m in body.get("messages", []) if m.get("role") == "system"), "")
+    if "OUTPUT FORMAT (compact)" in system:
+        rows = []
+        for line in user.split("\n"):
+            i, _, text = line.partition("\t")
+            label = _fake_label(text)
+            rows.append([int(i), label["sentiment"], _TOPICS.index(label["topic"])])
+        return json.dumps({"r": rows}, separators=(",", ":"))
+    try:
+        payload = json.loads(user)
+    except Exception:
+        return "・（モック要約）" + user[:50]
+    results = []
+    for item in payload.get("inputs", []):
+        results.append({"id": item.get("id"), **_fake_label(str(item.get("text", "")))})
+    return json.dumps({"results": results}, ensure_ascii=False)
+
+
+def completion(body: dict, content: str) -> dict:
+    """chat.completion の応答本体（トークン数は文字数からの概算）"""
+    prompt_chars = sum(len(m.get("content") or "") for m in body.get("messages", []))
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_chars // 2,
+            "completion_tokens": len(content) // 2,
+            "total_tokens": prompt_chars // 2 + len(content) // 2,
+        },
+    }
+
+
+def make_handler(cfg: MockConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code: int, obj: dict, headers: dict = None):
+            data = json.dumps(obj, ensure_ascii=False).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", "0"))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            with cfg.lock:
+                cfg.requests += 1
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send(404, {"error": {"message": "not found"}})
+                return
+            if cfg.roll(cfg.rate_limit_rate):
+                with cfg.lock:
+                    cfg.rate_limited += 1
+                self._send(429, {"error": {"message": "rate limited", "type": "rate_limit_error"}},
+                           {"retry-after-ms": str(int(cfg.retry_after * 1000))})
+                return
+            if cfg.latency:
+                time.sleep(cfg.latency)
+            if cfg.roll(cfg.error_rate):
+                with cfg.lock:
+                    cfg.errors += 1
+                self._send(500, {"error": {"message": "mock server error", "type": "server_error"}})
+                return
+            content = _answer(body)
+            if content.startswith("{") and cfg.roll(cfg.malformed_rate):
+                with cfg.lock:
+                    cfg.malformed += 1
+                    content = _malform(content, cfg.rng)
+            self._send(200, completion(body, content))
+
+    return Handler
+
+
+def serve(port: int = 8089, cfg: MockConfig = None, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """バックグラウンドスレッドで起動してサーバを返す（停止は .shutdown()）"""
+    server = ThreadingHTTPServer((host, port), make_handler(cfg or MockConfig()))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="chat.completions 互換のモックサーバ")
+    ap.add_argument("--port", type=int, default=8089)
+    ap.add_argument("--latency", type=float, default=0.0, help="1リクエストあたりの遅延（秒）")
+    ap.add_argument("--rate-limit-rate", type=float, default=0.0, help="429 を返す確率")
+    ap.add_argument("--retry-after", type=float, default=0.5, help="429 時に返す待ち時間（秒）")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="500 を返す確率")
+    ap.add_argument("--malformed-rate", type=float, default=0.0, help="壊れた JSON を返す確率")
+    args = ap.parse_args()
+    server = serve(args.port, MockConfig(args.latency, args.rate_limit_rate, args.retry_after,
+                                         error_rate=args.error_rate, malformed_rate=args.malformed_rate))
+    print(f"mock server: http://127.0.0.1:{args.port}/v1", file=sys.stderr)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
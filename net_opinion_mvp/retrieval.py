@@ -0,0 +1,97 @@
+# retrieval.py — 文字起こしの区間検索（文字 bigram の BM25、外部サービスなし）
+"""
+文字起こしを数百文字の区間に分けて索引を作り、コメントのバッチごとに関係の深い区間だけを取り出す。
+文脈再判定で毎回同じ要約（または先頭 4000 文字）を添える代わりに使う。
+
+- 日本語は分かち書きせず、NFKC 正規化した文字 bigram を語として扱う
+- バッチのスコア = コメントごとの BM25 スコア（最大値で正規化）の合計
+  → 多くのコメントに関係する区間ほど上位になる
+"""
+import re, unicodedata
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+_WS_RE = re.compile(r"\s+")
+_SENTENCE_RE = re.compile(r"[^。！？!?\n]*(?:[。！？!?]+|\n+|$)")
+
+
+def _bigrams(text: str) -> List[str]:
+    t = _WS_RE.sub("", unicodedata.normalize("NFKC", text or "").lower())
+    if len(t) < 2:
+        return [t] if t else []
+    return [t[i:i + 2] for i in range(len(t) - 1)]
+
+
+def split_segments(text: str, max_chars: int = 400) -> List[str]:
+    """文の切れ目で max_chars 前後の区間に分ける（1文で超える場合は文字数で切る）"""
+    segs: List[str] = []
+    cur = ""
+    for sent in _SENTENCE_RE.findall(text or ""):
+        if not sent.strip():
+            continue
+        for i in range(0, len(sent), max_chars):
+            piece = sent[i:i + max_chars]
+            if cur and len(cur) + len(piece) > max_chars:
+                segs.append(cur.strip())
+                cur = ""
+            cur += piece
+    if cur.strip():
+        segs.append(cur.strip())
+    return segs
+
+
+class BM25Index:
+    """区間リストに対する BM25（Okapi）索引"""
+
+    def __init__(self, segments: Sequence[str], k1: float = 1.5, b: float = 0.75):
+        self.segments = list(segments)
+        n = len(self.segments)
+        lengths = np.zeros(n, dtype=np.float64)
+        tfs: Dict[str, Dict[int, int]] = {}
+        for j, seg in enumerate(self.segments):
+            grams = _bigrams(seg)
+            lengths[j] = len(grams)
+            for g in grams:
+                d = tfs.setdefault(g, {})
+                d[j] = d.get(j, 0) + 1
+        avgdl = float(lengths.mean()) if n else 0.0
+        norm = k1 * (1 - b + b * lengths / avgdl) if avgdl else np.full(n, k1)
+
+        # 語ごとに (区間位置, 重み) を前計算しておく（検索は足し込むだけ）
+        self._postings: Dict[str, tuple] = {}
+        for g, d in tfs.items():
+            idx = np.fromiter(d.keys(), dtype=np.int64, count=len(d))
+            tf = np.fromiter(d.values(), dtype=np.float64, count=len(d))
+            idf = np.log(1.0 + (n - len(d) + 0.5) / (len(d) + 0.5))
+            self._postings[g] = (idx, idf * tf * (k1 + 1) / (tf + norm[idx]))
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+    def scores(self, query: str) -> np.ndarray:
+        out = np.zeros(len(self.segments), dtype=np.float64)
+        for g in set(_bigrams(query)):
+            p = self._postings.get(g)
+            if p is not None:
+                np.add.at(out, p[0], p[1])
+        return out
+
+    def top_segments(self, queries: Sequence[str], k: int = 4) -> List[str]:
+        """
+        queries（1バッチ分のコメント）に関係の深い区間を最大 k 件、文字起こしの順で返す。
+        どのコメントにも関係しない区間は返さない。
+        """
+        if not self.segments or k <= 0:
+            return []
+        total = np.zeros(len(self.segments), dtype=np.float64)
+        for q in queries:
+            s = self.scores(q)
+            m = s.max() if len(s) else 0.0
+            if m > 0:
+                total += s / m
+        cand = np.flatnonzero(total > 0)
+        if not len(cand):
+            return []
+        top = cand[np.argsort(-total[cand], kind="stable")[:k]]
+        return [self.segments[j] for j in sorted(top)]
@@ -0,0 +1,212 @@
+# rolling.py — 直近 1時間 / 24時間 / 7日 のスライディングウィンドウ KPI（コメントを足すたびに差分更新）
+"""
+コメントを投稿時刻のバケット（ウィンドウ長 / n_buckets 秒）に足し込み、ウィンドウごとに
+直近のウィンドウ（current）と、その1つ前の同じ長さのウィンドウ（previous）の合計を持ち続ける。
+
+- add() は1件あたり O(ウィンドウ数)（フレームを走査し直さない）。時刻が進んだらバケットを
+  current → previous → 期限切れ の順に送り、合計から引く（送るバケット数はならして O(1)）
+- 集計する値は rollup.METRICS と同じで、KPI も rollup.kpi_from_sums()（いいね加重つき）で出す
+- 「いま」は今まで見た最新の投稿時刻（過去データでも直近の変化が見える）。kpis(now=...) で指定もできる
+  （読み出しは状態を変えない。時刻を進めるのは add() だけ）
+- ウィンドウの端はバケット単位（既定 60 分割なので 1h なら 1分、7d なら 2.8時間の粒度）
+
+  engine = RollingKPI()
+  engine.add_frame(dfx)                 # enrich() 済みのフレームをまとめて（列単位で）足す
+  engine.add(ts, sentiment=1, likes=3)  # 1件ずつ
+  engine.kpis("24h")  # {"n_comments", "pos_rate", ..., "weighted_pos_rate", ..., "previous": {...}, "start", "end"}
+"""
+import threading
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from rollup import METRICS, kpi_from_sums
+
+WINDOWS = {"1h": 3600, "24h": 86400, "7d": 7 * 86400}
+
+_M = len(METRICS)
+
+
+def _metric_rows(sentiment: np.ndarray, likes: np.ndarray) -> np.ndarray:
+    """1件ごとの METRICS の値（行 = コメント、列 = METRICS の順）"""
+    s = sentiment.astype(np.float64)
+    likes = likes.astype(np.float64)
+    pos, neg = (s > 0).astype(np.float64), (s < 0).astype(np.float64)
+    return np.column_stack([np.ones(len(s)), pos, neg, s, likes, likes * pos, likes * neg, likes * s])
+
+
+class _Window:
+    """1つのウィンドウ長のリングバッファ（2 × n_buckets 個のバケット = current + previous）"""
+
+    def __init__(self, seconds: int, n_buckets: int):
+        self.n = n_buckets
+        self.width = seconds / n_buckets
+        self.sums = np.zeros((2 * n_buckets, _M))
+        self.current = np.zeros(_M)
+        self.previous = np.zeros(_M)
+        self.head: Optional[int] = None  # 最新バケットの通し番号
+
+    def copy(self) -> "_Window":
+        w = _Window.__new__(_Window)
+        w.n, w.width, w.head = self.n, self.width, self.head
+        w.sums, w.current, w.previous = self.sums.copy(), self.current.copy(), self.previous.copy()
+        return w
+
+    def advance(self, head: int) -> None:
+        """最新バケットを head まで進める（current から外れるバケットは previous へ、previous から外れるものは捨てる）"""
+        if self.head is None:
+            self.head = head
+            return
+        steps = head - self.head
+        if steps <= 0:
+            return
+        if steps >= 2 * self.n:
+            self.sums[:] = 0.0
+            self.current[:] = 0.0
+            self.previous[:] = 0.0
+        else:
+            for b in range(self.head + 1, head + 1):
+                gone = self.sums[b % (2 * self.n)]       # 2n 前のバケット（previous の一番古いもの）
+                self.previous -= gone
+                gone[:] = 0.0
+                moved = self.sums[(b - self.n) % (2 * self.n)]  # current から previous へ移るバケット
+                self.current -= moved
+                self.previous += moved
+        self.head = head
+
+    def add(self, bucket: int, row: np.ndarray) -> None:
+        if self.head is None or bucket > self.head:
+            self.advance(bucket)
+        age = self.head - bucket
+        if age >= 2 * self.n:
+            return  # previous より古い
+        self.sums[bucket % (2 * self.n)] += row
+        if age < self.n:
+            self.current += row
+        else:
+            self.previous += row
+
+    def merge(self, other: "_Window") -> None:
+        """同じ設定のウィンドウの合計を足し込む（バケット数に比例、コメント数によらない）"""
+        if other.head is None:
+            return
+        self.advance(other.head)
+        other = other.copy()
+        other.advance(self.head)
+        self.sums += other.sums
+        self.current += other.current
+        self.previous += other.previous
+
+    def add_many(self, buckets: np.ndarray, rows: np.ndarray) -> None:
+        """add() を列単位で（バケット番号ごとに np.add.at でまとめて足す）"""
+        self.advance(int(buckets.max()))
+        age = self.head - buckets
+        keep = age < 2 * self.n
+        buckets, rows, age = buckets[keep], rows[keep], age[keep]
+        np.add.at(self.sums, buckets % (2 * self.n), rows)
+        cur = age < self.n
+        self.current += rows[cur].sum(axis=0)
+        self.previous += rows[~cur].sum(axis=0)
+
+
+class RollingKPI:
+    """直近ウィンドウの KPI をコメントの追加ごとに差分更新するエンジン（スレッドセーフ）"""
+
+    def __init__(self, windows: Optional[Dict[str, int]] = None, n_buckets: int = 60):
+        self.windows = dict(windows or WINDOWS)
+        self._w = {name: _Window(sec, n_buckets) for name, sec in self.windows.items()}
+        self._latest: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_frame(cls, dfx: pd.DataFrame, **kwargs) -> "RollingKPI":
+        engine = cls(**kwargs)
+        engine.add_frame(dfx)
+        return engine
+
+    def copy(self) -> "RollingKPI":
+        with self._lock:
+            other = RollingKPI.__new__(RollingKPI)
+            other.windows = dict(self.windows)
+            other._w = {k: w.copy() for k, w in self._w.items()}
+            other._latest = self._latest
+            other._lock = threading.Lock()
+            return other
+
+    def merge(self, other: "RollingKPI") -> "RollingKPI":
+        """other（同じ windows・n_buckets）の集計を足し込んで self を返す"""
+        with self._lock:
+            for name, w in self._w.items():
+                w.merge(other._w[name])
+            if other._latest is not None:
+                self._latest = other._latest if self._latest is None else max(self._latest, other._latest)
+        return self
+
+    @property
+    def latest(self) -> Optional[float]:
+        """今まで見た最新の投稿時刻（UNIX 秒）"""
+        return self._latest
+
+    def add(self, ts: float, sentiment: int, likes: float = 0.0, sign: int = 1) -> None:
+        """
+        1件足す（ts は UNIX 秒）。sign=-1 で引く（再判定で上書きした行の旧い値を取り消す用。
+        引く行は足したときと同じ ts・sentiment・likes で渡す）。
+        """
+        s, l = float(np.sign(sentiment)), float(likes)
+        pos, neg = float(s > 0), float(s < 0)
+        row = sign * np.array([1.0, pos, neg, s, l, l * pos, l * neg, l * s])
+        with self._lock:
+            for w in self._w.values():
+                w.add(int(ts // w.width), row)
+            if sign > 0 and (self._latest is None or ts > self._latest):
+                self._latest = float(ts)
+
+    def add_frame(self, dfx: pd.DataFrame, sign: int = 1) -> int:
+        """
+        enrich() 済みのフレーム（published_at, sentiment, likes）をまとめて足す。投稿時刻が読めない行は飛ばす。
+        返却: 足した件数
+        """
+        if dfx is None or dfx.empty:
+            return 0
+        ts = pd.to_datetime(dfx["published_at"], errors="coerce", utc=True)
+        ok = ts.notna().to_numpy()
+        if not ok.any():
+            return 0
+        secs = ((ts[ok] - pd.Timestamp(0, tz="UTC")) / pd.Timedelta(seconds=1)).to_numpy(dtype=np.float64)
+        s = pd.to_numeric(dfx["sentiment"], errors="coerce").fillna(0).to_numpy()[ok]
+        likes = (pd.to_numeric(dfx["likes"], errors="coerce").fillna(0).to_numpy()[ok]
+                 if "likes" in dfx.columns else np.zeros(len(secs)))
+        rows = sign * _metric_rows(np.sign(s), likes)
+        with self._lock:
+            for w in self._w.values():
+                w.add_many(np.floor(secs / w.width).astype(np.int64), rows)
+            if sign > 0:
+                m = float(secs.max())
+                self._latest = m if self._latest is None else max(self._latest, m)
+        return int(len(secs))
+
+    def kpis(self, window: str, now: Optional[float] = None) -> Dict:
+        """
+        直近 window の KPI（rollup.kpi_from_sums() と同じキー）と、その1つ前の同じ長さの KPI（"previous"）。
+        now（UNIX 秒）を省略すると今まで見た最新の投稿時刻。"start" / "end" はウィンドウの範囲（UNIX 秒）。
+        読むだけで状態は変えない（now を先に進めて見ても、後から足す now より前のコメントは集計される）。
+        """
+        with self._lock:
+            w = self._w[window]
+            if w.head is None:
+                empty = kpi_from_sums({})
+                return dict(empty, previous=dict(empty), start=None, end=None)
+            if now is not None and int(now // w.width) > w.head:
+                w = w.copy()  # 元のウィンドウのバケットは送らない
+                w.advance(int(now // w.width))
+            cur, prev = w.current.copy(), w.previous.copy()
+            end = (w.head + 1) * w.width
+        out = kpi_from_sums(dict(zip(METRICS, cur)))
+        out["previous"] = kpi_from_sums(dict(zip(METRICS, prev)))
+        out["start"], out["end"] = end - self.windows[window], end
+        return out
+
+    def snapshot(self, now: Optional[float] = None) -> Dict[str, Dict]:
+        """全ウィンドウの kpis()"""
+        return {name: self.kpis(name, now) for name in self.windows}
@@ -0,0 +1,130 @@
+# rollup.py — 日付 × トピック × ソースの集計表（ダッシュボードの KPI・グラフ用）
+"""
+判定済みコメントを (日付, トピック, ソース) ごとに事前集計しておき、
+KPI・グラフは集計表だけから計算する（コメント数ではなく日数 × トピック数 × ソース数に比例）。
+
+- 新しい行が来たら build() した差分を merge() で足し込む
+- 再判定で上書きした行は、旧行の集計を引いて新行の集計を足す（apply_delta）
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+KEYS = ["date", "topic", "source"]
+METRICS = [
+    "n",                # 件数
+    "n_pos",            # sentiment > 0 の件数
+    "n_neg",            # sentiment < 0 の件数
+    "sentiment_sum",    # sentiment の合計
+    "likes_sum",        # いいね数の合計
+    "likes_pos",        # ポジ行のいいね数の合計
+    "likes_neg",        # ネガ行のいいね数の合計
+    "likes_sentiment",  # sentiment × いいね数 の合計
+]
+UNKNOWN_DATE = "unknown"
+
+
+def _date_keys(col: pd.Series) -> pd.Series:
+    dt = pd.to_datetime(col, errors="coerce")
+    return dt.dt.strftime("%Y-%m-%d").fillna(UNKNOWN_DATE)
+
+
+def empty(keys: List[str] = KEYS) -> pd.DataFrame:
+    return pd.DataFrame({**{k: pd.Series(dtype=object) for k in keys},
+                         **{m: pd.Series(dtype="float64") for m in METRICS}})
+
+
+def build(dfx: pd.DataFrame, keys: List[str] = KEYS) -> pd.DataFrame:
+    """enrich() 済みの行から集計表を作る（列: keys + METRICS）"""
+    if dfx is None or dfx.empty:
+        return empty(keys)
+    s = pd.to_numeric(dfx["sentiment"], errors="coerce").fillna(0.0).to_numpy(dtype=np.float64)
+    likes = (pd.to_numeric(dfx["likes"], errors="coerce").fillna(0).to_numpy(dtype=np.float64)
+             if "likes" in dfx.columns else np.zeros(len(dfx)))
+    pos, neg = s > 0, s < 0
+    frame = {}
+    for k in keys:
+        if k == "date":
+            src = dfx["date"] if "date" in dfx.columns else dfx.get("published_at")
+            frame[k] = _date_keys(src).to_numpy() if src is not None else UNKNOWN_DATE
+        else:
+            frame[k] = (dfx[k].astype(object).where(dfx[k].notna(), "").astype(str).to_numpy()
+                        if k in dfx.columns else "")
+    frame.update(
+        n=np.ones(len(dfx)), n_pos=pos.astype(np.float64), n_neg=neg.astype(np.float64),
+        sentiment_sum=s, likes_sum=likes, likes_pos=likes * pos, likes_neg=likes * neg,
+        likes_sentiment=likes * s,
+    )
+    return pd.DataFrame(frame).groupby(keys, as_index=False, sort=False)[METRICS].sum()
+
+
+def merge(*parts: pd.DataFrame, keys: Optional[List[str]] = None) -> pd.DataFrame:
+    """集計表を足し合わせる（件数 0 になったグループは落とす）"""
+    parts = [p for p in parts if p is not None and not p.empty]
+    if not parts:
+        return empty(keys or KEYS)
+    keys = keys or [c for c in parts[0].columns if c not in METRICS]
+    out = pd.concat(parts, ignore_index=True).groupby(keys, as_index=False, sort=False)[METRICS].sum()
+    return out[out["n"] > 0].reset_index(drop=True)
+
+
+def apply_delta(roll: pd.DataFrame, removed: Optional[pd.DataFrame], added: Optional[pd.DataFrame],
+                keys: List[str] = KEYS) -> pd.DataFrame:
+    """removed の行を引き、added の行を足す（再判定で上書きした行の反映用）"""
+    neg = build(removed, keys) if removed is not None else None
+    if neg is not None:
+        neg[METRICS] = -neg[METRICS]
+    return merge(roll, neg, build(added, keys) if added is not None else None, keys=keys)
+
+
+# ---- 集計表からの KPI・グラフ用データ ----
+def kpi_from_sums(sums: Dict[str, float]) -> Dict[str, float]:
+    """
+    METRICS の合計から KPI を出す。weighted_* はいいね加重（1件の重み = 1 + いいね数）。
+    """
+    n = float(sums.get("n", 0.0))
+    if n < 0.5:  # 差分更新で足し引きした合計は 0 ちょうどにならないことがある
+        return {"n_comments": 0, "pos_rate": 0.0, "neg_rate": 0.0, "avg_sentiment": 0.0,
+                "weighted_pos_rate": 0.0, "weighted_neg_rate": 0.0, "weighted_avg_sentiment": 0.0}
+    w = n + sums["likes_sum"]
+    return {
+        "n_comments": int(round(n)),
+        "pos_rate": float(sums["n_pos"] / n),
+        "neg_rate": float(sums["n_neg"] / n),
+        "avg_sentiment": float(sums["sentiment_sum"] / n),
+        "weighted_pos_rate": float((sums["n_pos"] + sums["likes_pos"]) / w),
+        "weighted_neg_rate": float((sums["n_neg"] + sums["likes_neg"]) / w),
+        "weighted_avg_sentiment": float((sums["sentiment_sum"] + sums["likes_sentiment"]) / w),
+    }
+
+
+def kpi(roll: pd.DataFrame) -> Dict[str, float]:
+    if roll is None or not len(roll):
+        return kpi_from_sums({})
+    return kpi_from_sums(roll[METRICS].sum().to_dict())
+
+
+def daily(roll: pd.DataFrame) -> pd.DataFrame:
+    """日付ごとの件数・平均センチメント（日付不明の行は除く）"""
+    d = roll[roll["date"] != UNKNOWN_DATE].groupby("date", as_index=False)[["n", "sentiment_sum"]].sum()
+    return pd.DataFrame({
+        "date": pd.to_datetime(d["date"]).dt.date,
+        "count": d["n"].astype(int),
+        "sentiment": d["sentiment_sum"] / d["n"],
+    })
+
+
+def by_topic(roll: pd.DataFrame) -> pd.DataFrame:
+    t = roll.groupby("topic", as_index=False)["n"].sum().sort_values("n", ascending=False)
+    return pd.DataFrame({"topic": t["topic"], "count": t["n"].astype(int)}).reset_index(drop=True)
+
+
+def by_source(roll: pd.DataFrame) -> pd.DataFrame:
+    g = roll.groupby("source", as_index=False)[["n", "n_pos", "n_neg"]].sum()
+    return pd.DataFrame({
+        "source": g["source"],
+        "pos_rate": g["n_pos"] / g["n"],
+        "neg_rate": g["n_neg"] / g["n"],
+        "n": g["n"].astype(int),
+    })
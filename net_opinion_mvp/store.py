@@ -0,0 +1,232 @@
+# store.py — コメント・判定結果の列指向ストア（Parquet データセット）
+"""
+CSV の読み書きの代わりに、生コメントと判定結果を Parquet で保存する。
+
+  <root>/raw/video_id=<ID>/date=<YYYY-MM-DD>/part-*.parquet       … 取得したコメント
+  <root>/enriched/video_id=<ID>/date=<YYYY-MM-DD>/part-*.parquet  … enrich() 済みの判定結果
+  <root>/rollup/enriched.parquet                                   … 判定結果の 動画×日付×トピック×ソース 集計
+
+- 書き込みは追記のみ（毎回ユニークなファイル名で足していく）
+- source / topic は辞書エンコード
+- 読み込みはパーティション（動画・日付）で絞り込み、メモリマップで必要なファイルだけ読む
+- 同じ comment_id が複数回書かれていれば、後から書いた方を採用する
+- 集計表は append_enriched() のたびに差分だけ更新する（KPI・グラフは集計表から計算）。
+  読んで足して書き戻すので、<root>/rollup/.lock のファイルロックで別プロセス・別インスタンスの書き込みと排他する
+"""
+import os, uuid, time, threading
+from contextlib import contextmanager
+from typing import List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+
+import rollup
+from locks import file_lock
+
+_DICT = pa.dictionary(pa.int32(), pa.string())
+
+RAW_SCHEMA = pa.schema([
+    ("comment_id", pa.string()),
+    ("parent_id", pa.string()),
+    ("source", _DICT),
+    ("text", pa.string()),
+    ("likes", pa.int64()),
+    ("published_at", pa.string()),
+    ("video_id", pa.string()),
+    ("date", pa.string()),
+    ("written_at", pa.float64()),
+])
+
+ENRICHED_SCHEMA = pa.schema(list(RAW_SCHEMA) + [
+    ("sentiment", pa.int8()),
+    ("topic", _DICT),
+    ("heuristic_rule", pa.string()),
+    ("label_source", _DICT),   # analyze.LABEL_SOURCES（この列より前に書いた行は空）
+])
+
+_PARTITIONING = ds.partitioning(pa.schema([("video_id", pa.string()), ("date", pa.string())]), flavor="hive")
+_UNKNOWN_VIDEO = "_unknown"
+ROLLUP_KEYS = ["video_id"] + rollup.KEYS
+
+
+def to_table(df: pd.DataFrame, schema: pa.Schema) -> pa.Table:
+    """DataFrame を保存用スキーマに揃える（足りない列は空で補う）"""
+    out = pd.DataFrame(index=df.index)
+    for field in schema:
+        name = field.name
+        if name == "date":
+            dt = pd.to_datetime(df.get("published_at"), errors="coerce", utc=True)
+            out[name] = dt.dt.strftime("%Y-%m-%d").fillna("unknown")
+        elif name == "written_at":
+            out[name] = time.time()
+        elif name in df.columns:
+            col = df[name]
+            if name == "video_id":
+                col = col.fillna(_UNKNOWN_VIDEO).astype(str).replace("", _UNKNOWN_VIDEO)
+            elif name in ("likes",):
+                col = pd.to_numeric(col, errors="coerce").fillna(0).astype("int64")
+            elif name == "sentiment":
+                col = pd.to_numeric(col, errors="coerce").fillna(0).astype("int8")
+            else:
+                col = col.astype(object).where(col.notna(), "").astype(str)
+            out[name] = col
+        elif name == "video_id":
+            out[name] = _UNKNOWN_VIDEO
+        elif name == "likes":
+            out[name] = 0
+        else:
+            out[name] = ""
+    return pa.Table.from_pandas(out, schema=schema, preserve_index=False)
+
+
+def _build_filter(video_ids: Optional[List[str]], start: Optional[str], end: Optional[str]):
+    expr = None
+    if video_ids:
+        expr = ds.field("video_id").isin(list(video_ids))
+    if start:
+        e = ds.field("date") >= str(start)
+        expr = e if expr is None else expr & e
+    if end:
+        e = ds.field("date") <= str(end)
+        expr = e if expr is None else expr & e
+    return expr
+
+
+class CommentStore:
+    def __init__(self, root: str):
+        self.root = root
+        self.raw_dir = os.path.join(root, "raw")
+        self.enriched_dir = os.path.join(root, "enriched")
+        self.rollup_path = os.path.join(root, "rollup", "enriched.parquet")
+        self._fs = pafs.LocalFileSystem(use_mmap=True)
+        self._rollup_lock = threading.Lock()
+
+    @contextmanager
+    def _rollup_locked(self):
+        """集計表の読み書きの排他（スレッド間 + プロセス間）"""
+        os.makedirs(os.path.dirname(self.rollup_path), exist_ok=True)
+        with self._rollup_lock, file_lock(os.path.join(os.path.dirname(self.rollup_path), ".lock")):
+            yield
+
+    # ---- 書き込み（追記のみ） ----
+    def _append(self, df: pd.DataFrame, base_dir: str, schema: pa.Schema) -> Optional[pa.Table]:
+        if df is None or df.empty:
+            return None
+        table = to_table(df, schema)
+        ds.write_dataset(
+            table, base_dir, format="parquet", partitioning=_PARTITIONING,
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+        return table
+
+    def append_raw(self, df: pd.DataFrame) -> int:
+        """取得したコメントを追記する（columns: text, source, likes, published_at, comment_id, video_id …）"""
+        table = self._append(df, self.raw_dir, RAW_SCHEMA)
+        return table.num_rows if table is not None else 0
+
+    def append_enriched(self, dfx: pd.DataFrame, replaces: Optional[pd.DataFrame] = None) -> int:
+        """
+        enrich() / refine_with_transcript() 済みの行を追記し、集計表を更新する。
+        既存の行を上書きする場合は、上書き前の行を replaces に渡す（集計表から差し引く）。
+        """
+        if dfx is None or dfx.empty:
+            return 0
+        with self._rollup_locked():
+            return self._append_enriched(dfx, replaces)
+
+    def _append_enriched(self, dfx: pd.DataFrame, replaces: Optional[pd.DataFrame]) -> int:
+        old = to_table(replaces, ENRICHED_SCHEMA).to_pandas() if replaces is not None and len(replaces) else None
+        roll = self._load_rollup()  # 追記前に読む（集計表が無ければ追記前の判定結果から作る）
+        table = self._append(dfx, self.enriched_dir, ENRICHED_SCHEMA)
+        self._save_rollup(rollup.apply_delta(roll, old, table.to_pandas(), keys=ROLLUP_KEYS))
+        return table.num_rows
+
+    def upsert_enriched(self, dfx: pd.DataFrame) -> int:
+        """
+        append_enriched() の、同じ comment_id の行が既にあれば置き換える版（旧い行は集計表から差し引く）。
+        comment_id の無い行はそのまま追記する。
+        """
+        if dfx is None or dfx.empty:
+            return 0
+        with self._rollup_locked():  # 置き換える行を読むところから排他する（同じ行を二重に差し引かない）
+            old = None
+            if "comment_id" in dfx.columns:
+                ids = set(dfx["comment_id"].dropna().astype(str)) - {""}
+                if ids:
+                    done = self.read_enriched()
+                    old = done[done["comment_id"].isin(ids)] if len(done) else None
+            return self._append_enriched(dfx, old)
+
+    # ---- 集計表 ----
+    def _load_rollup(self) -> pd.DataFrame:
+        if os.path.exists(self.rollup_path):
+            return pd.read_parquet(self.rollup_path)
+        # 集計表が無い（以前のバージョンで作ったストア）→ 判定結果から作り直して保存
+        roll = rollup.build(self.read_enriched(), keys=ROLLUP_KEYS)
+        if os.path.isdir(self.enriched_dir):
+            self._save_rollup(roll)
+        return roll
+
+    def _save_rollup(self, roll: pd.DataFrame) -> None:
+        os.makedirs(os.path.dirname(self.rollup_path), exist_ok=True)
+        tmp = self.rollup_path + ".tmp"
+        roll.to_parquet(tmp, index=False)
+        os.replace(tmp, self.rollup_path)
+
+    def read_rollup(self, video_ids: Optional[List[str]] = None, start: Optional[str] = None,
+                    end: Optional[str] = None) -> pd.DataFrame:
+        """
+        read_enriched() と同じ条件で絞り込んだ 日付×トピック×ソース の集計表（rollup.KEYS + rollup.METRICS）
+        """
+        with self._rollup_locked():
+            roll = self._load_rollup()
+        if video_ids:
+            roll = roll[roll["video_id"].isin(list(video_ids))]
+        if start:
+            roll = roll[roll["date"] >= str(start)]
+        if end:
+            roll = roll[roll["date"] <= str(end)]
+        return rollup.merge(roll[rollup.KEYS + rollup.METRICS], keys=rollup.KEYS)
+
+    def rebuild_rollup(self) -> None:
+        """判定結果を全件読み直して集計表を作り直す"""
+        with self._rollup_locked():
+            self._save_rollup(rollup.build(self.read_enriched(), keys=ROLLUP_KEYS))
+
+    # ---- 読み込み（パーティションで絞り込み） ----
+    def _read(self, base_dir: str, schema: pa.Schema, video_ids, start, end, columns) -> pd.DataFrame:
+        if not os.path.isdir(base_dir):
+            return pd.DataFrame(columns=columns or schema.names)
+        dataset = ds.dataset(base_dir, schema=schema, format="parquet",
+                             partitioning=_PARTITIONING, filesystem=self._fs)
+        cols = None
+        if columns:
+            cols = list(dict.fromkeys(list(columns) + ["comment_id", "written_at"]))
+        table = dataset.to_table(columns=cols, filter=_build_filter(video_ids, start, end))
+        df = table.to_pandas()
+        # 同じコメントが複数回書かれていれば後勝ち（comment_id が無い行はそのまま）
+        if len(df) and "comment_id" in df.columns:
+            df = df.sort_values("written_at", kind="stable")
+            has_id = df["comment_id"] != ""
+            df = pd.concat([df[has_id].drop_duplicates("comment_id", keep="last"), df[~has_id]])
+            df = df.sort_index()
+        if columns:
+            df = df[list(columns)]
+        return df.reset_index(drop=True)
+
+    def read_raw(self, video_ids: Optional[List[str]] = None, start: Optional[str] = None,
+                 end: Optional[str] = None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        return self._read(self.raw_dir, RAW_SCHEMA, video_ids, start, end, columns)
+
+    def read_enriched(self, video_ids: Optional[List[str]] = None, start: Optional[str] = None,
+                      end: Optional[str] = None, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        return self._read(self.enriched_dir, ENRICHED_SCHEMA, video_ids, start, end, columns)
+
+    def list_videos(self) -> List[str]:
+        """raw に保存済みの動画ID（ディレクトリ名から取るのでデータは読まない）"""
+        if not os.path.isdir(self.raw_dir):
+            return []
+        return sorted(d.split("=", 1)[1] for d in os.listdir(self.raw_dir) if d.startswith("video_id="))
@@ -0,0 +1,212 @@
+# telemetry.py — API 呼び出しごとの計測（JSONL ログ・Prometheus 形式・ダッシュボード用の集計）
+"""
+API 呼び出し1回ごとに次を記録する。
+  kind（classify / refine / summarize）, model, batch_size, prompt/completion/cached トークン,
+  latency_ms, attempts（429 再送を含む試行回数）, status（ok / error）, parse_path（json / regex / failed）
+
+- TELEMETRY_LOG（既定 .cache/telemetry.jsonl、空文字で無効）に1行1レコードで追記（サイズでローテーション）
+- TELEMETRY_PROM_PORT を指定すると http://127.0.0.1:<port>/metrics で Prometheus テキスト形式を返す
+- snapshot() / diff() / summarize() でダッシュボードの性能パネル用に集計する
+"""
+import os, json, time, threading, logging
+from logging.handlers import RotatingFileHandler
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+TELEMETRY_LOG = os.environ.get(
+    "TELEMETRY_LOG",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "telemetry.jsonl"),
+)
+TELEMETRY_LOG_MAX_BYTES = int(os.environ.get("TELEMETRY_LOG_MAX_BYTES", str(10 * 2 ** 20)))
+TELEMETRY_LOG_BACKUPS = int(os.environ.get("TELEMETRY_LOG_BACKUPS", "5"))
+TELEMETRY_PROM_PORT = int(os.environ.get("TELEMETRY_PROM_PORT", "0"))
+
+# 料金（USD / 100万トークン。既定は gpt-4o-mini）
+PRICE_INPUT_PER_1M = float(os.environ.get("OPENAI_PRICE_INPUT_PER_1M", "0.15"))
+PRICE_CACHED_INPUT_PER_1M = float(os.environ.get("OPENAI_PRICE_CACHED_INPUT_PER_1M", "0.075"))
+PRICE_OUTPUT_PER_1M = float(os.environ.get("OPENAI_PRICE_OUTPUT_PER_1M", "0.60"))
+
+LATENCY_BUCKETS = (0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+_COUNTERS = ("calls", "errors", "items", "prompt_tokens", "completion_tokens", "cached_tokens",
+             "attempts", "parse_json", "parse_regex", "parse_failed", "latency_sum")
+
+_lock = threading.Lock()
+_totals: Dict[str, Dict[str, float]] = {}          # kind → カウンタ
+_buckets: Dict[str, list] = {}                     # kind → レイテンシのヒストグラム
+_first_ts: Optional[float] = None
+_last_ts: Optional[float] = None
+_file_logger: Optional[logging.Logger] = None
+_prom_server: Optional[ThreadingHTTPServer] = None
+_prom_tried = False
+
+
+def _get_file_logger() -> Optional[logging.Logger]:
+    global _file_logger
+    if not TELEMETRY_LOG:
+        return None
+    if _file_logger is None:
+        os.makedirs(os.path.dirname(os.path.abspath(TELEMETRY_LOG)), exist_ok=True)
+        lg = logging.getLogger("net_opinion_mvp.telemetry")
+        lg.setLevel(logging.INFO)
+        lg.propagate = False
+        if not lg.handlers:
+            h = RotatingFileHandler(TELEMETRY_LOG, maxBytes=TELEMETRY_LOG_MAX_BYTES,
+                                    backupCount=TELEMETRY_LOG_BACKUPS, encoding="utf-8")
+            h.setFormatter(logging.Formatter("%(message)s"))
+            lg.addHandler(h)
+        _file_logger = lg
+    return _file_logger
+
+
+def record(rec: Dict) -> None:
+    """1呼び出し分のレコードを集計に足し、JSONL に書く"""
+    global _first_ts, _last_ts
+    rec.setdefault("ts", time.time())
+    kind = rec.get("kind", "classify")
+    latency = float(rec.get("latency_ms") or 0.0) / 1000.0
+    with _lock:
+        t = _totals.setdefault(kind, dict.fromkeys(_COUNTERS, 0.0))
+        t["calls"] += 1
+        t["errors"] += rec.get("status") != "ok"
+        if rec.get("status") == "ok":  # 分類できた件数（分割・再送で送り直した分は数えない）
+            t["items"] += rec.get("n_parsed", rec.get("batch_size") or 0)
+        for k in ("prompt_tokens", "completion_tokens", "cached_tokens", "attempts"):
+            t[k] += rec.get(k) or 0
+        path = rec.get("parse_path")
+        if path in ("json", "regex", "failed"):
+            t["parse_" + path] += 1
+        t["latency_sum"] += latency
+        b = _buckets.setdefault(kind, [0] * (len(LATENCY_BUCKETS) + 1))
+        b[next((i for i, ub in enumerate(LATENCY_BUCKETS) if latency <= ub), len(LATENCY_BUCKETS))] += 1
+        start = rec["ts"] - latency
+        _first_ts = start if _first_ts is None else min(_first_ts, start)
+        _last_ts = rec["ts"] if _last_ts is None else max(_last_ts, rec["ts"])
+    lg = _get_file_logger()
+    if lg is not None:
+        lg.info(json.dumps(rec, ensure_ascii=False))
+    if TELEMETRY_PROM_PORT:
+        serve_prometheus(TELEMETRY_PROM_PORT)
+
+
+# ---- 集計 ----
+def snapshot() -> Dict:
+    """現在までの累計（kind ごとのカウンタ + 最初/最後の呼び出し時刻）"""
+    with _lock:
+        return {"totals": {k: dict(v) for k, v in _totals.items()}, "first_ts": _first_ts, "last_ts": _last_ts}
+
+
+def diff(now: Dict, before: Optional[Dict]) -> Dict:
+    """before（セッション開始時の snapshot）以降の分"""
+    if not before:
+        return now
+    totals = {}
+    for kind, t in now["totals"].items():
+        b = before["totals"].get(kind, {})
+        totals[kind] = {k: v - b.get(k, 0.0) for k, v in t.items()}
+    first = now["first_ts"] if before["last_ts"] is None else max(now["first_ts"] or 0, before["last_ts"])
+    return {"totals": totals, "first_ts": first, "last_ts": now["last_ts"]}
+
+
+def summarize(snap: Dict) -> Dict[str, float]:
+    """
+    性能パネル用の指標。
+    cost_per_1k_comments は分類（classify / refine）1000件あたりの USD（要約の呼び出し分も含めて按分）。
+    """
+    s = dict.fromkeys(_COUNTERS, 0.0)
+    for t in snap["totals"].values():
+        for k in _COUNTERS:
+            s[k] += t.get(k, 0.0)
+    comments = sum(t.get("items", 0.0) for kind, t in snap["totals"].items() if kind != "summarize")
+    cost = ((s["prompt_tokens"] - s["cached_tokens"]) * PRICE_INPUT_PER_1M
+            + s["cached_tokens"] * PRICE_CACHED_INPUT_PER_1M
+            + s["completion_tokens"] * PRICE_OUTPUT_PER_1M) / 1e6
+    span = (snap["last_ts"] - snap["first_ts"]) if snap["first_ts"] and snap["last_ts"] else 0.0
+    calls = s["calls"]
+    parsed = s["parse_json"] + s["parse_regex"] + s["parse_failed"]
+    return {
+        "calls": int(calls),
+        "comments": int(comments),
+        "cost_usd": cost,
+        "cost_per_1k_comments": cost / comments * 1000 if comments else 0.0,
+        "comments_per_sec": comments / span if span > 0 else 0.0,
+        "avg_latency_ms": s["latency_sum"] / calls * 1000 if calls else 0.0,
+        "error_rate": s["errors"] / calls if calls else 0.0,
+        "retry_rate": (s["attempts"] - calls) / calls if calls else 0.0,
+        "regex_fallback_rate": s["parse_regex"] / parsed if parsed else 0.0,
+        "parse_failure_rate": s["parse_failed"] / parsed if parsed else 0.0,
+    }
+
+
+# ---- Prometheus テキスト形式 ----
+def prometheus_text() -> str:
+    snap = snapshot()
+    with _lock:
+        buckets = {k: list(v) for k, v in _buckets.items()}
+    lines = []
+
+    def metric(name: str, help_: str, typ: str, samples):
+        lines.append(f"# HELP {name} {help_}")
+        lines.append(f"# TYPE {name} {typ}")
+        for labels, value in samples:
+            lab = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}{{{lab}}} {value:g}")
+
+    totals = snap["totals"]
+    metric("net_opinion_api_calls_total", "API calls", "counter",
+           [({"kind": k, "status": "ok"}, t["calls"] - t["errors"]) for k, t in totals.items()]
+           + [({"kind": k, "status": "error"}, t["errors"]) for k, t in totals.items()])
+    metric("net_opinion_api_items_total", "Comments labelled by successful calls", "counter",
+           [({"kind": k}, t["items"]) for k, t in totals.items()])
+    metric("net_opinion_api_tokens_total", "Tokens reported by the API", "counter",
+           [({"kind": k, "type": typ}, t[f"{typ}_tokens"]) for k, t in totals.items()
+            for typ in ("prompt", "completion", "cached")])
+    metric("net_opinion_api_attempts_total", "HTTP attempts including 429 retries", "counter",
+           [({"kind": k}, t["attempts"]) for k, t in totals.items()])
+    metric("net_opinion_api_parse_total", "Response parse outcomes", "counter",
+           [({"kind": k, "path": p}, t["parse_" + p]) for k, t in totals.items()
+            for p in ("json", "regex", "failed")])
+    lines.append("# HELP net_opinion_api_latency_seconds API call latency")
+    lines.append("# TYPE net_opinion_api_latency_seconds histogram")
+    for k, b in buckets.items():
+        acc = 0
+        for ub, c in zip(list(LATENCY_BUCKETS) + ["+Inf"], b):
+            acc += c
+            lines.append(f'net_opinion_api_latency_seconds_bucket{{kind="{k}",le="{ub}"}} {acc}')
+        lines.append(f'net_opinion_api_latency_seconds_sum{{kind="{k}"}} {totals[k]["latency_sum"]:g}')
+        lines.append(f'net_opinion_api_latency_seconds_count{{kind="{k}"}} {acc}')
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        data = prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def serve_prometheus(port: int, host: str = "127.0.0.1") -> Optional[ThreadingHTTPServer]:
+    """/metrics を返すサーバをバックグラウンドで起動する（プロセスで1回だけ。ポート使用中なら None）"""
+    global _prom_server, _prom_tried
+    with _lock:
+        if _prom_server is None:
+            if _prom_tried:
+                return None
+            _prom_tried = True
+            try:
+                _prom_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            except OSError:
+                logging.getLogger(__name__).warning("Prometheus エンドポイントを起動できません（port=%d）", port)
+                return None
+            _prom_server.daemon_threads = True
+            threading.Thread(target=_prom_server.serve_forever, daemon=True).start()
+        return _prom_server
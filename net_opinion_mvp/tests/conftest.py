@@ -0,0 +1,24 @@
+"""
+テスト共通の設定。analyze などは import 時に環境変数を読むので、ここで先に決めておく
+（キャッシュなどのファイルは使わず、API はモックサーバに向ける）。
+"""
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.update(OPENAI_API_KEY="dummy", OFFLINE="0", CLASSIFY_CACHE_PATH="", DISTILL_MODEL_PATH="",
+                  TELEMETRY_LOG="", WIRE_FORMAT="json")
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def mock_api():
+    """chat.completions 互換のモックサーバを立てて analyze の接続先にする"""
+    import analyze
+    from mock_openai_server import MockConfig, serve
+    server = serve(0, MockConfig())
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    analyze._client = None
+    yield server
+    server.shutdown()
+    analyze._client = None
@@ -0,0 +1,217 @@
+"""bulk.py（バッチ API 形式のバックフィル）のテスト。応答はモックサーバと同じものを fake_service で書く"""
+import json, os
+
+import pandas as pd
+import pytest
+
+import analyze
+import bulk
+import rollup
+from store import CommentStore
+
+SUBJECTS = ["主人公", "司会", "ゲスト", "解説", "音楽", "編集", "字幕", "カメラ"]
+TONES = ["が最高でした", "はいまいち", "について質問です", "がよかった！", "、次回も期待"]
+
+
+def _rows(n: int = 60) -> pd.DataFrame:
+    texts = [f"{SUBJECTS[i % len(SUBJECTS)]}{TONES[i % len(TONES)]}{i % 23}" for i in range(n)]
+    texts[5] = texts[3]  # 完全一致の重複
+    return pd.DataFrame({
+        "comment_id": [f"c{i:03d}" for i in range(n)], "video_id": ["v1"] * n, "text": texts,
+        "source": "youtube", "likes": range(n),
+        "published_at": pd.date_range("2024-03-01", periods=n, freq="h").strftime("%Y-%m-%dT%H:%M:%SZ"),
+    })
+
+
+@pytest.fixture
+def small_batches(monkeypatch):
+    monkeypatch.setattr(analyze, "BATCH_MAX_ITEMS", 8)
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(analyze, "CACHE_PATH", str(tmp_path / "classify.sqlite3"))
+    monkeypatch.setattr(analyze, "_cache", None)
+    yield analyze.get_cache()
+    monkeypatch.setattr(analyze, "_cache", None)
+
+
+@pytest.fixture
+def job_input(tmp_path):
+    df = _rows()
+    path = str(tmp_path / "comments.csv")
+    df.to_csv(path, index=False)
+    return df, path
+
+
+def _drive(job, root, max_steps: int = 20, **faults) -> None:
+    """送信 → fake_service が処理 → 取り込み を判定が終わるまで繰り返す"""
+    svc = bulk.DirectoryBatchService(root)
+    for seed in range(max_steps):
+        bulk.run(job, svc)
+        if job.stage in ("done", "merged"):
+            return
+        bulk.fake_service(root, seed=seed, **faults)
+    raise AssertionError(f"{max_steps} 回で終わりませんでした: {job.summary()}")
+
+
+def _request_files(job, rnd: int):
+    return sorted(n for n, f in job.state["files"].items() if f["round"] == rnd)
+
+
+def test_prepare_writes_round_with_stable_custom_ids(tmp_path, job_input, small_batches):
+    _, path = job_input
+    job = bulk.prepare([path], str(tmp_path / "job"))
+    names = _request_files(job, 0)
+    assert names and job.stage == "classify"
+    ids = {}
+    for name in names:
+        ids.update(bulk._read_json(os.path.join(job.dir, "requests", name + ".ids.json")))
+        for req in bulk._read_jsonl(os.path.join(job.dir, "requests", name)):
+            assert req["method"] == "POST" and req["url"] == bulk.BULK_ENDPOINT
+            members = ids[req["custom_id"]]
+            assert req["body"] == analyze._classify_request([job.texts("classify")[i] for i in members],
+                                                             job.config["model"], job.config["wire"])
+    # 代表テキストはちょうど1回ずつリクエストに入る（重複は1件にまとまる）
+    members = sorted(i for b in ids.values() for i in b)
+    assert members == list(range(len(job.texts("classify")))) and len(members) == len(_rows()) - 1
+
+    again = bulk.prepare([path], str(tmp_path / "job2"))
+    ids2 = {}
+    for name in _request_files(again, 0):
+        ids2.update(bulk._read_json(os.path.join(again.dir, "requests", name + ".ids.json")))
+    assert ids2 == ids
+    with pytest.raises(ValueError):
+        bulk.prepare([path], str(tmp_path / "job"))
+
+
+def test_import_results_and_retry_missing_rows(tmp_path, job_input, small_batches):
+    from mock_openai_server import _fake_label
+    _, path = job_input
+    root = str(tmp_path / "svc")
+    job = bulk.prepare([path], str(tmp_path / "job"))
+    svc = bulk.DirectoryBatchService(root)
+    job.step(svc)
+    bulk.fake_service(root, drop_rate=0.3, malformed_rate=0.3, error_rate=0.1, seed=1)
+    job.step(svc)
+
+    labels = job.labels("classify")
+    n = len(job.texts("classify"))
+    assert 0 < len(labels) < n
+    assert all(r["source"] == "gpt" for r in labels.values())
+    texts = job.texts("classify")
+    for i, r in labels.items():  # 取れたラベルはモックの応答どおり
+        assert {"sentiment": r["sentiment"], "topic": r["topic"]} == _fake_label(texts[i])
+    # 次のラウンドには取れなかった代表だけが入る
+    retry = {}
+    for name in _request_files(job, 1):
+        assert job.state["files"][name]["status"] == "submitted"
+        retry.update(bulk._read_json(os.path.join(job.dir, "requests", name + ".ids.json")))
+    assert sorted(i for b in retry.values() for i in b) == sorted(set(range(n)) - set(labels))
+
+    _drive(job, root)
+    assert len(job.labels("classify")) == n
+
+
+def test_unreadable_batch_is_split_in_next_round(tmp_path, job_input, small_batches):
+    from mock_openai_server import _answer, completion
+    _, path = job_input
+    job = bulk.prepare([path], str(tmp_path / "job"))
+    name = _request_files(job, 0)[0]
+    reqs = bulk._read_jsonl(os.path.join(job.dir, "requests", name))
+    out = []
+    for k, req in enumerate(reqs):
+        content = "読めない応答" if k == 0 else _answer(req["body"])
+        out.append({"id": f"r{k}", "custom_id": req["custom_id"], "error": None,
+                    "response": {"status_code": 200, "body": completion(req["body"], content)}})
+    res = str(tmp_path / "results.jsonl")
+    bulk._write_jsonl(res, out)
+    stats = job.import_results([res], name)
+    assert stats["failed"] == 1 and stats["ok"] == len(reqs) - 1
+
+    ids = bulk._read_json(os.path.join(job.dir, "requests", name + ".ids.json"))
+    stuck = ids[reqs[0]["custom_id"]]
+    job.advance()
+    retry = {}
+    for n in _request_files(job, 1):
+        retry.update(bulk._read_json(os.path.join(job.dir, "requests", n + ".ids.json")))
+    assert sorted(retry.values()) == sorted([stuck[:len(stuck) // 2], stuck[len(stuck) // 2:]])
+    # 同じ結果ファイルをもう一度取り込んでも何も増えない
+    assert job.import_results([res])["items"] == 0
+
+
+def test_fallback_labels_stay_out_of_cache(tmp_path, job_input, small_batches, cache, monkeypatch):
+    monkeypatch.setattr(bulk, "BULK_MAX_ROUNDS", 2)
+    df, path = job_input
+    root = str(tmp_path / "svc")
+    job = bulk.prepare([path], str(tmp_path / "job"))
+    _drive(job, root, drop_rate=1.0)
+
+    dfx = job.enriched()
+    assert (dfx["label_source"] == "fallback").all()
+    assert (dfx["sentiment"] == 0).all() and (dfx["topic"] == "その他").all()
+    ctx = job._cache_context("classify")
+    assert cache.get_many(job.texts("classify"), job.config["model"], ctx) == {}
+
+    # 次のジョブではまた送り、取れたラベルだけがキャッシュに入る
+    job2 = bulk.prepare([path], str(tmp_path / "job2"))
+    assert sum(f["requests"] for f in job2.state["files"].values()) == sum(
+        f["requests"] for n, f in job.state["files"].items() if f["round"] == 0)
+    _drive(job2, root)
+    assert (job2.enriched()["label_source"] == "gpt").all()
+    hits = cache.get_many(job2.texts("classify"), job2.config["model"], ctx)
+    assert len(hits) == len(job2.texts("classify"))
+    assert not any(analyze._is_fallback(r) for r in hits.values())
+
+    # 3回目はキャッシュで全部そろうのでリクエストを書かない
+    job3 = bulk.prepare([path], str(tmp_path / "job3"))
+    assert job3.stage == "done" and not job3.state["files"]
+    assert (job3.enriched()["label_source"] == "gpt").all()
+
+
+def test_merged_back_in_original_order_like_sync_enrich(tmp_path, job_input, mock_api):
+    df, path = job_input
+    transcript = "今日は主人公の成長と音楽の演出について話します。字幕とカメラワークにもこだわりました。"
+    root = str(tmp_path / "svc")
+    job = bulk.prepare([path], str(tmp_path / "job"), transcript=transcript)
+    _drive(job, root, malformed_rate=0.2, drop_rate=0.1)
+
+    dfx = job.enriched()
+    assert dfx["comment_id"].tolist() == df["comment_id"].tolist()
+    assert dfx["text"].tolist() == df["text"].tolist()
+    want = analyze.refine_with_transcript(analyze.enrich(df), transcript)
+    assert dfx["sentiment"].tolist() == want["sentiment"].tolist()
+    assert dfx["topic"].astype(str).tolist() == want["topic"].astype(str).tolist()
+    assert job.state["stage"] == "done" and os.path.exists(os.path.join(job.dir, "refine.texts.json"))
+    assert set(dfx["label_source"].astype(str)) <= set(analyze.LABEL_SOURCES)
+
+
+def _sorted_rollup(store) -> pd.DataFrame:
+    roll = store.read_rollup()
+    roll = roll.astype({c: str for c in roll.columns if isinstance(roll[c].dtype, pd.CategoricalDtype)})
+    return roll.sort_values(rollup.KEYS).reset_index(drop=True)
+
+
+def test_merge_replaces_rows_once(tmp_path, job_input):
+    df, path = job_input
+    store_root = str(tmp_path / "store")
+    store = CommentStore(store_root)
+    old = df.iloc[:10].copy()
+    old["text"] = "古い判定"
+    store.append_enriched(analyze._apply_labels(old, [analyze._fallback_label()] * len(old)))
+
+    root = str(tmp_path / "svc")
+    job = bulk.prepare([path], str(tmp_path / "job"))
+    _drive(job, root)
+    assert job.merge(store_root) == len(df)
+
+    got = store.read_enriched().sort_values("comment_id").reset_index(drop=True)
+    assert got["comment_id"].tolist() == df["comment_id"].tolist()
+    assert got["text"].tolist() == df["text"].tolist()
+    roll = _sorted_rollup(store)
+    store.rebuild_rollup()
+    pd.testing.assert_frame_equal(roll, _sorted_rollup(store))
+
+    with pytest.raises(ValueError):
+        job.merge(store_root)
+    assert len(store.read_enriched()) == len(df)
@@ -0,0 +1,48 @@
+"""cache.py（分類結果キャッシュ）のテスト"""
+import time
+
+from cache import ClassificationCache
+
+
+def _label(i: int):
+    return {"sentiment": i % 3 - 1, "topic": "政策"}
+
+
+def _counts(cache: ClassificationCache):
+    seen = []
+    cache._conn.set_trace_callback(lambda sql: seen.append(sql) if "COUNT(*)" in sql else None)
+    return seen
+
+
+def test_evicts_least_recently_used_over_limit(tmp_path):
+    cache = ClassificationCache(str(tmp_path / "c.sqlite3"), "v1", max_entries=10)
+    texts = [f"コメント{i}" for i in range(10)]
+    cache.put_many(texts, [_label(i) for i in range(10)], "m")
+    time.sleep(0.01)
+    cache.get_many(texts[:3], "m")  # 最近使った 3 件は残る
+    cache.put_many(["新しい1", "新しい2", "新しい3"], [_label(0)] * 3, "m")
+    assert cache.size() == 10
+    got = cache.get_many(texts + ["新しい1", "新しい2", "新しい3"], "m")
+    assert sorted(got) == [0, 1, 2, 6, 7, 8, 9, 10, 11, 12]
+
+
+def test_counts_periodically_not_on_every_put(tmp_path):
+    cache = ClassificationCache(str(tmp_path / "c.sqlite3"), "v1", max_entries=100)
+    seen = _counts(cache)
+    for i in range(4):
+        cache.put_many([f"a{i}"], [_label(0)], "m")
+    assert seen == []  # 上限の 1/20（5件）を書くまでは数えない
+    cache.put_many(["a4"], [_label(0)], "m")
+    assert len(seen) == 1
+    cache.put_many([f"b{j}" for j in range(4)], [_label(j) for j in range(4)], "m")
+    assert len(seen) == 1
+
+
+def test_estimate_picks_up_rows_from_other_writers(tmp_path):
+    path = str(tmp_path / "c.sqlite3")
+    a = ClassificationCache(path, "v1", max_entries=50)
+    b = ClassificationCache(path, "v1", max_entries=50)
+    a.put_many([f"a{j}" for j in range(40)], [_label(j) for j in range(40)], "m")
+    b.put_many([f"b{j}" for j in range(40)], [_label(j) for j in range(40)], "m")
+    # b の概算（開いた時点の 0 件 + 40）は上限未満でも、1/20 ごとの数え直しで a の分を拾って消す
+    assert a.size() <= 50 + 50 // 20
@@ -0,0 +1,129 @@
+"""crawler の優先度つき割り当て（クォータ不足時は伸びの遅い動画を後回し）と、コメント数取得の失敗のテスト"""
+import pytest
+
+from crawler import QuotaScheduler, VideoStats, allocate_pages, crawl
+
+
+class _Request:
+    def __init__(self, yt: "FakeYouTube", video_id: str, offset: int):
+        self.yt, self.video_id, self.offset = yt, video_id, offset
+
+    def execute(self):
+        self.yt.calls.append((self.video_id, self.offset))
+        rows = self.yt.videos_[self.video_id]
+        page = rows[self.offset:self.offset + self.yt.page_size]
+        res = {"items": [{"id": c["id"], "snippet": {
+            "totalReplyCount": 0,
+            "topLevelComment": {"id": c["id"], "snippet": {
+                "textDisplay": c["id"], "likeCount": 0, "publishedAt": c["ts"]}}}} for c in page]}
+        if self.offset + self.yt.page_size < len(rows):
+            res["nextPageToken"] = f"{self.video_id}:{self.offset + self.yt.page_size}"
+        return res
+
+
+class _Threads:
+    def __init__(self, yt):
+        self.yt = yt
+
+    def list(self, videoId, pageToken=None, **params):
+        return _Request(self.yt, videoId, int(pageToken.split(":")[1]) if pageToken else 0)
+
+    def list_next(self, req, res):
+        token = res.get("nextPageToken")
+        return _Request(self.yt, req.video_id, int(token.split(":")[1])) if token else None
+
+
+class _Videos:
+    def __init__(self, yt):
+        self.yt = yt
+
+    def list(self, part, id):
+        yt = self.yt
+
+        class _Stats:
+            def execute(self):
+                if yt.stats_error is not None:
+                    raise yt.stats_error
+                return {"items": [{"id": v, "statistics": {"commentCount": str(len(yt.videos_[v]))},
+                                   "snippet": {"publishedAt": yt.published[v]}} for v in id.split(",")]}
+        return _Stats()
+
+
+class FakeYouTube:
+    """videos().list（コメント数・公開日時）と commentThreads() を持つ偽クライアント（動画ごと、page_size 件ずつ）"""
+
+    def __init__(self, videos, published, page_size: int = 100):
+        self.videos_ = {v: sorted(rows, key=lambda c: c["ts"], reverse=True) for v, rows in videos.items()}
+        self.published = published
+        self.page_size = page_size
+        self.calls = []
+        self.stats_error = None
+
+    def videos(self):
+        return _Videos(self)
+
+    def commentThreads(self):
+        return _Threads(self)
+
+    def pages(self, video_id: str) -> int:
+        return sum(1 for v, _ in self.calls if v == video_id)
+
+
+def _comments(video_id: str, n: int):
+    return [{"id": f"{video_id}-{i}", "ts": f"2024-03-01T00:{i // 60:02d}:{i % 60:02d}Z"} for i in range(n)]
+
+
+@pytest.fixture
+def yt():
+    # 公開からの平均ペース: fast（最近公開）> mid > slow
+    return FakeYouTube(
+        {"slow": _comments("slow", 150), "fast": _comments("fast", 150), "mid": _comments("mid", 150)},
+        {"slow": "2020-01-01T00:00:00Z", "mid": "2023-01-01T00:00:00Z", "fast": "2024-03-01T00:00:00Z"},
+    )
+
+
+def test_first_round_is_ordered_by_average_pace_since_publishing():
+    stats = VideoStats()
+    now = 1_000_000.0
+    stats.update("old", 100, now, published_at=now - 100 * 3600)
+    stats.update("new", 100, now, published_at=now - 2 * 3600)
+    stats.update("unknown", 100, now)
+    assert stats.priority(["old", "new", "unknown"]) == ["unknown", "new", "old"]
+    stats.update("old", 400, now + 3600)  # 2回目以降は実測の伸び
+    assert stats.priority(["old", "new"]) == ["old", "new"]
+
+
+def test_allocate_pages_grants_in_priority_order_until_budget_runs_out():
+    stats = VideoStats()
+    for v, count in (("a", 250), ("b", 50), ("c", 50)):
+        stats.update(v, count, 0.0)
+    assert allocate_pages(["a", "b", "c"], stats, budget=4) == {"a": 3, "b": 1}
+    assert allocate_pages(["a", "b", "c"], stats, budget=4, max_pages=1) == {"a": 1, "b": 1, "c": 1}
+    stats.add_fetched("a", 200)
+    assert allocate_pages(["a", "b", "c"], stats, budget=4) == {"a": 1, "b": 1, "c": 1}
+
+
+def test_allocate_pages_splits_budget_evenly_without_counts():
+    assert allocate_pages(["a", "b", "c"], VideoStats(), budget=7) == {"a": 2, "b": 2, "c": 3}
+
+
+def test_short_quota_defers_the_slowest_videos(tmp_path, yt):
+    # videos.list に 1 unit、残り 4 units = fast 2ページ + mid 2ページ
+    scheduler = QuotaScheduler(daily_budget=5, burst=5)
+    deferred = []
+    written = crawl(["slow", "mid", "fast"], str(tmp_path), workers=3, scheduler=scheduler,
+                    youtube_factory=lambda: yt, deferred=deferred)
+    assert written == {"fast": 150, "mid": 150}
+    assert deferred == ["slow"]
+    assert (yt.pages("fast"), yt.pages("mid"), yt.pages("slow")) == (2, 2, 0)
+    assert scheduler.remaining == 0
+
+
+def test_stats_failure_does_not_abort_the_crawl(tmp_path, yt):
+    yt.stats_error = ConnectionError("接続が切れました")
+    errors = {}
+    written = crawl(["slow", "mid", "fast"], str(tmp_path), workers=2,
+                    scheduler=QuotaScheduler(daily_budget=100, burst=100),
+                    youtube_factory=lambda: yt, errors=errors)
+    assert written == {"slow": 150, "mid": 150, "fast": 150}
+    assert errors == {}
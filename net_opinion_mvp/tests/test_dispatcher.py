@@ -0,0 +1,152 @@
+"""dispatcher.py と analyze の GPT 呼び出し（並列・レート制御・429 の再送・id での突き合わせ・分割再送）のテスト。API はモックサーバ"""
+import json, threading, time
+
+import pytest
+
+import analyze
+from dispatcher import RateLimiter, dispatch, retry_after_seconds
+from mock_openai_server import MockConfig, _fake_label, serve
+
+TEXTS = [f"コメント{i}：{'よかった' if i % 3 else 'いまいち'}{i * 7}" for i in range(23)]
+
+
+class _Resp:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class _Err(Exception):
+    def __init__(self, headers):
+        super().__init__("rate limited")
+        self.response = _Resp(headers)
+
+
+def _labels(out):
+    return [{"sentiment": r["sentiment"], "topic": r["topic"]} for r in out]
+
+
+@pytest.fixture
+def rate_limited_api(monkeypatch):
+    """半分くらいの確率で 429 + retry-after-ms を返すモックサーバ"""
+    cfg = MockConfig(rate_limit_rate=0.5, retry_after=0.05, seed=3)
+    server = serve(0, cfg)
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}/v1")
+    monkeypatch.setattr(analyze, "_client", None)
+    yield cfg
+    server.shutdown()
+
+
+def test_dispatch_keeps_input_order_and_runs_in_parallel():
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def work(x):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02 * (5 - x % 5))  # 後の要素ほど早く終わる
+        with lock:
+            running[0] -= 1
+        return x * 10
+
+    assert dispatch(work, list(range(12)), concurrency=4) == [x * 10 for x in range(12)]
+    assert 1 < peak[0] <= 4
+
+
+def test_dispatch_raises_worker_error():
+    def work(x):
+        if x == 3:
+            raise ValueError("boom")
+        return x
+
+    with pytest.raises(ValueError):
+        dispatch(work, list(range(6)), concurrency=3)
+
+
+@pytest.mark.parametrize("headers, want", [
+    ({"retry-after-ms": "250"}, 0.25),
+    ({"retry-after": "2"}, 2.0),
+    ({"x-ratelimit-reset-requests": "1m30s"}, 90.0),
+    ({"x-ratelimit-reset-tokens": "20ms"}, 0.02),
+    ({}, 7.0),
+])
+def test_retry_after_seconds(headers, want):
+    assert retry_after_seconds(_Err(headers), default=7.0) == pytest.approx(want)
+
+
+def test_rate_limiter_waits_for_refill():
+    limiter = RateLimiter(rpm=600)  # 1秒に10個
+    limiter.requests.tokens = 0
+    t0 = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - t0 >= 0.08
+    limiter.penalize(0.3)  # 429 の後は 0.3 秒ぶん補充が追いつかない
+    t0 = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - t0 >= 0.35
+
+
+def test_429_is_retried_after_server_delay(rate_limited_api, monkeypatch):
+    waits = []
+    penalize = analyze._limiter.penalize
+    monkeypatch.setattr(analyze._limiter, "penalize", lambda s: (waits.append(s), penalize(s)))
+
+    out = analyze._classify_with_gpt(TEXTS, batch_size=4)
+    assert _labels(out) == [_fake_label(t) for t in TEXTS]
+    assert rate_limited_api.rate_limited > 0
+    assert waits == [pytest.approx(0.05)] * rate_limited_api.rate_limited
+    assert rate_limited_api.requests == rate_limited_api.rate_limited + (len(TEXTS) + 3) // 4
+
+
+# ---- 応答の突き合わせ・分割再送（モックの応答を途中で書き換える） ----
+@pytest.fixture
+def tamper(mock_api, monkeypatch):
+    """
+    モックサーバの応答の results を fn(送った本文のリスト, results) で書き換える。
+    fn が None を返したら応答を途中で切る。返却: 送ったバッチ（本文のリスト）の記録
+    """
+    sent = []
+
+    def install(fn):
+        orig = analyze._chat_completion
+
+        def call(*args, **kwargs):
+            resp = orig(*args, **kwargs)
+            messages = kwargs.get("messages") or args[0]
+            items = [x["text"] for x in json.loads(messages[-1]["content"])["inputs"]]
+            sent.append(items)
+            content = resp.choices[0].message.content
+            results = fn(items, json.loads(content)["results"])
+            resp.choices[0].message.content = (content[: len(content) // 2] if results is None
+                                               else json.dumps({"results": results}, ensure_ascii=False))
+            return resp
+
+        monkeypatch.setattr(analyze, "_chat_completion", call)
+        return sent
+
+    return install
+
+
+def test_results_are_aligned_by_id(tamper):
+    sent = tamper(lambda items, results: results[::-1])  # 順番が入れ替わっても id で合わせる
+    out = analyze._call_gpt_batch(TEXTS[:8])
+    assert _labels(out) == [_fake_label(t) for t in TEXTS[:8]]
+    assert len(sent) == 1
+
+
+def test_missing_ids_are_resent_alone(tamper):
+    sent = tamper(lambda items, results: results[:-2] if len(items) > 2 else results)
+    out = analyze._call_gpt_batch(TEXTS[:8])
+    assert _labels(out) == [_fake_label(t) for t in TEXTS[:8]]
+    assert sent == [TEXTS[:8], TEXTS[6:8]]
+
+
+def test_unreadable_reply_bisects_down_to_bad_item(tamper):
+    bad = TEXTS[5]
+    sent = tamper(lambda items, results: None if bad in items else results)
+    out = analyze._call_gpt_batch(TEXTS[:8])
+    want = [_fake_label(t) for t in TEXTS[:8]]
+    want[5] = {"sentiment": 0, "topic": "その他"}
+    assert _labels(out) == want
+    # 8 → 4+4 → 2+2 → 1+1 と分けて（深さ優先）、壊れた1件だけを 0/その他 にする
+    assert [len(b) for b in sent] == [8, 4, 4, 2, 1, 1, 2]
+    assert sent[-3:-1] == [[TEXTS[4]], [bad]]
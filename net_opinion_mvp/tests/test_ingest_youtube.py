@@ -0,0 +1,190 @@
+"""ingest_youtube.fetch_comments_incremental（差分取得・中断再開）のテスト。API は偽のページング"""
+import json
+
+import pandas as pd
+import pytest
+
+from ingest_youtube import fetch_comments_incremental
+
+
+class _Request:
+    def __init__(self, yt: "FakeYouTube", kind: str, key: str, offset: int):
+        self.yt, self.kind, self.key, self.offset = yt, kind, key, offset
+
+    def execute(self):
+        self.yt.calls.append((self.kind, self.key, self.offset))
+        if (self.kind, self.offset) in self.yt.fail_once:
+            self.yt.fail_once.discard((self.kind, self.offset))
+            raise ConnectionError("接続が切れました")
+        rows = self.yt.threads if self.kind == "threads" else self.yt.replies[self.key]
+        page = rows[self.offset:self.offset + self.yt.page_size]
+        if self.kind == "threads":
+            items = [{"id": c["id"], "snippet": {
+                "totalReplyCount": len(self.yt.replies.get(c["id"], [])),
+                "topLevelComment": {"id": c["id"], "snippet": _snippet(c)}}} for c in page]
+        else:
+            items = [{"id": c["id"], "snippet": _snippet(c)} for c in page]
+        res = {"items": items}
+        if self.offset + self.yt.page_size < len(rows):
+            res["nextPageToken"] = f"{self.kind}:{self.offset + self.yt.page_size}"
+        return res
+
+
+def _snippet(c):
+    return {"textDisplay": c.get("text", c["id"]), "likeCount": 0, "publishedAt": c["ts"]}
+
+
+class FakeYouTube:
+    """commentThreads() / comments() の list / list_next を持つ偽クライアント（新しい順、page_size 件ずつ）"""
+
+    def __init__(self, threads, replies=None, page_size: int = 3):
+        self.threads = sorted(threads, key=lambda c: c["ts"], reverse=True)
+        self.replies = replies or {}
+        self.page_size = page_size
+        self.calls = []
+        self.fail_once = set()
+
+    def post(self, *comments, first: bool = True):
+        """コメントを足す（first: 同じ時刻のコメントより前に並べる）"""
+        rows = list(comments) + self.threads if first else self.threads + list(comments)
+        self.threads = sorted(rows, key=lambda c: c["ts"], reverse=True)
+
+    def commentThreads(self):
+        return _Resource(self, "threads")
+
+    def comments(self):
+        return _Resource(self, "replies")
+
+    def pages(self, kind: str = "threads"):
+        return [c for c in self.calls if c[0] == kind]
+
+
+class _Resource:
+    def __init__(self, yt, kind):
+        self.yt, self.kind = yt, kind
+
+    def list(self, **params):
+        token = params.get("pageToken")
+        offset = int(token.split(":")[1]) if token else 0
+        return _Request(self.yt, self.kind, params.get("parentId", ""), offset)
+
+    def list_next(self, req, res):
+        token = res.get("nextPageToken")
+        return _Request(self.yt, req.kind, req.key, int(token.split(":")[1])) if token else None
+
+
+def _ts(i: int) -> str:
+    return f"2024-03-01T00:{i // 60:02d}:{i % 60:02d}Z"
+
+
+def _threads(n: int, start: int = 0):
+    return [{"id": f"t{i}", "ts": _ts(i)} for i in range(start, start + n)]
+
+
+def _fetch(yt, out, **kw):
+    return fetch_comments_incremental("vid", out, youtube=yt, sleep=0, chunk_size=kw.pop("chunk_size", 2), **kw)
+
+
+def _ids(out):
+    return pd.read_csv(out, encoding="utf-8-sig")["comment_id"].tolist()
+
+
+def _state(out):
+    with open(out + ".state.json", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_first_run_fetches_all_and_sets_watermark(tmp_path):
+    out = str(tmp_path / "c.csv")
+    yt = FakeYouTube(_threads(8))
+    assert _fetch(yt, out) == 8
+    assert _ids(out) == [f"t{i}" for i in range(7, -1, -1)]
+    st = _state(out)
+    assert st["watermark"] == _ts(7) and st["watermark_ids"] == ["t7"] and st["page_token"] is None
+
+
+def test_stops_at_watermark(tmp_path):
+    out = str(tmp_path / "c.csv")
+    yt = FakeYouTube(_threads(20))
+    _fetch(yt, out)
+    yt.calls.clear()
+    yt.post(*_threads(2, start=20))
+    assert _fetch(yt, out) == 2
+    assert _ids(out)[-2:] == ["t21", "t20"]
+    # 1ページ目（t21, t20, t19）の最後が取得済みの t19 なので、2ページ目の先頭（t18）で止まる（それより古いページは取らない）
+    assert len(yt.pages()) == 2
+    assert _state(out)["watermark"] == _ts(21)
+    yt.calls.clear()
+    assert _fetch(yt, out) == 0 and len(yt.pages()) == 1
+
+
+@pytest.mark.parametrize("new_first", [True, False])
+def test_watermark_ties_by_comment_id(tmp_path, new_first):
+    out = str(tmp_path / "c.csv")
+    yt = FakeYouTube(_threads(4))
+    _fetch(yt, out)
+    yt.post({"id": "same-second", "ts": _ts(3)}, first=new_first)  # watermark と同じ時刻の新しいコメント
+    assert _fetch(yt, out) == 1
+    assert _ids(out).count("t3") == 1 and _ids(out)[-1] == "same-second"
+    st = _state(out)
+    assert st["watermark"] == _ts(3) and st["watermark_ids"] == ["same-second", "t3"]
+    assert _fetch(yt, out) == 0
+
+
+def test_resumes_from_saved_page_token(tmp_path):
+    out = str(tmp_path / "c.csv")
+    yt = FakeYouTube(_threads(12))
+    yt.fail_once.add(("threads", 9))  # 4ページ目で落ちる
+    with pytest.raises(ConnectionError):
+        _fetch(yt, out, chunk_size=3)
+    assert _state(out)["page_token"] == "threads:9"
+    assert len(_ids(out)) == 9 and _state(out)["watermark"] == ""  # 取り切るまで watermark は進めない
+
+    yt.calls.clear()
+    assert _fetch(yt, out) == 3
+    assert yt.pages() == [("threads", "", 9)]  # 続きのページから取る
+    assert _ids(out) == [f"t{i}" for i in range(11, -1, -1)]
+    st = _state(out)
+    assert st["watermark"] == _ts(11) and st["page_token"] is None
+
+
+def test_max_pages_then_resume(tmp_path):
+    out = str(tmp_path / "c.csv")
+    yt = FakeYouTube(_threads(10))
+    assert _fetch(yt, out, max_pages=2) == 6
+    assert _state(out)["page_token"] == "threads:6"
+    assert _fetch(yt, out) == 4
+    assert sorted(_ids(out)) == sorted(f"t{i}" for i in range(10))
+
+
+def test_throttle_abort_keeps_page_for_next_run(tmp_path):
+    out = str(tmp_path / "c.csv")
+    yt = FakeYouTube(_threads(9))
+    budget = [2]
+
+    def throttle(cost):
+        budget[0] -= cost
+        return budget[0] >= 0
+
+    assert _fetch(yt, out, throttle=throttle) == 6
+    assert len(yt.pages()) == 2 and _state(out)["page_token"] == "threads:6"
+    assert _fetch(yt, out) == 3
+    assert _ids(out) == [f"t{i}" for i in range(8, -1, -1)]
+
+
+def test_throttle_abort_while_fetching_replies(tmp_path):
+    out = str(tmp_path / "c.csv")
+    replies = {"t4": [{"id": f"r{j}", "ts": _ts(100 + j)} for j in range(5)]}
+    yt = FakeYouTube(_threads(6), replies=replies)
+    budget = [2]  # 1ページ目（t5,t4,t3）+ t4 の返信1ページ目で尽きる
+
+    def throttle(cost):
+        budget[0] -= cost
+        return budget[0] >= 0
+
+    assert _fetch(yt, out, include_replies=True, throttle=throttle) == 0  # 返信が途中のページは書かない
+    assert _state(out)["page_token"] is None and _state(out)["watermark"] == ""
+    assert _fetch(yt, out, include_replies=True) == 6 + 5
+    df = pd.read_csv(out, encoding="utf-8-sig", keep_default_na=False)
+    assert df["comment_id"].tolist().count("t4") == 1
+    assert sorted(df.loc[df["parent_id"] == "t4", "comment_id"]) == [f"r{j}" for j in range(5)]
@@ -0,0 +1,59 @@
+"""store.py（Parquet ストア）のテスト"""
+import multiprocessing
+
+import pandas as pd
+
+import rollup
+from store import CommentStore
+
+TOPICS = ["政策", "外交", "経済", "その他"]
+
+
+def _frame(tag: str, n: int) -> pd.DataFrame:
+    return pd.DataFrame({
+        "comment_id": [f"{tag}-{i}" for i in range(n)], "video_id": [f"v{i % 3}" for i in range(n)],
+        "text": [f"{tag} のコメント {i}" for i in range(n)], "source": "youtube", "likes": range(n),
+        "published_at": [f"2024-03-0{1 + i % 4}T00:00:00Z" for i in range(n)],
+        "sentiment": [i % 3 - 1 for i in range(n)], "topic": [TOPICS[i % len(TOPICS)] for i in range(n)],
+    })
+
+
+def _writer(root: str, tag: str, rounds: int) -> None:
+    store = CommentStore(root)  # プロセスごとに別インスタンス
+    for r in range(rounds):
+        store.append_enriched(_frame(f"{tag}-{r}", 15))
+
+
+def _rollup(store: CommentStore) -> pd.DataFrame:
+    roll = store.read_rollup()
+    roll = roll.astype({c: str for c in roll.columns if isinstance(roll[c].dtype, pd.CategoricalDtype)})
+    return roll.sort_values(rollup.KEYS).reset_index(drop=True)
+
+
+def test_rollup_survives_concurrent_writers(tmp_path):
+    root = str(tmp_path / "store")
+    procs = [multiprocessing.Process(target=_writer, args=(root, f"p{k}", 6)) for k in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert all(p.exitcode == 0 for p in procs)
+
+    store = CommentStore(root)
+    assert len(store.read_enriched()) == 4 * 6 * 15
+    roll = _rollup(store)
+    assert roll["n"].sum() == 4 * 6 * 15
+    store.rebuild_rollup()
+    pd.testing.assert_frame_equal(roll, _rollup(store))
+
+
+def test_upsert_replaces_rows_in_rollup(tmp_path):
+    store = CommentStore(str(tmp_path / "store"))
+    df = _frame("a", 12)
+    store.upsert_enriched(df)
+    store.upsert_enriched(df.assign(sentiment=1, topic="外交"))
+    assert len(store.read_enriched()) == 12  # 後から書いた方を採用
+    roll = _rollup(store)
+    store.rebuild_rollup()
+    pd.testing.assert_frame_equal(roll, _rollup(store))
+    assert roll["n"].sum() == 12